@@ -0,0 +1,104 @@
+"asyncio variants of the cache operations, python 3 only"
+import asyncio
+import functools
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_async_executor(max_workers):
+    """
+    Returns the process wide pool of max_workers threads running the
+    blocking client calls of the async methods. Unlike sync_to_async, which
+    runs them one at a time on a single thread, the pool lets as many of them
+    wait on the cluster concurrently. A new pool is made after a fork, the
+    parent's threads do not exist in the child.
+    """
+    key = (os.getpid(), max_workers)
+    executor = _executors.get(key)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(key)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    thread_name_prefix="aerospike-cache-async")
+                _executors[key] = executor
+    return executor
+
+
+class AsyncCacheMixin(object):
+    """
+    Native async methods for AerospikeCache, replacing the sync_to_async based
+    defaults of django's BaseCache. The shared client is thread safe, so the
+    blocking operations run on a bounded pool of ASYNC_WORKERS threads.
+    """
+
+    def _run_async(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(
+            get_async_executor(self._opts.async_workers),
+            functools.partial(func, *args, **kwargs))
+
+    async def aget(self, key, default=None, version=None):
+        return await self._run_async(self.get, key, default, version)
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None,
+                   tags=None):
+        return await self._run_async(self.set, key, value, timeout, version,
+                                     tags)
+
+    async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT, version=None,
+                   tags=None):
+        return await self._run_async(self.add, key, value, timeout, version,
+                                     tags)
+
+    async def aget_or_set(self, key, default, timeout=DEFAULT_TIMEOUT,
+                          version=None):
+        return await self._run_async(self.get_or_set, key, default, timeout,
+                                     version)
+
+    async def atouch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return await self._run_async(self.touch, key, timeout, version)
+
+    async def adelete(self, key, version=None):
+        return await self._run_async(self.delete, key, version)
+
+    async def ahas_key(self, key, version=None):
+        return await self._run_async(self.has_key, key, version)
+
+    async def aget_many(self, keys, version=None):
+        return await self._run_async(self.get_many, keys, version)
+
+    async def aget_fields(self, key, fields, version=None):
+        return await self._run_async(self.get_fields, key, fields, version)
+
+    async def aget_many_fields(self, keys, fields, version=None):
+        return await self._run_async(self.get_many_fields, keys, fields,
+                                     version)
+
+    async def aupdate_fields(self, key, fields, version=None):
+        return await self._run_async(self.update_fields, key, fields, version)
+
+    async def aset_many(self, data, timeout=DEFAULT_TIMEOUT, version=None,
+                        tags=None):
+        return await self._run_async(self.set_many, data, timeout, version,
+                                     tags)
+
+    async def adelete_many(self, keys, version=None):
+        return await self._run_async(self.delete_many, keys, version)
+
+    async def aincr(self, key, delta=1, version=None):
+        return await self._run_async(self.incr, key, delta, version)
+
+    async def adecr(self, key, delta=1, version=None):
+        return await self._run_async(self.incr, key, -delta, version)
+
+    async def aincr_many(self, deltas, version=None):
+        return await self._run_async(self.incr_many, deltas, version)
@@ -0,0 +1,201 @@
+"Circuit breaker failing cache calls fast while the cluster is degraded"
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger('aerospike_cache')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling the cluster while the circuit is open.
+    """
+
+
+def get_breaker(name, **settings):
+    """
+    Returns the process wide circuit breaker registered under name, creating
+    it on first use, so all the backends sharing a client share its health.
+    """
+    with _registry_lock:
+        breaker = _registry.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(**settings)
+            _registry[name] = breaker
+        return breaker
+
+
+def log_state_change(old_state, new_state, breaker):
+    """
+    The default state change callback, logs to the 'aerospike_cache' logger.
+    """
+    if new_state == OPEN:
+        logger.warning("aerospike cache circuit opened (%s -> %s), failing "
+                       "fast for %ss", old_state, new_state,
+                       breaker.open_seconds)
+    else:
+        logger.info("aerospike cache circuit %s -> %s", old_state, new_state)
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the outcome of the last window calls. Calls that raise, or take
+    longer than slow_call_ms when set, count as failures. Once at least
+    min_calls were made and the failure rate reaches error_rate, the circuit
+    opens: calls are refused for open_seconds. It then half-opens, letting
+    through up to probes calls at a time. It closes again after probes of
+    them succeed in a row, and opens again on the first failure.
+
+    on_state_change(old_state, new_state, breaker) is called on each change.
+    """
+    def __init__(self, error_rate=0.5, min_calls=20, window=100,
+                 slow_call_ms=0, open_seconds=5, probes=3,
+                 on_state_change=log_state_change):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.slow_call = slow_call_ms / 1000.0
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.on_state_change = on_state_change
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._failures = 0
+        self._opened_at = 0
+        self._probing = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.opened = 0
+
+    def allow(self):
+        """
+        Tells whether a call may go to the cluster now.
+        """
+        if self.state == CLOSED:
+            return True
+        change = None
+        with self._lock:
+            if self.state == OPEN:
+                if time.time() < self._opened_at + self.open_seconds:
+                    self.rejected += 1
+                    return False
+                change = self._set_state(HALF_OPEN)
+                self._probing = 0
+                self._probe_successes = 0
+            allowed = self.state == CLOSED or self._probing < self.probes
+            if not allowed:
+                self.rejected += 1
+            elif self.state == HALF_OPEN:
+                self._probing += 1
+        self._notify(change)
+        return allowed
+
+    def record(self, success, duration):
+        """
+        Records the outcome of a call allowed through, which took duration
+        seconds.
+        """
+        if self.slow_call and duration > self.slow_call:
+            success = False
+        change = None
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = max(self._probing - 1, 0)
+                if not success:
+                    change = self._open()
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.probes:
+                        change = self._set_state(CLOSED)
+                        self._outcomes.clear()
+                        self._failures = 0
+            elif self.state == CLOSED:
+                outcomes = self._outcomes
+                if len(outcomes) == outcomes.maxlen and not outcomes[0]:
+                    self._failures -= 1
+                outcomes.append(success)
+                if not success:
+                    self._failures += 1
+                    if (len(outcomes) >= self.min_calls and
+                            self._failures >= self.error_rate * len(outcomes)):
+                        change = self._open()
+        self._notify(change)
+
+    def _open(self):
+        self._opened_at = time.time()
+        self.opened += 1
+        return self._set_state(OPEN)
+
+    def _set_state(self, state):
+        """
+        Changes the state, called with the lock held. Returns the change to
+        notify once the lock is released.
+        """
+        old_state, self.state = self.state, state
+        return old_state, state
+
+    def _notify(self, change):
+        if change is not None and self.on_state_change is not None:
+            try:
+                self.on_state_change(change[0], change[1], self)
+            except Exception:
+                logger.exception("aerospike cache circuit callback failed")
+
+    def stats(self):
+        """
+        Returns a snapshot of the breaker state and counters.
+        """
+        with self._lock:
+            return {
+                'state': self.state,
+                'calls': len(self._outcomes),
+                'failures': self._failures,
+                'rejected': self.rejected,
+                'opened': self.opened,
+            }
+
+
+class GuardedClient(object):
+    """
+    Wraps the shared aerospike client so each call goes through the breaker.
+    Exceptions in expected, e.g. a missing record, are answers from a healthy
+    cluster and count as successes.
+    """
+    def __init__(self, client, breaker, expected=()):
+        self._client = client
+        self._breaker = breaker
+        self._expected = expected
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        breaker = self._breaker
+        expected = self._expected
+
+        def call(*args, **kwargs):
+            if not breaker.allow():
+                raise CircuitOpenError("aerospike cache circuit is open")
+            start = time.time()
+            try:
+                result = attr(*args, **kwargs)
+            except expected:
+                breaker.record(True, time.time() - start)
+                raise
+            except Exception:
+                breaker.record(False, time.time() - start)
+                raise
+            breaker.record(True, time.time() - start)
+            return result
+
+        #built once per method
+        self.__dict__[name] = call
+        return call
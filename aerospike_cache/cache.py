@@ -1,14 +1,15 @@
 "Aerospike cache module"
 from __future__ import print_function
 import time, sys
+import threading
+import copy
+import math
+import random
+import functools
 
 import types # to check for function type for picking
 
-#pickling is taken care by the client library for all except function/class/tuple
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
+from django.core.cache.backends.base import InvalidCacheBackendError
 
 try:
     import aerospike
@@ -16,21 +17,96 @@ except ImportError:
     raise InvalidCacheBackendError(
         "Aerospike cache backend requires the 'aerospike' library")
 
+try:
+    from aerospike.exception import RecordNotFound, RecordExistsError
+except ImportError:
+    #older clients raise plain exceptions for missing/existing records
+    class RecordNotFound(Exception):
+        pass
+
+    class RecordExistsError(Exception):
+        pass
+
+try:
+    from aerospike.exception import RecordTooBig
+except ImportError:
+    class RecordTooBig(Exception):
+        pass
+
+try:
+    from aerospike.exception import RecordGenerationError
+except ImportError:
+    class RecordGenerationError(Exception):
+        pass
+
+try:
+    from aerospike_helpers.batch.records import (BatchRecords,
+                                                 Write as BatchWrite,
+                                                 Remove as BatchRemove)
+except ImportError:
+    #clients before 7.0 have no batch writes, chunks are put one by one
+    BatchRecords = BatchWrite = BatchRemove = None
+
+#deletes a record within operate(), needs server 4.7
+OPERATOR_DELETE = getattr(aerospike, 'OPERATOR_DELETE', None)
+
+#bulk writes/deletes are fanned out over a thread pool, needs the 'futures'
+#backport on python 2
+from concurrent.futures import as_completed, wait, FIRST_COMPLETED
+from itertools import chain, islice
+
 #from array import array #for unsupported data types
 import inspect
 
+from aerospike_cache.breaker import (CircuitOpenError, GuardedClient,
+                                     get_breaker)
+from aerospike_cache.chunks import (CHUNKS_BIN, split, new_manifest,
+                                    chunk_keys, join)
+from aerospike_cache.clients import get_client, clients_epoch
+from aerospike_cache.executors import get_executor, on_pool_thread
+from aerospike_cache.keys import Digest, KeyMemo
+from aerospike_cache.lazy import LazyBatch, lazy_value
+from aerospike_cache.metrics import MeteredCodec, get_metrics
+from aerospike_cache.options import CacheOptions, FIELDS_BIN
+from aerospike_cache.nearcache import get_near_cache, MISSING
+from aerospike_cache.refresh import get_refresher
+from aerospike_cache.singleflight import TIMED_OUT, get_flight_group
+from aerospike_cache.tags import TAGS_BIN, get_tag_versions
+from aerospike_cache.trace import get_recorder
+from aerospike_cache.writebehind import SET, DELETE, get_write_buffer
+
 from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+#native async methods need python 3
+if sys.version_info >= (3, 6):
+    from aerospike_cache.aio import AsyncCacheMixin
+else:
+    class AsyncCacheMixin(object):
+        pass
+
+
+#bin holding how long get_or_set took to compute the value, in ms
+RECOMPUTE_BIN = "recompute_ms"
+#bin holding when the value goes stale with STALE_TTL, in epoch seconds
+SOFT_EXPIRY_BIN = "soft_expiry"
+#bins that can not be dict fields in STRUCTURED mode, nor the value bin
+RESERVED_BINS = frozenset((RECOMPUTE_BIN, SOFT_EXPIRY_BIN, CHUNKS_BIN,
+                           FIELDS_BIN, TAGS_BIN))
+#longest bin name the server accepts
+MAX_BIN_NAME = 15
+
 try:
-    # Django 1.5+
-    from django.utils.encoding import smart_text, smart_bytes
-except ImportError:
-    # older Django, thus definitely Python 2
-    from django.utils.encoding import smart_unicode, smart_str
-    smart_text = smart_unicode
-    smart_bytes = smart_str
+    integer_types = (int, long)
+except NameError:
+    integer_types = (int,)
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    string_types = (str,)
 
 
-class AerospikeCache(BaseCache):
+class AerospikeCache(AsyncCacheMixin, BaseCache):
     def __init__(self, server, params):
         """
         set up cache backend.
@@ -46,39 +122,68 @@ class AerospikeCache(BaseCache):
         SET
         BIN
         TIMEOUT
+        and the tuning options documented on the properties below. They are
+        all resolved once, see CacheOptions.
         """
         BaseCache.__init__(self, params)
         self._server = server
         self._params = params
+        self._opts = CacheOptions(server, params)
+        #optional in-process near cache shared by the instances with the same
+        #location/namespace/set/bin and near cache settings
+        self._near_cache = None
+        opts = self._opts
+        self._tag_versions = get_tag_versions(
+            (tuple(opts.hosts), opts.namespace, opts.set, opts.tag_ttl),
+            opts.tag_ttl)
+        if opts.near_cache_size > 0:
+            self._near_cache = get_near_cache(
+                (tuple(opts.hosts), opts.namespace, opts.set, opts.bin,
+                 opts.near_cache_size, opts.near_cache_ttl),
+                opts.near_cache_size, opts.near_cache_ttl)
 
-        if ':' in self.server:
-            host, port = self.server.rsplit(':', 1)
-            try:
-                port = int(port)
-            except (ValueError, TypeError):
-                raise ImproperlyConfigured("port value must be an integer")
-        else:
-            host, port = None, None
-
-        config = {
-            "hosts": [
-                  ( host, port )
-              ],
-              "policies": {
-                  #aerospike timeout has no equivalent in django cache
-                  #"timeout": self.timeout # milliseconds
-              }
-          }
-
-        self._client = aerospike.client(config)
-
-        #community edition does not need username/password
-        if self.username is None and self.password is None:
-            self._client.connect()
-        #check for username/password for enterprise versions
-        else:
-            self._client.connect(self.username, self.password)
-
+        #the client is shared process wide and connected on first use
+        self._client_obj = None
+        self._client_epoch = None
+        self._metrics = None
+        if opts.metrics is not None:
+            self._metrics = get_metrics(
+                (tuple(opts.hosts), opts.namespace, opts.set), **opts.metrics)
+            self._metrics.instrument(self)
+            opts.codec = MeteredCodec(opts.codec, self._metrics)
+        #concurrent reads of a key share one request with COALESCE_READS
+        self._flights = None
+        if opts.coalesce_reads:
+            self._flights = get_flight_group(
+                (tuple(opts.hosts), opts.namespace, opts.set, opts.bin))
+        self._write_buffer = None
+        if opts.write_behind is not None:
+            self._write_buffer = get_write_buffer(
+                (tuple(opts.hosts), opts.namespace, opts.set, opts.bin),
+                **opts.write_behind)
+        self._recorder = None
+        if opts.trace is not None:
+            self._recorder = get_recorder(**opts.trace)
+            self._recorder.instrument(self)
+        self._breaker = None
+        if opts.breaker is not None:
+            self._breaker = get_breaker(
+                (tuple(opts.hosts), opts.username), **opts.breaker)
+        #refreshes of stale values for STALE_TTL, shared like the near cache
+        self._refresher = None
+        if opts.stale_ttl:
+            self._refresher = get_refresher(
+                (tuple(opts.hosts), opts.namespace, opts.set, opts.bin),
+                opts.refresh_workers, opts.refresh_max_pending)
+        #memo of the keys built by make_key, optional
+        self._key_memo = None
+        if opts.key_memo_size > 0:
+            self._key_memo = KeyMemo(opts.key_memo_size)
+        #gets deferred by each thread, see defer()
+        self._lazy_local = threading.local()
+        #clear generation for CLEAR_MODE 'generation', read on first use
+        self._generation = None
+        self._generation_expires = 0
 
     #for pickling, not needed as pickling is handled by the client library
     def __getstate__(self):
@@ -87,33 +192,125 @@ class AerospikeCache(BaseCache):
     def __setstate__(self, state):
         self._init(**state)
 
+    @property
+    def _client(self):
+        """
+        The connected aerospike client, shared with the other backends of this
+        process using the same hosts and credentials. A new one is looked up
+        after a fork.
+        """
+        if self._client_epoch != clients_epoch():
+            breaker = self._breaker
+            if breaker is None:
+                client = get_client(self._opts.client_config,
+                                    self._opts.username, self._opts.password)
+            else:
+                #connecting goes through the breaker like the calls
+                if not breaker.allow():
+                    raise CircuitOpenError("aerospike cache circuit is open")
+                started = time.time()
+                try:
+                    client = get_client(self._opts.client_config,
+                                        self._opts.username,
+                                        self._opts.password)
+                except Exception:
+                    breaker.record(False, time.time() - started)
+                    raise
+                breaker.record(True, 0)
+                #missing or existing records are healthy answers
+                client = GuardedClient(
+                    client, breaker,
+                    (RecordNotFound, RecordExistsError, RecordTooBig))
+            self._client_obj = client
+            self._client_epoch = clients_epoch()
+        return self._client_obj
+
+    @property
+    def metrics(self):
+        """
+        The metrics shared by the backends of this process using the same
+        hosts, namespace and set, None without the METRICS option.
+        """
+        return self._metrics
+
+    def stats(self):
+        """
+        Returns a snapshot of the operation metrics, with METRICS, and of the
+        near cache, refresher, circuit breaker, write-behind buffer, read
+        coalescing and trace counters, when enabled.
+        """
+        stats = {}
+        for name, source in (('metrics', self._metrics),
+                             ('near_cache', self._near_cache),
+                             ('refresher', self._refresher),
+                             ('breaker', self._breaker),
+                             ('write_behind', self._write_buffer),
+                             ('coalescing', self._flights),
+                             ('trace', self._recorder)):
+            if source is not None:
+                stats[name] = source.stats()
+        return stats
+
+    def _report_error(self, error):
+        """
+        Reports an error which the operation does not raise.
+        """
+        print("error: {0}".format(error), file=sys.stderr)
+        if self._metrics is not None:
+            self._metrics.error()
+
+    @property
+    def breaker(self):
+        """
+        The circuit breaker shared by the backends using the same hosts, None
+        without the CIRCUIT_BREAKER option.
+        """
+        return self._breaker
+
+    @property
+    def _config(self):
+        """
+        The aerospike client config, with the seed hosts and the compiled
+        client wide policies.
+        """
+        return self._opts.client_config
+
     @property
     def server(self):
         """
         the server:port combination for aerospike server
         """
-        return self._server or "127.0.0.1:3000"
+        return self._opts.server
+
+    @property
+    def hosts(self):
+        """
+        The list of (host, port) seed nodes. LOCATION is either a list of
+        host:port strings or a single string of them separated by ',' or ';'.
+        The port defaults to 3000.
+        """
+        return self._opts.hosts
 
     @property
     def password(self):
         """
         user's password
         """
-        return self.params.get('password', self.options.get('PASSWORD', None))
+        return self._opts.password
 
     @property
     def username(self):
         """
         user's username
         """
-        return self.params.get('username', self.options.get('USERNAME', None))
+        return self._opts.username
 
     @property
     def params(self):
         """
         configuration params
         """
-        return self._params or {}
+        return self._opts.params
 
     @property
     def timeout(self):
@@ -122,7 +319,7 @@ class AerospikeCache(BaseCache):
         to ttl in aerospike meta data for records. so TTL (Aerospike) == TIMEOUT (django).
         The default value changed to 10 s == 10000 ms
         """
-        return self.params.get('TIMEOUT', 10000)
+        return self._opts.ttl
 
     @property
     def options(self):
@@ -135,139 +332,966 @@ class AerospikeCache(BaseCache):
         TIMEOUT - the time at which the value gets expired, for aerospike its
         the ttl value
         """
-        return self.params.get('OPTIONS', {
-                'HOST': "127.0.0.1",
-                'PORT': 3000,
-                'NAMESPACE': "test",
-                'SET': "cache",
-                'BIN': "entry",
-                'TIMEOUT': 10000,
-            })
+        return self._opts.options
 
     @property
-    def meta(self):
+    def concurrency(self):
         """
-        The meta data for the record. For now only setting the ttl value.
+        The number of worker threads used to issue set_many/delete_many
+        requests concurrently. Defaults to 8.
+        """
+        return self._opts.concurrency
+
+    @property
+    def batch_size(self):
+        """
+        The largest number of keys fetched by a single batch request,
+        bigger get_many/iter_many lookups are split up. Defaults to 1000.
+        """
+        return self._opts.batch_size
+
+    @property
+    def near_cache_size(self):
+        """
+        The number of entries kept in the in-process near cache, 0 (the
+        default) disables it.
+        """
+        return self._opts.near_cache_size
+
+    @property
+    def near_cache_ttl(self):
+        """
+        The number of seconds a near cache entry is served without asking the
+        server. Defaults to 1 s.
+        """
+        return self._opts.near_cache_ttl
+
+    @property
+    def near_cache_validate(self):
+        """
+        Whether an expired near cache entry is kept when the record
+        generation on the server has not changed. This costs a metadata only
+        round trip instead of a full read. Defaults to False.
         """
-        meta = {
-            'ttl': 10000
-        }
-        return meta
+        return self._opts.near_cache_validate
 
-    @meta.setter
-    def meta(self, value):
+    @property
+    def near_cache(self):
+        """
+        The in-process near cache, None if it is disabled.
+        """
+        return self._near_cache
+
+    @property
+    def refresher(self):
+        """
+        The background refresher of stale values, None without STALE_TTL.
+        """
+        return self._refresher
+
+    @property
+    def executor(self):
+        """
+        The worker pool used for the bulk operations, shared process wide by
+        the backends with the same CONCURRENCY and created lazily.
+        """
+        return get_executor(self._opts.concurrency)
+
+    @property
+    def meta(self):
         """
-        The setter for the meta property
+        The meta data for the record. For now only setting the ttl value.
         """
-        self.meta = value
+        return self._opts.meta
 
     @property
     def policy(self):
         """
         The policy for the record. For now default is to to send the digest.
+        Built once, the timeouts/retries/replica/commit level are client wide
+        defaults, see CacheOptions.
         """
-        policy = {
-            'key': aerospike.POLICY_KEY_DIGEST
-        } # store the key along with the record
-        return policy
+        return self._opts.policy
 
     @property
     def aero_namespace(self):
         """
         The configured aerospike namespace to hold the cache.
         """
-        return self.params.get('NAMESPACE', self.options.get('NAMESPACE', "test"))
+        return self._opts.namespace
 
     @property
     def aero_set(self):
         """
         The configured aerospike set to hold the cache.
         """
-        return self.params.get('SET', self.options.get('SET', "cache"))
+        return self._opts.set
 
     @property
     def aero_bin(self):
         """
         The configured aerospike bin to hold the cache.
         """
-        return self.params.get('BIN', self.options.get('BIN', "entry"))
+        return self._opts.bin
 
     def make_key(self, key, version=None):
         """
-        Constructs the aerospike key from given user key
+        Constructs the aerospike key from given user key. Like the other
+        django backends the key is built by KEY_FUNCTION from KEY_PREFIX, the
+        version (VERSION by default) and the user key. With DIGEST_KEYS the
+        aerospike key only carries the digest of that key.
         """
-        ret_key = (self.aero_namespace, self.aero_set, key)
-        return ret_key
+        opts = self._opts
+        generation = None
+        if opts.clear_mode == 'generation':
+            generation = self._current_generation()
+
+        memo = self._key_memo
+        if memo is not None:
+            memo_key = (key, version, generation)
+            aero_key = memo.get(memo_key)
+            if aero_key is not None:
+                return aero_key
+
+        user_key = BaseCache.make_key(self, key, version=version)
+        if generation is not None:
+            user_key = "%s:%s" % (generation, user_key)
+        if opts.digest_keys:
+            aero_key = opts.key_prefix + (None, Digest(aerospike.calc_digest(
+                opts.namespace, opts.set, user_key)))
+        else:
+            aero_key = opts.key_prefix + (user_key,)
 
-    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if memo is not None:
+            memo.set(memo_key, aero_key)
+        return aero_key
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None,
+            tags=None):
         """
         Set a value in the cache if the key does not already exist. If
         timeout is given, that timeout will be used for the key; otherwise
-        the default cache timeout will be used.
+        the default cache timeout will be used. See set for tags.
 
         Returns True if the value was stored, False otherwise.
         """
+        aero_key = self._settle(self.make_key(key, version=version))
+        #the create only policy makes the put fail if the record exists
+        try:
+            return self._put(key, value, timeout, version,
+                             self._opts.create_policy, tags=tags)
+        except RecordExistsError:
+            pass
+        except CircuitOpenError:
+            return False
+        #an entry get does not serve, of an invalidated tag or stale, counts
+        #as missing: it is replaced unless it changed since checked
+        try:
+            found = self._check_entry(aero_key)
+            if found is None or found[1]:
+                return False
+            return self._put(key, value, timeout, version,
+                             self._opts.gen_replace_policy, tags=tags,
+                             generation=found[0])
+        except (RecordNotFound, RecordGenerationError, CircuitOpenError):
+            return False
+
+    def _put(self, key, value, timeout, version, policy, bins=None,
+             tags=None, generation=None, tag_versions=None):
+        """
+        Writes value, and the optional extra bins and tag versions, to the
+        record for key. The versions of tags are read unless given as
+        tag_versions. generation goes with a policy checking it.
+        """
         aero_key = self.make_key(key, version=version)
+        opts = self._opts
 
-        # the pickling is taken care by the client library, it detects data types
-        # as integer or string or list or map or objects as blobs
-        # but for function/class/tuple it has to manually convert to blob
-        #http://stackoverflow.com/a/624948/119031 to check for function type
-        #TODO - use bytearray(function/class/tuple) to serialize unsupported data types
-        value_type = type(value)
-        if not isinstance(value, (int, str, list, dict)):
-            pickle_value = pickle.dumps(value)
-            #now store it as an array
-            #value = array('B', pickle_value).tostring()
-            #aerospike python library does not recognize array so use bytearray
-            value = bytearray( pickle_value)
-
-
-        meta = {}
-        #check if its int or long else use default
-        if isinstance(timeout, (int , long)):
-            meta['ttl'] = timeout
+        fields = self._field_bins(value) if opts.structured else None
+        if opts.structured and policy is opts.policy:
+            #the field bins of a previous dict value are dropped
+            policy = opts.replace_policy
+        if fields is not None:
+            #one bin per field
+            record = fields
         else:
-            meta['ttl'] = self.timeout
+            # the client library stores integer or string or list or map
+            # natively, everything else is serialized (and maybe compressed)
+            # into a blob
+            original, value = value, opts.codec.encode(value)
 
-        #compose the value for the cache key
-        record = {self.aero_bin: value}
-        ret = self._client.put(aero_key, record, meta, self.policy)
+            #compose the value for the cache key
+            record = {opts.bin: value}
+            if opts.structured:
+                #no longer a structured entry
+                record[FIELDS_BIN] = aerospike.null()
+
+        if tags:
+            tag_versions = self._get_tag_versions(tags)
+        if tag_versions:
+            record[TAGS_BIN] = tag_versions
+        elif fields is None:
+            #no longer tagged
+            record[TAGS_BIN] = aerospike.null()
+
+        ttl = self._ttl(timeout)
+        meta = opts.meta if ttl == opts.ttl else {'ttl': ttl}
+        if bins:
+            record.update(bins)
+        if opts.stale_ttl and ttl > 0:
+            #the value goes stale after ttl, the record lives STALE_TTL longer
+            record[SOFT_EXPIRY_BIN] = int(time.time()) + ttl
+            meta = {'ttl': ttl + opts.stale_ttl}
+        if generation is not None:
+            meta = dict(meta, gen=generation)
+        #the chunks of the value replaced are removed once it is
+        if opts.chunk_size and fields is None:
+            data = self._chunk_data(value)
+            if data is not None:
+                ret, replaced = self._put_chunked(aero_key, data, record, meta,
+                                                  policy)
+            else:
+                try:
+                    #drop the manifest of an earlier chunked value
+                    record[CHUNKS_BIN] = aerospike.null()
+                    ret, replaced = self._put_record(aero_key, record, meta,
+                                                     policy)
+                except RecordTooBig:
+                    #a native list or dict too large for one record
+                    ret, replaced = self._put_chunked(
+                        aero_key, opts.codec.dumps(original), record, meta,
+                        policy)
+        else:
+            ret, replaced = self._put_record(aero_key, record, meta, policy)
+        if self._near_cache is not None:
+            self._near_cache.delete(aero_key)
+        self._detach_flight(aero_key)
 
         if ret == 0:
+            if replaced is not None:
+                self._remove_chunks(replaced)
             return True
         return False
 
+    def _is_field(self, field):
+        """
+        Whether field can be stored as a bin of a structured entry.
+        """
+        return (isinstance(field, string_types)
+                and 0 < len(field) <= MAX_BIN_NAME
+                and field != self._opts.bin and field not in RESERVED_BINS)
+
+    def _field_bins(self, value):
+        """
+        Returns the bins storing the dict value one field per bin, None if
+        value is not a dict or one of its keys can not be a bin name.
+        """
+        if not isinstance(value, dict) or not value:
+            return None
+        encode = self._opts.codec.encode
+        record = {FIELDS_BIN: 1}
+        for field, field_value in value.items():
+            if not self._is_field(field):
+                return None
+            record[field] = encode(field_value)
+        return record
+
+    def _fields_value(self, record):
+        """
+        Returns the dict stored in the bins of a structured entry.
+        """
+        decode = self._opts.codec.decode
+        value_bin = self._opts.bin
+        return dict((field, decode(field_value))
+                    for field, field_value in record.items()
+                    if field != value_bin and field not in RESERVED_BINS
+                    and field_value is not None)
+
+    def _chunk_data(self, value):
+        """
+        Returns the blob to split into chunks if the bin value is larger than
+        CHUNK_SIZE, None if it fits in one record. Lists and dicts are not
+        measured, they are chunked when the server finds them too big.
+        """
+        size = self._opts.chunk_size
+        if isinstance(value, bytearray):
+            if len(value) > size:
+                return value
+        elif isinstance(value, str) and len(value) > size:
+            return self._opts.codec.dumps(value)
+        return None
+
+    def _put_chunked(self, aero_key, data, record, meta, policy):
+        """
+        Writes the chunks of the blob data in a batch, then the manifest
+        listing them in place of the value, all with the same ttl. Returns the
+        put status, -1 if a chunk could not be written, and the manifest of
+        the value replaced like _put_record. The chunks are removed if the
+        manifest is not written, e.g. by an add of an existing key.
+        """
+        opts = self._opts
+        if len(data) <= opts.chunk_size:
+            #small enough once serialized (and compressed)
+            record[opts.bin] = data
+            record[CHUNKS_BIN] = aerospike.null()
+            return self._put_record(aero_key, record, meta, policy)
+        parts = split(data, opts.chunk_size)
+        manifest = new_manifest(len(parts), len(data))
+        ret, replaced = -1, None
+        try:
+            if self._write_chunks(chunk_keys(opts.key_prefix, manifest),
+                                  parts, meta):
+                record[opts.bin] = aerospike.null()
+                record[CHUNKS_BIN] = manifest
+                ret, replaced = self._put_record(aero_key, record, meta,
+                                                 policy)
+        finally:
+            if ret != 0:
+                self._remove_chunks(manifest)
+        return ret, replaced
+
+    def _put_record(self, aero_key, record, meta, policy):
+        """
+        Puts the bins of record. With CHUNK_SIZE the manifest of the value
+        replaced, if any, is read back by the same operate() call, but for a
+        create, which replaces nothing, and a replace, which the server does
+        not take along with a read. Returns the put status and that manifest,
+        None if there is none.
+        """
+        opts = self._opts
+        client = self._client
+        if not opts.chunk_size or policy is opts.create_policy:
+            return client.put(aero_key, record, meta, policy), None
+        if policy.get('exists') in (aerospike.POLICY_EXISTS_REPLACE,
+                                    aerospike.POLICY_EXISTS_CREATE_OR_REPLACE):
+            replaced = self._manifest(aero_key)
+            return client.put(aero_key, record, meta, policy), replaced
+        #the read comes first, it sees the bins before the writes
+        ops = [{'op': aerospike.OPERATOR_READ, 'bin': CHUNKS_BIN}]
+        ops.extend({'op': aerospike.OPERATOR_WRITE, 'bin': name, 'val': value}
+                   for name, value in record.items())
+        (key, metadata, bins) = client.operate(aero_key, ops, meta, policy)
+        return 0, (bins or {}).get(CHUNKS_BIN) or None
+
+    def _write_chunks(self, keys, parts, meta):
+        """
+        Writes each part to the record of the matching key, in one batch
+        request where the client supports it, otherwise concurrently over
+        the worker pool. Returns True if all of them were written.
+        """
+        client = self._client
+        opts = self._opts
+        if BatchWrite is not None and hasattr(client, 'batch_write'):
+            records = client.batch_write(BatchRecords([
+                BatchWrite(key, [{'op': aerospike.OPERATOR_WRITE,
+                                  'bin': opts.bin, 'val': part}],
+                           meta=meta, policy=opts.policy)
+                for key, part in zip(keys, parts)]))
+            return all(batch_record.result == 0
+                       for batch_record in records.batch_records)
+        failed = self._run_many(
+            lambda index: client.put(keys[index], {opts.bin: parts[index]},
+                                     meta, opts.policy) == 0,
+            range(len(keys)))
+        return not failed
+
+    def _manifest(self, aero_key):
+        """
+        Returns the manifest of the chunked value stored at aero_key, None if
+        there is none.
+        """
+        try:
+            (key, metadata, record) = self._client.select(
+                aero_key, [CHUNKS_BIN], self._opts.policy)
+        except RecordNotFound:
+            return None
+        if not record:
+            return None
+        return record.get(CHUNKS_BIN) or None
+
+    def _remove_chunks(self, manifest):
+        """
+        Removes the chunks listed by manifest, in one batch request where the
+        client supports it, otherwise one by one. Not over the worker pool,
+        delete_many runs on it.
+        """
+        client = self._client
+        keys = chunk_keys(self._opts.key_prefix, manifest)
+        if BatchRemove is not None and hasattr(client, 'batch_write'):
+            client.batch_write(BatchRecords([BatchRemove(key) for key in keys]))
+            return
+        for key in keys:
+            self._remove_record(key)
+
+    def _read_chunks(self, manifests, touch=None):
+        """
+        Reads the chunks listed by the manifests with one batch request and
+        returns the reassembled blobs, None for those missing a chunk. With
+        touch, the (ops, meta) of _touch_ops, the chunks are read and touched
+        in the same request.
+        """
+        opts = self._opts
+        keys = []
+        for manifest in manifests:
+            keys.extend(chunk_keys(opts.key_prefix, manifest))
+        if touch is not None and hasattr(self._client, 'batch_operate'):
+            ops, meta = touch
+            records = [batch_record.record if batch_record.result == 0 else None
+                       for batch_record in self._client.batch_operate(
+                           keys, ops + opts.chunk_read_ops, None,
+                           opts.update_policy, meta['ttl']).batch_records]
+        else:
+            records = self._get_records(keys)
+
+        blobs = []
+        position = 0
+        for manifest in manifests:
+            end = position + manifest[1]
+            blobs.append(join([record[2].get(opts.bin)
+                               if record is not None and record[2] else None
+                               for record in records[position:end]],
+                              manifest[2]))
+            position = end
+        return blobs
+
+    def _touch_chunks(self, manifests, ops, meta):
+        """
+        Resets the expiration of the chunks listed by the manifests along
+        with that of their manifest record.
+        """
+        opts = self._opts
+        keys = []
+        for manifest in manifests:
+            keys.extend(chunk_keys(opts.key_prefix, manifest))
+        if hasattr(self._client, 'batch_operate'):
+            self._client.batch_operate(keys, ops, None, opts.update_policy,
+                                       meta['ttl'])
+        else:
+            self._run_many(lambda aero_key: self._client.operate(
+                aero_key, ops, meta, opts.update_policy), keys)
+
+    def _settle(self, aero_key):
+        """
+        Sends the write of aero_key buffered with WRITE_BEHIND, if any, before
+        an operation working on the record itself. Returns aero_key.
+        """
+        if self._write_buffer is not None:
+            self._write_buffer.settle(aero_key)
+        batch = self._deferred_batch()
+        if batch:
+            batch.forget(aero_key)
+        return aero_key
+
+    def flush_writes(self):
+        """
+        Sends all the writes buffered with WRITE_BEHIND now. The buffer is
+        shared by the backends of the process using the same set.
+        """
+        if self._write_buffer is not None:
+            self._write_buffer.flush()
+
+    def _ttl(self, timeout):
+        """
+        The record ttl for a django timeout: the timeout if it is an int or
+        long, the default TIMEOUT otherwise.
+        """
+        if timeout is not DEFAULT_TIMEOUT and isinstance(timeout, integer_types):
+            return timeout
+        return self._opts.ttl
+
+    def _expiry_ops(self, timeout):
+        """
+        The operate() operations, and meta, giving a record written by them
+        the expiration (and soft expiry with STALE_TTL) of a value set now.
+        """
+        opts = self._opts
+        ttl = self._ttl(timeout)
+        ops = []
+        if opts.stale_ttl and ttl > 0:
+            ops.append({'op': aerospike.OPERATOR_WRITE, 'bin': SOFT_EXPIRY_BIN,
+                        'val': int(time.time()) + ttl})
+            ttl += opts.stale_ttl
+        return ops, {'ttl': ttl}
+
+    def _touch_ops(self, timeout):
+        """
+        The operate() operations, and meta, resetting the ttl of a record
+        (and its soft expiry with STALE_TTL) as for a value set now.
+        """
+        ops, meta = self._expiry_ops(timeout)
+        ops.append({'op': aerospike.OPERATOR_TOUCH, 'val': meta['ttl']})
+        return ops, meta
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Update the expiration of key to timeout from now, without sending
+        the value again. Returns True if the key was touched, False if it
+        does not exist.
+        """
+        aero_key = self._settle(self.make_key(key, version=version))
+        opts = self._opts
+        ops, meta = self._touch_ops(timeout)
+        if self._near_cache is not None:
+            self._near_cache.delete(aero_key)
+        try:
+            if opts.chunk_size:
+                (key, metadata, record) = self._client.operate(
+                    aero_key, ops + opts.read_ops, meta, opts.update_policy)
+                if record and record.get(CHUNKS_BIN):
+                    self._touch_chunks([record[CHUNKS_BIN]], ops, meta)
+            else:
+                self._client.operate(aero_key, ops, meta, opts.update_policy)
+        except (RecordNotFound, CircuitOpenError):
+            return False
+        return True
+
+    def touch_many(self, keys, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Update the expiration of a bunch of keys to timeout from now, with
+        batch requests where the client supports it, otherwise concurrently
+        over the worker pool.
+
+        Returns a list of keys that were not touched, e.g. because they do not
+        exist, all of them while the circuit breaker is open.
+        """
+        keys = list(keys)
+        if not hasattr(self._client, 'batch_operate'):
+            return self._run_many(
+                lambda key: self.touch(key, timeout, version), keys)
+
+        opts = self._opts
+        ops, meta = self._touch_ops(timeout)
+        #read back the manifests of chunked values to touch their chunks
+        record_ops = ops + opts.read_ops if opts.chunk_size else ops
+        failed = []
+        for start in range(0, len(keys), opts.batch_size):
+            batch = keys[start:start + opts.batch_size]
+            new_keys = [self._settle(self.make_key(key, version))
+                        for key in batch]
+            if self._near_cache is not None:
+                for aero_key in new_keys:
+                    self._near_cache.delete(aero_key)
+            try:
+                records = self._client.batch_operate(
+                    new_keys, record_ops, None, opts.update_policy,
+                    meta['ttl'])
+            except CircuitOpenError:
+                failed.extend(batch)
+                continue
+            manifests = []
+            for key, batch_record in zip(batch, records.batch_records):
+                if batch_record.result != 0:
+                    failed.append(key)
+                elif opts.chunk_size and batch_record.record[2].get(CHUNKS_BIN):
+                    manifests.append(batch_record.record[2][CHUNKS_BIN])
+            if manifests:
+                try:
+                    self._touch_chunks(manifests, ops, meta)
+                except CircuitOpenError:
+                    #the chunks then expire first, the values as misses
+                    pass
+        return failed
+
     def get(self, key, default=None, version=None):
         """
         Fetch a given key from the cache. If the key does not exist, return
         default, which itself defaults to None.
         """
         aero_key = self.make_key(key, version=version)
+        if self._write_buffer is not None:
+            pending = self._write_buffer.lookup(aero_key)
+            if pending is not None:
+                return pending[1] if pending[0] == SET else default
+        batch = self._deferred_batch()
+        if batch:
+            batch.include([(aero_key, key)], version)
+            value = batch.take(aero_key)
+            if value is not None:
+                return default if value is MISSING else value
 
+        opts = self._opts
+        near_cache = self._near_cache
+        if near_cache is not None:
+            validate = None
+            if opts.near_cache_validate:
+                validate = lambda generation: self._is_current(aero_key,
+                                                               generation)
+            value = near_cache.get(aero_key, validate)
+            if value is not MISSING:
+                return self._near_value(value)
+
+        if self._flights is not None:
+            value = self._coalesced_read(aero_key)
+        else:
+            value = self._read(aero_key)
+            if value is not MISSING:
+                value = self.unpickle(value)
+        if value is MISSING:
+            return default
+        return value
+
+    def _read(self, aero_key):
+        """
+        Reads the entry of aero_key from the server and returns its raw value,
+        MISSING if it is not found. Errors are reported, not raised.
+        """
+        opts = self._opts
         try:
-            (key, metadata, record) = self._client.get(aero_key,self.policy)
+            touch = None
+            if opts.sliding_expiration:
+                #read and push the expiration back in the same round trip
+                touch = self._touch_ops(DEFAULT_TIMEOUT)
+                ops, meta = touch
+                (key, metadata, record) = self._client.operate(
+                    aero_key, ops + opts.read_ops, meta, opts.update_policy)
+            else:
+                (key, metadata, record) = self._client.get(aero_key, opts.policy)
             if record is None:
+                return MISSING
+            if not self._servable(aero_key, record):
+                return MISSING
+            value = self._record_value(aero_key, record, touch)
+            if value is not MISSING and self._near_cache is not None:
+                self._near_set(aero_key, value, metadata, record)
+            return value
+        except (RecordNotFound, CircuitOpenError):
+            #a miss, or the cluster is not asked while degraded
+            pass
+        except Exception as e:
+            self._report_error(e)
+        return MISSING
+
+    def _coalesced_read(self, aero_key):
+        """
+        Like _read but returns the decoded value, with COALESCE_READS: the
+        concurrent reads of aero_key share the request of the first one.
+        """
+        flights = self._flights
+        flight, leader = flights.join(aero_key)
+        if not leader:
+            value = flights.wait(flight, self._opts.coalesce_wait)
+            if value is not TIMED_OUT:
+                return self._decoded(value, True)
+            #the leader is too slow, read on our own
+            return self._decoded(self._read(aero_key), False)
+        value = MISSING
+        try:
+            value = self._read(aero_key)
+        finally:
+            waiters = flights.land(aero_key, flight, value)
+        return self._decoded(value, waiters > 0)
+
+    def _decoded(self, value, shared):
+        """
+        Decodes a raw value read from the server, copying native lists and
+        dicts if other callers got the same value.
+        """
+        if value is MISSING:
+            return MISSING
+        if shared:
+            return self._near_value(value)
+        return self.unpickle(value)
+
+    def _record_value(self, aero_key, record, touch=None):
+        """
+        Returns the raw value of an entry read back in record: the value bin,
+        the blob put back together from its chunks or the dict of its fields.
+        MISSING if a chunk is missing. touch is the (ops, meta) with which the
+        record was read in sliding expiration mode.
+        """
+        opts = self._opts
+        if opts.chunk_size and record.get(CHUNKS_BIN):
+            value = self._read_chunks([record[CHUNKS_BIN]], touch)[0]
+            if value is None:
+                return MISSING
+            return value
+        if opts.structured and record.get(FIELDS_BIN):
+            if touch is not None:
+                #the operate() reading the record only read the marker bin
+                record = self._client.get(aero_key, opts.policy)[2]
+            return self._fields_value(record)
+        return record[opts.bin]
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None,
+            tags=None):
+        """
+        Set a value in the cache. It is similar to add, but overwrites an
+        existing value. The value is no longer found once one of its tags, if
+        any, is passed to invalidate_tags.
+
+        With WRITE_BEHIND the value is buffered and written in the background
+        unless the buffer is full, it must not be changed in the meantime.
+        Returns False if the value could not be stored, e.g. while the
+        circuit breaker is open.
+        """
+        aero_key = self.make_key(key, version=version)
+        batch = self._deferred_batch()
+        if batch:
+            batch.forget(aero_key)
+        try:
+            if self._write_buffer is not None:
+                #the tag versions of now, not of when the write is sent
+                tag_versions = self._get_tag_versions(tags) if tags else None
+                if self._write_buffer.enqueue(
+                        aero_key, SET, value,
+                        lambda: self._put(key, value, timeout, version,
+                                          self._opts.policy,
+                                          tag_versions=tag_versions)):
+                    return True
+            return self._put(key, value, timeout, version, self._opts.policy,
+                             tags=tags)
+        except CircuitOpenError:
+            return False
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Fetch a given key from the cache. If the key does not exist, add it
+        with the value of default, which is called first if it is callable.
+        Returns the value in the cache.
+
+        A callable default is only called by one worker at a time: the one
+        that creates a short lived lock record. The others wait up to
+        STAMPEDE_WAIT seconds for its value, then compute it themselves.
+        Before the value expires, a worker may refresh it early, more likely
+        as the remaining ttl gets close to the time the last computation
+        took (scaled by STAMPEDE_BETA). Meanwhile the others keep getting the
+        current value.
+        """
+        opts = self._opts
+        if not callable(default):
+            #a hit costs one read, the create only add settles races
+            value = self.get(key, MISSING, version)
+            if value is not MISSING:
+                return value
+            if self.add(key, default, timeout, version):
                 return default
-            value = record[self.aero_bin]
-            unpickled_value = self.unpickle(value)
+            return self.get(key, default, version)
+
+        aero_key = self._settle(self.make_key(key, version=version))
+        if self._near_cache is not None:
+            value = self._near_cache.get(aero_key)
+            if value is not MISSING:
+                return self._near_value(value)
+
+        lock_key = self.make_key("%s:lock" % (key,), version=version)
+        value = MISSING
+        found = self._read_record(aero_key)
+        if found is not None:
+            metadata, record = found
+            if (not record.get(TAGS_BIN)
+                    or self._tags_current([record[TAGS_BIN]])[0]):
+                value = self._record_value(aero_key, record)
+        if value is not MISSING:
+            value = self.unpickle(value)
+            if opts.stale_ttl:
+                soft_expiry = record.get(SOFT_EXPIRY_BIN)
+                if soft_expiry is not None and soft_expiry <= time.time():
+                    #serve the stale value, refresh it in the background
+                    self._refresher.refresh(aero_key, functools.partial(
+                        self._refresh_value, key, default, timeout, version))
+                    return value
+            if not self._refresh_early(metadata, record.get(RECOMPUTE_BIN)):
+                return value
+            if not self._acquire_lock(lock_key):
+                #somebody else is refreshing it already
+                return value
+            return self._recompute(key, default, timeout, version, lock_key)
+
+        if self._acquire_lock(lock_key):
+            return self._recompute(key, default, timeout, version, lock_key)
+
+        #somebody else is computing it, wait for the value
+        deadline = time.time() + opts.stampede_wait
+        while time.time() < deadline:
+            time.sleep(opts.stampede_poll)
+            value = self.get(key, MISSING, version)
+            if value is not MISSING:
+                return value
+        return self._recompute(key, default, timeout, version, None)
+
+    def register_refresh(self, key, func, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Registers func to recompute the value of key. With STALE_TTL, get
+        and get_many return a value past its soft expiry right away and run
+        func on a background worker to set the new value. Without a
+        registered func such a value is treated as expired.
+        """
+        if self._refresher is None:
+            raise ValueError("register_refresh needs the STALE_TTL option")
+        self._refresher.register(
+            self.make_key(key, version=version),
+            functools.partial(self._refresh_value, key, func, timeout, version))
+
+    def _servable(self, aero_key, record):
+        """
+        Returns True if the entry read back in record can be served: none of
+        its tags was invalidated and, with STALE_TTL, it is not stale or a
+        refresh is on its way.
+        """
+        if (record.get(TAGS_BIN)
+                and not self._tags_current([record[TAGS_BIN]])[0]):
+            return False
+        if self._opts.stale_ttl and not self._check_stale(aero_key, record):
+            return False
+        return True
 
-            return unpickled_value
+    def _check_stale(self, aero_key, record):
+        """
+        Returns True if the value of the record can be served: it is not
+        past its soft expiry, or it is and a refresh is on its way.
+        """
+        soft_expiry = record.get(SOFT_EXPIRY_BIN)
+        if soft_expiry is None or soft_expiry > time.time():
+            return True
+        return self._refresher.refresh(aero_key)
+
+    def _refresh_value(self, key, func, timeout, version):
+        """
+        Recomputes a stale value in the background, unless a worker of
+        another process holds the get_or_set lock for it.
+        """
+        lock_key = self.make_key("%s:lock" % (key,), version=version)
+        if self._acquire_lock(lock_key):
+            self._recompute(key, func, timeout, version, lock_key)
+
+    def _read_record(self, aero_key):
+        """
+        Returns (metadata, bins) of the record, None if it is missing or can
+        not be read.
+        """
+        try:
+            (key, metadata, record) = self._client.get(aero_key,
+                                                       self._opts.policy)
+        except (RecordNotFound, CircuitOpenError):
+            return None
+        except Exception as e:
+            self._report_error(e)
+            return None
+        if record is None:
+            return None
+        return metadata, record
+
+    def _check_entry(self, aero_key):
+        """
+        Returns the generation of the record of aero_key and whether get
+        serves its entry, None if it is missing. Only the bins get checks are
+        read.
+        """
+        try:
+            (key, metadata, record) = self._client.select(
+                aero_key, [TAGS_BIN, SOFT_EXPIRY_BIN], self._opts.policy)
+        except RecordNotFound:
+            return None
+        if metadata is None:
+            return None
+        return metadata.get('gen'), self._servable(aero_key, record or {})
+
+    def _refresh_early(self, metadata, recompute_ms):
+        """
+        Decides whether to recompute a value before it expires, the closer
+        the record is to expiry relative to how long the value takes to
+        compute, the likelier.
+        """
+        ttl = (metadata or {}).get('ttl')
+        if not recompute_ms or not ttl or ttl <= 0:
+            return False
+        delta = recompute_ms / 1000.0
+        return delta * self._opts.stampede_beta * -math.log(
+            1.0 - random.random()) >= ttl
+
+    def _acquire_lock(self, lock_key):
+        """
+        Creates the lock record, returns False if it exists already. Fails
+        open: if the cluster can not be asked, the caller goes ahead.
+        """
+        opts = self._opts
+        try:
+            self._client.put(lock_key, {opts.bin: 1}, opts.lock_meta,
+                             opts.create_policy)
+        except RecordExistsError:
+            return False
+        except CircuitOpenError:
+            pass
         except Exception as e:
-            print("error: {0}".format(e), file=sys.stderr)
-        return default
+            self._report_error(e)
+        return True
 
-    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+    def _recompute(self, key, default, timeout, version, lock_key):
         """
-        Set a value in the cache. It is similar to add
+        Calls default and stores its value along with how long it took.
         """
-        return self.add(key, value, timeout, version)
+        started = time.time()
+        try:
+            value = default()
+            recompute_ms = int((time.time() - started) * 1000) + 1
+            try:
+                self._put(key, value, timeout, version, self._opts.policy,
+                          {RECOMPUTE_BIN: recompute_ms})
+            except CircuitOpenError:
+                #serve the value without caching it
+                pass
+        finally:
+            if lock_key is not None:
+                try:
+                    self._client.remove(lock_key)
+                except Exception:
+                    #it expires on its own anyway
+                    pass
+        return value
 
     def delete(self, key, version=None):
         """
-        Delete a key from the cache, failing silently.
+        Delete a key from the cache, failing silently. Buffered like set with
+        WRITE_BEHIND.
         """
-        self._client.remove(self.make_key(key, version=version))
+        aero_key = self.make_key(key, version=version)
+        if self._near_cache is not None:
+            self._near_cache.delete(aero_key)
+        batch = self._deferred_batch()
+        if batch:
+            batch.forget(aero_key)
+        if self._write_buffer is not None and self._write_buffer.enqueue(
+                aero_key, DELETE, None, lambda: self._remove(aero_key)):
+            return
+        try:
+            self._remove(aero_key)
+        except CircuitOpenError:
+            pass
+
+    def _remove(self, aero_key):
+        """
+        Removes the record of aero_key, and the chunks of its value if it is
+        chunked. With CHUNK_SIZE the manifest is read by the operate() call
+        deleting the record, where the client has the delete operation.
+        """
+        manifest = None
+        try:
+            if not self._opts.chunk_size:
+                self._remove_record(aero_key)
+            elif OPERATOR_DELETE is None:
+                manifest = self._manifest(aero_key)
+                self._remove_record(aero_key)
+            else:
+                try:
+                    (key, metadata, bins) = self._client.operate(
+                        aero_key, [{'op': aerospike.OPERATOR_READ,
+                                    'bin': CHUNKS_BIN},
+                                   {'op': OPERATOR_DELETE}])
+                    manifest = (bins or {}).get(CHUNKS_BIN) or None
+                except RecordNotFound:
+                    pass
+        finally:
+            self._detach_flight(aero_key)
+        if manifest is not None:
+            self._remove_chunks(manifest)
+
+    def _remove_record(self, aero_key):
+        """
+        Removes the record of aero_key, if it exists.
+        """
+        try:
+            self._client.remove(aero_key)
+        except RecordNotFound:
+            pass
 
     def get_many(self, keys, version=None):
         """
@@ -279,80 +1303,1046 @@ class AerospikeCache(BaseCache):
         """
         if not keys:
             return {}
-        ret_data = {}
-        # get list of keys using python map
-        new_keys = list(map(lambda key: self.make_key(key,version), keys))
+        batch = self._deferred_batch()
+        if not batch:
+            return dict(self.iter_many(keys, version=version))
+        #answer from the deferred gets, read the keys along with them
+        items = [(self.make_key(key, version=version), key) for key in keys]
+        batch.include(items, version)
+        ret = {}
+        rest = []
+        for aero_key, key in items:
+            value = batch.take(aero_key)
+            if value is None:
+                rest.append(key)
+            elif value is not MISSING:
+                ret[key] = value
+        if rest:
+            ret.update(self.iter_many(rest, version=version))
+        return ret
+
+    def defer(self, key, default=None, version=None):
+        """
+        Defers a get of key: returns a Deferred whose result() is the value,
+        default if the key is missing. The gets deferred by a thread are all
+        read with one get_many the first time one of them is needed, or on
+        flush_deferred(). A plain get or get_many of the thread meanwhile is
+        read along with them, so e.g. the {% cache %} fragments of a page
+        cost one round trip once their keys, see
+        django.core.cache.utils.make_template_fragment_key, are deferred up
+        front.
+        """
+        aero_key = self.make_key(key, version=version)
+        return self._lazy_batch().defer(aero_key, key, version, default)
+
+    def get_lazy(self, key, default=None, version=None):
+        """
+        Like defer but returns a lazy proxy of the value, resolved on first
+        use, e.g. when a template renders it.
+        """
+        return lazy_value(self.defer(key, default, version))
+
+    def flush_deferred(self):
+        """
+        Reads the gets deferred by this thread now, with one get_many.
+        """
+        batch = self._deferred_batch()
+        if batch:
+            batch.resolve()
+
+    def _lazy_batch(self):
+        """
+        The gets deferred by this thread, created on first use.
+        """
+        batch = getattr(self._lazy_local, 'batch', None)
+        if batch is None:
+            batch = self._lazy_local.batch = LazyBatch(
+                lambda keys, version: dict(self.iter_many(keys, version)))
+        return batch
+
+    def _deferred_batch(self):
+        """
+        The gets deferred by this thread, None if it never deferred one.
+        """
+        return getattr(self._lazy_local, 'batch', None)
+
+    def _forget_deferred(self, keys, version=None):
+        """
+        Drops the deferred outcomes of keys, as they are written.
+        """
+        batch = self._deferred_batch()
+        if batch:
+            for key in keys:
+                batch.forget(self.make_key(key, version=version))
+
+    def iter_many(self, keys, version=None):
+        """
+        Fetch a bunch of keys from the cache in sub-batches of at most
+        BATCH_SIZE keys, several of them in flight at once.
+
+        Yields a (key, value) pair for each key found, as soon as the
+        sub-batch holding it arrives. Missing keys are skipped.
+        """
+        if self._write_buffer is not None and len(self._write_buffer):
+            #the keys with a buffered write are answered from the buffer
+            found, rest = [], []
+            for key in keys:
+                pending = self._write_buffer.lookup(
+                    self.make_key(key, version))
+                if pending is None:
+                    rest.append(key)
+                elif pending[0] == SET:
+                    found.append((key, pending[1]))
+            return chain(found, self._iter_batches(self._get_batch, rest,
+                                                   version))
+        return self._iter_batches(self._get_batch, keys, version)
+
+    def _iter_batches(self, get_batch, keys, *args):
+        """
+        Calls get_batch(sub-batch, *args) for sub-batches of at most
+        BATCH_SIZE keys, up to CONCURRENCY of them at once, and yields the
+        items of the lists they return.
+        """
+        batch_size = self._opts.batch_size
+        keys = iter(keys)
+        chunk = list(islice(keys, batch_size))
+        if not chunk:
+            return
+        next_chunk = list(islice(keys, batch_size))
+        if not next_chunk:
+            #single batch, no need for the worker pool
+            for item in get_batch(chunk, *args):
+                yield item
+            return
+
+        #keep at most CONCURRENCY sub-batches in flight
+        pending = set()
+        while chunk:
+            pending.add(self.executor.submit(get_batch, chunk, *args))
+            if len(pending) >= self._opts.concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for item in future.result():
+                        yield item
+            chunk, next_chunk = next_chunk, list(islice(keys, batch_size))
+        for future in as_completed(pending):
+            for item in future.result():
+                yield item
+
+    def _get_batch(self, keys, version=None):
+        """
+        Fetch one sub-batch of keys with a single request.
+
+        Returns a list of (key, value) pairs for the keys found.
+        """
+        make_key = self.make_key
+        new_keys = [make_key(key, version) for key in keys]
+        ret_data = []
+
+        near_cache = self._near_cache
+        if near_cache is not None:
+            #only ask the server for what the near cache does not have
+            missed_keys, missed_new_keys = [], []
+            for key, aero_key in zip(keys, new_keys):
+                value = near_cache.get(aero_key)
+                if value is MISSING:
+                    missed_keys.append(key)
+                    missed_new_keys.append(aero_key)
+                else:
+                    ret_data.append((key, self._near_value(value)))
+            keys, new_keys = missed_keys, missed_new_keys
+            if not keys:
+                return ret_data
+
+        if self._flights is not None:
+            ret_data.extend(self._coalesced_read_many(keys, new_keys))
+        else:
+            for key, new_key, value in self._read_many(keys, new_keys):
+                ret_data.append((key, self.unpickle(value)))
+        return ret_data
+
+    def _coalesced_read_many(self, keys, new_keys):
+        """
+        Like _read_many but returns the (key, decoded value) pairs, with
+        COALESCE_READS: the keys already read by another call are not asked
+        for again, their results are awaited once ours are handed over, up to
+        COALESCE_WAIT seconds from the call in all.
+        """
+        flights = self._flights
+        deadline = time.time() + self._opts.coalesce_wait
+        leading, following = [], []
+        for key, new_key in zip(keys, new_keys):
+            flight, leader = flights.join(new_key)
+            (leading if leader else following).append((key, new_key, flight))
+        values = {}
+        try:
+            if leading:
+                values = dict(
+                    (new_key, value) for key, new_key, value in
+                    self._read_many([item[0] for item in leading],
+                                    [item[1] for item in leading]))
+        finally:
+            ret_data = []
+            for key, new_key, flight in leading:
+                value = values.get(new_key, MISSING)
+                waiters = flights.land(new_key, flight, value)
+                if value is not MISSING:
+                    ret_data.append((key, self._decoded(value, waiters > 0)))
+        late = []
+        for key, new_key, flight in following:
+            #past the deadline the flights already landed are still taken
+            value = flights.wait(flight, max(0, deadline - time.time()))
+            if value is TIMED_OUT:
+                late.append((key, new_key))
+            elif value is not MISSING:
+                ret_data.append((key, self._decoded(value, True)))
+        if late:
+            #their leaders are too slow, read them on our own
+            for key, new_key, value in self._read_many(
+                    [item[0] for item in late], [item[1] for item in late]):
+                ret_data.append((key, self.unpickle(value)))
+        return ret_data
+
+    def _read_many(self, keys, new_keys):
+        """
+        Reads the entries of new_keys from the server, with one request, or a
+        few for chunked values. Returns the list of (key, aerospike key, raw
+        value) of the entries found.
+        """
+        bin_name = self._opts.bin
+        stale_ttl = self._opts.stale_ttl
+        chunk_size = self._opts.chunk_size
+        structured = self._opts.structured
+        near_cache = self._near_cache
+        ret_data = []
 
-        #get dict of key,meta,rec
-        records = self._client.get_many(new_keys)
+        touch = None
+        try:
+            if (self._opts.sliding_expiration
+                    and hasattr(self._client, 'batch_operate')):
+                #read and push the expiration back in the same batch request
+                touch = self._touch_ops(DEFAULT_TIMEOUT)
+                ops, meta = touch
+                batch_records = self._client.batch_operate(
+                    new_keys, ops + self._opts.read_ops, None,
+                    self._opts.update_policy, meta['ttl']).batch_records
+                records = [batch_record.record if batch_record.result == 0
+                           else None for batch_record in batch_records]
+            else:
+                records = self._get_records(new_keys)
+        except CircuitOpenError:
+            #all misses while the cluster is degraded
+            return ret_data
 
-        for key, value in records.iteritems():
+        entries = []
+        for key, new_key, value in zip(keys, new_keys, records):
+            if value is None:
+                continue
             #extract aerospike record from returned tuple value,
             (aero_key, metadata, record) = value
             if record is None:
                 continue
-            #the python client library will unpickle the appropriate value
-            unpickled_value = record[self.aero_bin]
-            ret_data[key] = unpickled_value
+            entries.append((key, new_key, metadata, record))
+
+        #the versions of the tags of all the entries in one more batch request
+        tagged = [entry for entry in entries if entry[3].get(TAGS_BIN)]
+        if tagged:
+            invalid = set(entry[1] for entry, current in zip(
+                tagged, self._tags_current([entry[3][TAGS_BIN]
+                                            for entry in tagged]))
+                          if not current)
+            if invalid:
+                entries = [entry for entry in entries
+                           if entry[1] not in invalid]
+
+        found = []
+        chunked = []
+        refetch = []
+        for key, new_key, metadata, record in entries:
+            if stale_ttl and not self._check_stale(new_key, record):
+                continue
+            if chunk_size and record.get(CHUNKS_BIN):
+                chunked.append((key, new_key, metadata, record))
+            elif structured and record.get(FIELDS_BIN):
+                if touch is not None:
+                    #batch_operate() above only read the marker bin
+                    refetch.append((key, new_key, metadata))
+                else:
+                    found.append((key, new_key, metadata, record,
+                                  self._fields_value(record)))
+            else:
+                found.append((key, new_key, metadata, record, record[bin_name]))
+
+        if chunked:
+            #the chunks of all the chunked values in one more batch request
+            values = self._read_chunks(
+                [item[3][CHUNKS_BIN] for item in chunked], touch)
+            found.extend(item + (value,) for item, value in zip(chunked, values)
+                         if value is not None)
+        if refetch:
+            records = self._get_records([item[1] for item in refetch])
+            found.extend(item + (value[2], self._fields_value(value[2]))
+                         for item, value in zip(refetch, records)
+                         if value is not None and value[2] is not None)
+
+        for key, new_key, metadata, record, value in found:
+            if near_cache is not None:
+                self._near_set(new_key, value, metadata, record)
+            ret_data.append((key, new_key, value))
+        return ret_data
+
+    def _get_records(self, aero_keys, bins=None):
+        """
+        Reads the records of aero_keys, only the given bins if any, with one
+        batch request, and returns the list of their (key, meta, bins), None
+        for those not found.
+        """
+        client = self._client
+        if hasattr(client, 'batch_read'):
+            #get_many and select_many are gone from the newer clients
+            if bins is None:
+                records = client.batch_read(aero_keys)
+            else:
+                records = client.batch_read(aero_keys, bins)
+            return [batch_record.record if batch_record.result == 0 else None
+                    for batch_record in records.batch_records]
+        if bins is None:
+            records = client.get_many(aero_keys)
+        else:
+            records = client.select_many(aero_keys, bins)
+        #older clients return a dict by primary key
+        if isinstance(records, dict):
+            records = [records.get(aero_key[2]) for aero_key in aero_keys]
+        return records
+
+    def get_fields(self, key, fields, version=None):
+        """
+        Fetch the given fields of the dict cached at key. Only their bins are
+        read for entries stored in STRUCTURED mode, other dicts are read
+        whole.
+
+        Returns a dict of the fields found, empty if the key does not exist.
+        """
+        aero_key = self._settle(self.make_key(key, version=version))
+        fields = list(fields)
+        if self._near_cache is not None:
+            value = self._near_cache.get(aero_key)
+            if value is not MISSING:
+                return self._pick_fields(self._near_value(value), fields)
+        opts = self._opts
+        try:
+            (key, metadata, record) = self._client.select(
+                aero_key, fields + opts.select_bins, opts.policy)
+        except (RecordNotFound, CircuitOpenError):
+            return {}
+        return self._record_fields(aero_key, record, fields)
+
+    def get_many_fields(self, keys, fields, version=None):
+        """
+        Fetch the given fields of the dicts cached at a bunch of keys, in
+        sub-batches like get_many. Only their bins are read for entries stored
+        in STRUCTURED mode.
+
+        Returns a dict mapping each key found to the dict of its fields.
+        """
+        if not keys:
+            return {}
+        return dict(self._iter_batches(self._get_fields_batch, keys,
+                                       list(fields), version))
+
+    def _get_fields_batch(self, keys, fields, version=None):
+        """
+        Fetch the fields of one sub-batch of keys with a single request.
+
+        Returns a list of (key, fields dict) pairs for the keys found.
+        """
+        make_key = self.make_key
+        settle = self._settle
+        new_keys = [settle(make_key(key, version)) for key in keys]
+        ret_data = []
+
+        near_cache = self._near_cache
+        if near_cache is not None:
+            missed_keys, missed_new_keys = [], []
+            for key, aero_key in zip(keys, new_keys):
+                value = near_cache.get(aero_key)
+                if value is MISSING:
+                    missed_keys.append(key)
+                    missed_new_keys.append(aero_key)
+                else:
+                    ret_data.append(
+                        (key, self._pick_fields(self._near_value(value), fields)))
+            keys, new_keys = missed_keys, missed_new_keys
+            if not keys:
+                return ret_data
+
+        try:
+            records = self._get_records(new_keys,
+                                        fields + self._opts.select_bins)
+        except CircuitOpenError:
+            #all misses while the cluster is degraded
+            return ret_data
+        for key, new_key, value in zip(keys, new_keys, records):
+            if value is None or value[2] is None:
+                continue
+            ret_data.append((key, self._record_fields(new_key, value[2], fields)))
         return ret_data
 
+    def _record_fields(self, aero_key, record, fields):
+        """
+        Returns the given fields of the entry read back in record, which has
+        the selected bins.
+        """
+        opts = self._opts
+        if not self._servable(aero_key, record):
+            return {}
+        if record.get(FIELDS_BIN):
+            decode = opts.codec.decode
+            return dict((field, decode(record[field])) for field in fields
+                        if record.get(field) is not None)
+        if opts.chunk_size and record.get(CHUNKS_BIN):
+            value = self._read_chunks([record[CHUNKS_BIN]])[0]
+        else:
+            value = record.get(opts.bin)
+        if value is None:
+            return {}
+        return self._pick_fields(self.unpickle(value), fields)
+
+    def _pick_fields(self, value, fields):
+        """
+        Returns the given fields of a cached dict, none if it is not a dict.
+        """
+        if not isinstance(value, dict):
+            return {}
+        return dict((field, value[field]) for field in fields if field in value)
+
+    def update_fields(self, key, fields, version=None):
+        """
+        Write the fields of the dict fields into the structured entry at key,
+        only sending their bins. The other fields and the expiration are kept.
+        Needs the STRUCTURED option.
+
+        Returns False if the key does not exist.
+        """
+        opts = self._opts
+        if not opts.structured:
+            raise ValueError("update_fields needs the STRUCTURED option")
+        encode = opts.codec.encode
+        ops = []
+        for field, value in fields.items():
+            if not self._is_field(field):
+                raise ValueError("{0!r} can not be a field name".format(field))
+            ops.append({'op': aerospike.OPERATOR_WRITE, 'bin': field,
+                        'val': encode(value)})
+        if not ops:
+            return True
+        aero_key = self._settle(self.make_key(key, version=version))
+        if self._near_cache is not None:
+            self._near_cache.delete(aero_key)
+        try:
+            self._client.operate(aero_key, ops, opts.incr_meta,
+                                 opts.update_policy)
+        except (RecordNotFound, CircuitOpenError):
+            return False
+        finally:
+            self._detach_flight(aero_key)
+        return True
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None,
+                 tags=None):
+        """
+        Set a bunch of values in the cache at once from a dict of key/value
+        pairs, all with the given tags if any. The writes are issued
+        concurrently over the worker pool rather than one round trip after
+        the other.
+
+        Returns a list of keys that failed insertion.
+        """
+        if tags:
+            #read the tag versions once for all the values
+            self._get_tag_versions(tags)
+        #the pool threads can not see the deferred gets of this one
+        self._forget_deferred(data, version)
+        if self._write_buffer is not None:
+            #buffering is quicker than handing the writes to the pool
+            return [key for key in data
+                    if not self.set(key, data[key], timeout, version, tags)]
+
+        def _set(key):
+            return self.set(key, data[key], timeout, version, tags)
+        return self._run_many(_set, data)
+
+    def delete_many(self, keys, version=None):
+        """
+        Delete a bunch of keys from the cache at once. The removes are issued
+        concurrently over the worker pool, missing keys are ignored.
+
+        Returns a list of keys that failed deletion.
+        """
+        keys = list(keys)
+        self._forget_deferred(keys, version)
+        if self._write_buffer is not None:
+            for key in keys:
+                self.delete(key, version=version)
+            return []
+
+        def _delete(key):
+            try:
+                self.delete(key, version=version)
+            except RecordNotFound:
+                pass
+            return True
+        return self._run_many(_delete, keys)
+
+    def _run_many(self, func, keys):
+        """
+        Applies func to each key, concurrently when there is more than one,
+        and collects the keys for which func raised or returned False. On a
+        thread of the pool already, e.g. writing the chunks of a value for
+        set_many, the keys are done one by one: waiting on the pool from its
+        own threads can deadlock it.
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+        failed = []
+        if len(keys) == 1 or on_pool_thread():
+            results = [(key, self._call_safe(func, key)) for key in keys]
+        else:
+            futures = dict((self.executor.submit(self._call_safe, func, key), key)
+                           for key in keys)
+            results = [(futures[future], future.result())
+                       for future in as_completed(futures)]
+        for key, ret in results:
+            if ret is False:
+                failed.append(key)
+        return failed
+
+    def _call_safe(self, func, key):
+        """
+        Calls func(key), reporting an error as a False return value.
+        """
+        try:
+            return func(key)
+        except CircuitOpenError:
+            pass
+        except Exception as e:
+            self._report_error(e)
+        return False
+
     def has_key(self, key, version=None):
         """
-        Returns True if the key is in the cache and has not expired.
+        Returns True if the key is in the cache, has not expired and would be
+        served by get.
         """
-        meta = None
+        found = None
+        aero_key = self.make_key(key, version=version)
+        if self._write_buffer is not None:
+            pending = self._write_buffer.lookup(aero_key)
+            if pending is not None:
+                return pending[0] == SET
+        if self._near_cache is not None:
+            if self._near_cache.get(aero_key) is not MISSING:
+                return True
         try:
-            key, meta = self._client.exists(self.make_key(key, version=version))
-        except Exception, eargs:
-            print("error: {0}".format(eargs), file=sys.stderr)
+            found = self._check_entry(aero_key)
+        except CircuitOpenError:
+            pass
+        except Exception as eargs:
+            self._report_error(eargs)
 
-        if meta == None:
+        if found == None:
             return False
 
-        return True
+        return found[1]
 
     def incr(self, key, delta=1, version=None):
         """
         Add delta to value in the cache. If the key does not exist, raise a
         ValueError exception.
         """
-        exists = self.has_key(key)
-        if not exists:
+        opts = self._opts
+        aero_key = self._settle(self.make_key(key, version=version))
+        if self._near_cache is not None:
+            self._near_cache.delete(aero_key)
+        #increment and read back in one atomic round trip, the update only
+        #policy makes it fail rather than create a missing record
+        try:
+            (key_, metadata, record) = self._client.operate(
+                aero_key, opts.incr_ops(delta), opts.incr_meta, opts.update_policy)
+        except RecordNotFound:
             raise ValueError("Key '%s' not found" % key)
+        except CircuitOpenError:
+            #not found while degraded, like the reads
+            raise ValueError("Key '%s' not found, the circuit is open" % key)
+        finally:
+            self._detach_flight(aero_key)
+        return record[opts.bin]
+
+    def _operate(self, key, version, ops, meta, policy):
+        """
+        Applies ops to the record for key with one operate() call and returns
+        its bins, None if the key does not exist or the circuit breaker is
+        open.
+        """
+        aero_key = self._settle(self.make_key(key, version=version))
+        if self._near_cache is not None:
+            self._near_cache.delete(aero_key)
+        try:
+            return self._client.operate(aero_key, ops, meta, policy)[2]
+        except (RecordNotFound, CircuitOpenError):
+            return None
+        finally:
+            self._detach_flight(aero_key)
+
+    def _operate_bin(self, key, version, ops, meta, policy):
+        """
+        Like _operate but returns the value bin only, None if the record was
+        not written.
+        """
+        record = self._operate(key, version, ops, meta, policy)
+        if record is None:
+            return None
+        return record[self._opts.bin]
+
+    def _detach_flight(self, aero_key=None):
+        """
+        With COALESCE_READS, makes the reads of aero_key, of all the keys by
+        default, after a write not join a read started before it.
+        """
+        if self._flights is not None:
+            self._flights.detach(aero_key)
+
+    def _list_trim_op(self, max_items):
+        """
+        The operation removing all but the last max_items items of the list.
+        """
+        return {'op': aerospike.OP_LIST_REMOVE_BY_INDEX_RANGE,
+                'bin': self._opts.bin, 'index': -max_items if max_items else 0,
+                'return_type': aerospike.LIST_RETURN_NONE,
+                'inverted': bool(max_items)}
+
+    def list_append(self, key, value, max_items=None, timeout=DEFAULT_TIMEOUT,
+                    version=None):
+        """
+        Append value to the list cached at key, on the server and without
+        reading the list, creating it if the key does not exist. With
+        max_items only the last max_items items are kept. The expiration is
+        reset to timeout.
+
+        Returns the new length of the list, None while the circuit breaker is
+        open.
+        """
+        opts = self._opts
+        ops, meta = self._expiry_ops(timeout)
+        ops.append({'op': aerospike.OP_LIST_APPEND, 'bin': opts.bin,
+                    'val': value})
+        if max_items is not None:
+            ops.append(self._list_trim_op(max_items))
+        ops.append({'op': aerospike.OP_LIST_SIZE, 'bin': opts.bin})
+        return self._operate_bin(key, version, ops, meta, opts.policy)
+
+    def list_trim(self, key, max_items, version=None):
+        """
+        Remove all but the last max_items items of the list cached at key,
+        on the server. The expiration is kept.
+
+        Returns the new length of the list, None if the key does not exist.
+        """
+        opts = self._opts
+        record = self._operate(
+            key, version,
+            [self._list_trim_op(max_items),
+             {'op': aerospike.OP_LIST_SIZE, 'bin': opts.bin}],
+            opts.incr_meta, opts.update_policy)
+        if record is None:
+            return None
+        return record[opts.bin]
+
+    def list_range(self, key, index=0, count=None, version=None):
+        """
+        Fetch count items (all the rest by default) of the list cached at key
+        from index on, negative indexes counting from the end, without
+        reading the whole list.
+
+        Returns the list of items, None if the key does not exist.
+        """
+        opts = self._opts
+        op = {'op': aerospike.OP_LIST_GET_BY_INDEX_RANGE, 'bin': opts.bin,
+              'index': index, 'return_type': aerospike.LIST_RETURN_VALUE,
+              'inverted': False}
+        if count is not None:
+            op['count'] = count
+        record = self._operate_read(key, version, op)
+        if record is None:
+            return None
+        return record[opts.bin]
+
+    def _operate_read(self, key, version, op):
+        """
+        Runs the read only list or map op on the entry of key, reading along
+        the bins get checks before serving it. Returns the bins read, None if
+        the key does not exist or the entry can not be served.
+        """
+        aero_key = self._settle(self.make_key(key, version=version))
+        ops = [op, {'op': aerospike.OPERATOR_READ, 'bin': TAGS_BIN}]
+        if self._opts.stale_ttl:
+            ops.append({'op': aerospike.OPERATOR_READ, 'bin': SOFT_EXPIRY_BIN})
         try:
-            aero_key = self.make_key(key, version=version)
-            value = self._client.increment(aero_key, self.aero_bin, delta)
-        except Exception, eargs:
-            value = self.get(key) + delta
-            self.set(key, value)
+            (key_, metadata, record) = self._client.operate(aero_key, ops)
+        except (RecordNotFound, CircuitOpenError):
+            return None
+        if not self._servable(aero_key, record):
+            return None
+        return record
+
+    def map_put(self, key, map_key, value, timeout=DEFAULT_TIMEOUT,
+                version=None):
+        """
+        Set map_key to value in the dict cached at key, on the server and
+        without reading the dict, creating it if the key does not exist. The
+        expiration is reset to timeout.
+
+        Returns the new size of the dict, None while the circuit breaker is
+        open.
+        """
+        opts = self._opts
+        ops, meta = self._expiry_ops(timeout)
+        ops.append({'op': aerospike.OP_MAP_PUT, 'bin': opts.bin,
+                    'key': map_key, 'val': value})
+        return self._operate_bin(key, version, ops, meta, opts.policy)
+
+    def map_incr(self, key, map_key, delta=1, timeout=DEFAULT_TIMEOUT,
+                 version=None):
+        """
+        Add delta to the number at map_key in the dict cached at key, on the
+        server, creating the dict and the entry as needed. The expiration is
+        reset to timeout.
+
+        Returns the new value of the entry, None while the circuit breaker is
+        open.
+        """
+        opts = self._opts
+        ops, meta = self._expiry_ops(timeout)
+        ops.append({'op': aerospike.OP_MAP_INCREMENT, 'bin': opts.bin,
+                    'key': map_key, 'val': delta})
+        return self._operate_bin(key, version, ops, meta, opts.policy)
+
+    def map_remove(self, key, map_key, version=None):
+        """
+        Remove map_key from the dict cached at key, on the server. The
+        expiration is kept.
+
+        Returns the removed value, None if there was none.
+        """
+        opts = self._opts
+        record = self._operate(
+            key, version,
+            [{'op': aerospike.OP_MAP_REMOVE_BY_KEY, 'bin': opts.bin,
+              'key': map_key, 'return_type': aerospike.MAP_RETURN_VALUE}],
+            opts.incr_meta, opts.update_policy)
+        if record is None:
+            return None
+        return record[opts.bin]
+
+    def map_get(self, key, map_key, default=None, version=None):
+        """
+        Fetch the value at map_key in the dict cached at key, without reading
+        the whole dict.
+
+        Returns default if the key or map_key does not exist.
+        """
+        opts = self._opts
+        op = {'op': aerospike.OP_MAP_GET_BY_KEY, 'bin': opts.bin,
+              'key': map_key, 'return_type': aerospike.MAP_RETURN_VALUE}
+        record = self._operate_read(key, version, op)
+        if record is None:
+            return default
+        value = record.get(opts.bin)
+        if value is None:
+            return default
         return value
 
+    def incr_many(self, deltas, version=None):
+        """
+        Add each delta of the dict deltas to the value of its key in the
+        cache, with batch requests of at most BATCH_SIZE keys where the client
+        supports it, otherwise concurrently over the worker pool.
+
+        Returns a dict mapping each key to its new value. Keys that do not
+        exist, or all of them while the circuit breaker is open, are missing
+        from the response dict.
+        """
+        ret_data = {}
+        if not deltas:
+            return ret_data
+        if BatchWrite is None or not hasattr(self._client, 'batch_write'):
+            def _incr(key):
+                try:
+                    ret_data[key] = self.incr(key, deltas[key], version)
+                except ValueError:
+                    pass
+                return True
+            self._run_many(_incr, deltas)
+            return ret_data
+
+        keys = list(deltas)
+        batch_size = self._opts.batch_size
+        for start in range(0, len(keys), batch_size):
+            try:
+                ret_data.update(self._incr_batch(
+                    keys[start:start + batch_size], deltas, version))
+            except CircuitOpenError:
+                pass
+        return ret_data
+
+    def _incr_batch(self, keys, deltas, version=None):
+        """
+        Add its delta to the value of each key with a single batch request,
+        one record each holding the increment and the read back.
+
+        Returns a list of (key, value) pairs for the keys found.
+        """
+        opts = self._opts
+        new_keys = [self._settle(self.make_key(key, version)) for key in keys]
+        if self._near_cache is not None:
+            for aero_key in new_keys:
+                self._near_cache.delete(aero_key)
+        try:
+            records = self._client.batch_write(BatchRecords([
+                BatchWrite(aero_key, opts.incr_ops(deltas[key]),
+                           meta=opts.incr_meta, policy=opts.update_policy)
+                for key, aero_key in zip(keys, new_keys)]))
+        finally:
+            for aero_key in new_keys:
+                self._detach_flight(aero_key)
+
+        ret_data = []
+        for key, batch_record in zip(keys, records.batch_records):
+            if batch_record.result == 0 and batch_record.record:
+                ret_data.append((key, batch_record.record[2][opts.bin]))
+        return ret_data
+
     def clear(self):
         """
         Remove *all* values from the cache at once.
+
+        How depends on CLEAR_MODE:
+        'scan' (the default) removes the records one by one from a scan of the
+        set, in a background thread when CLEAR_BACKGROUND is set and at most
+        CLEAR_RATE records per second when it is given.
+        'truncate' has the server drop all the records of the set.
+        'generation' bumps a counter that make_key mixes into every key, the
+        old records are not found any more and expire with their ttl.
         """
+        opts = self._opts
+        if self._write_buffer is not None:
+            #the writes buffered so far came before the clear
+            self._write_buffer.discard()
+        try:
+            if opts.clear_mode == 'generation':
+                self._bump_generation()
+            elif opts.clear_mode == 'truncate':
+                self._client.truncate(opts.namespace, opts.set, 0)
+            elif opts.clear_background:
+                thread = threading.Thread(target=self._scan_remove,
+                                          name="aerospike-cache-clear")
+                thread.daemon = True
+                thread.start()
+            else:
+                self._scan_remove()
+        except CircuitOpenError:
+            #nothing is removed while degraded, like delete
+            pass
+        if self._near_cache is not None:
+            self._near_cache.clear()
+        self._detach_flight()
+
+    def _scan_remove(self):
+        """
+        Removes each record of the set, pacing the removes to CLEAR_RATE
+        records per second if it is set.
+        """
+        client = self._client
+        rate = self._opts.clear_rate
+        interval = 1.0 / rate if rate else 0
+        state = {'next': time.time()}
 
         #remove each record in the bin
-        def callback((key, meta, bins)):
-            self._client.remove(key)
+        def callback(record):
+            try:
+                client.remove(record[0])
+            except RecordNotFound:
+                pass
+            if interval:
+                state['next'] += interval
+                delay = state['next'] - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+        scan_obj = client.scan(self._opts.namespace, self._opts.set)
+        try:
+            scan_obj.foreach(callback)
+        except Exception as e:
+            self._report_error(e)
+
+    def _tag_key(self, tag):
+        return self._opts.key_prefix + ("__tag__:%s" % tag,)
+
+    def _get_tag_versions(self, tags):
+        """
+        Returns the dict of the current versions of tags, those not read
+        within TAG_VERSION_TTL seconds are read with one batch request. Tags
+        never invalidated are at version 0.
+        """
+        versions, missing = self._tag_versions.get(tags)
+        if missing:
+            bin_name = self._opts.bin
+            records = self._get_records([self._tag_key(tag) for tag in missing])
+            read = dict((tag, record[2][bin_name]
+                         if record is not None and record[2] else 0)
+                        for tag, record in zip(missing, records))
+            self._tag_versions.update(read)
+            versions.update(read)
+        return versions
 
-        scan_obj = self._client.scan(self.aero_namespace, self.aero_set)
+    def _tags_current(self, tag_maps):
+        """
+        Tells for each of the {tag: version} maps stored with entries whether
+        all its tags are still at those versions.
+        """
+        tags = set()
+        for tag_map in tag_maps:
+            tags.update(tag_map)
+        versions = self._get_tag_versions(list(tags))
+        return [all(versions.get(tag, 0) == version
+                    for tag, version in tag_map.items())
+                for tag_map in tag_maps]
 
-        scan_obj.foreach(callback)
+    def invalidate_tags(self, tags):
+        """
+        Invalidate every entry set with any of the given tags, by bumping the
+        tag versions on the server rather than finding the entries. Other
+        processes stop serving them within TAG_VERSION_TTL seconds, this one
+        right away.
+
+        Returns False if some of the tags could not be invalidated, e.g.
+        while the circuit breaker is open.
+        """
+        opts = self._opts
+        client = self._client
+        tags = list(tags)
+        #the tagged values buffered so far are to be invalidated too
+        self.flush_writes()
+        keys = [self._tag_key(tag) for tag in tags]
+        ops = opts.incr_ops(1)
+        versions = {}
+        try:
+            if len(keys) > 1 and hasattr(client, 'batch_operate'):
+                records = client.batch_operate(keys, ops, None, None,
+                                               opts.generation_meta['ttl'])
+                for tag, batch_record in zip(tags, records.batch_records):
+                    if batch_record.result == 0:
+                        versions[tag] = batch_record.record[2][opts.bin]
+            for tag, key in zip(tags, keys):
+                if tag not in versions:
+                    (key_, metadata, record) = client.operate(
+                        key, ops, opts.generation_meta, opts.policy)
+                    versions[tag] = record[opts.bin]
+        except CircuitOpenError:
+            pass
+        self._tag_versions.update(versions)
+        if self._near_cache is not None:
+            #near cached entries do not say what their tags are
+            self._near_cache.clear()
+        self._detach_flight()
+        return len(versions) == len(tags)
+
+    def _current_generation(self):
+        """
+        The clear generation mixed into the keys, read from the server at most
+        every CLEAR_GENERATION_TTL seconds.
+        """
+        now = time.time()
+        if now >= self._generation_expires:
+            opts = self._opts
+            try:
+                (key, metadata, record) = self._client.get(
+                    opts.generation_key, opts.policy)
+                self._generation = record[opts.bin]
+            except RecordNotFound:
+                self._generation = 0
+            except Exception as e:
+                #keep using the last known generation
+                self._report_error(e)
+                if self._generation is None:
+                    self._generation = 0
+            self._generation_expires = now + opts.generation_ttl
+        return self._generation
+
+    def _bump_generation(self):
+        """
+        Increments the clear generation on the server, which invalidates every
+        key of the cache for all the processes.
+        """
+        opts = self._opts
+        (key, metadata, record) = self._client.operate(
+            opts.generation_key, opts.incr_ops(1), opts.generation_meta,
+            opts.policy)
+        self._generation = record[opts.bin]
+        self._generation_expires = time.time() + opts.generation_ttl
 
     def close(self):
         """
-        closes the database connection
+        Django calls this at the end of every request. The client is shared
+        with the other backends of the process so its connections are kept
+        open, use aerospike_cache.clients.close_clients() to close them. The
+        worker pool of the bulk operations is shared and kept as well, like
+        the writes buffered with WRITE_BEHIND: they are sent in the background,
+        by flush_writes() or when the process exits.
         """
-        self._client.close()
+        batch = self._deferred_batch()
+        if batch:
+            #the gets deferred and the outcomes not taken are stale by the
+            #next request
+            batch.clear()
         
+    def _is_current(self, aero_key, generation):
+        """
+        Returns True if the record still has the given generation on the
+        server, checked with a metadata only request.
+        """
+        key, meta = self._client.exists(aero_key)
+        return meta is not None and meta.get('gen') == generation
+
+    def _near_set(self, aero_key, value, metadata, record=None):
+        """
+        Keeps a raw bin value read from the server in the near cache, no
+        longer than the record lives or, with STALE_TTL, stays fresh.
+        """
+        metadata = metadata or {}
+        ttl = metadata.get('ttl')
+        soft_expiry = record.get(SOFT_EXPIRY_BIN) if record else None
+        if soft_expiry is not None:
+            fresh_for = soft_expiry - time.time()
+            if fresh_for <= 0:
+                return
+            ttl = min(ttl, fresh_for) if ttl and ttl > 0 else fresh_for
+        self._near_cache.set(aero_key, value, metadata.get('gen'), ttl)
+
+    def _near_value(self, value):
+        """
+        Turns a raw bin value from the near cache into the cached value. Lists
+        and dicts are copied so callers can not modify the shared entry.
+        """
+        if isinstance(value, (list, dict)):
+            return copy.deepcopy(value)
+        return self.unpickle(value)
+
     def unpickle(self, value):
         """
-        Unpickles the given value, it is unpickled by client lib and therefore
-        not unpickled here.
+        Decodes the given bin value. Natively stored values are converted by
+        the client lib and returned as they are, blobs are deserialized, see
+        serializers.Codec.
         """
-        #if its byte array then unpickle else ignore
-        if isinstance(value, bytearray):
-            value = smart_bytes(value)
-            return pickle.loads(value)
-        return value
+        return self._opts.codec.decode(value)
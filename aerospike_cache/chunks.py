@@ -0,0 +1,52 @@
+"Splitting of values too large for one record, and their reassembly"
+import uuid
+
+#bin of the manifest record that replaces the value bin of a chunked value
+CHUNKS_BIN = "chunks"
+
+
+def split(data, size):
+    """
+    Returns the chunks of at most size bytes of the blob data.
+    """
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def new_manifest(count, total_size):
+    """
+    Returns the manifest of a value split into count chunks: [token, count,
+    total size]. The chunk keys derive from a token new to each write, so a
+    reader never mixes the chunks of two writes of the same key.
+    """
+    return [uuid.uuid4().hex, count, total_size]
+
+
+def chunk_keys(key_prefix, manifest):
+    """
+    Returns the aerospike keys of the chunks listed by manifest.
+    """
+    token, count = manifest[0], manifest[1]
+    return [key_prefix + ("__chunk__:%s:%d" % (token, index),)
+            for index in range(count)]
+
+
+def join(parts, total_size):
+    """
+    Reassembles the chunks read back into a single bytearray, copied once
+    into place through a memoryview. Returns None if a chunk is missing,
+    e.g. evicted, or the sizes do not add up.
+    """
+    data = bytearray(total_size)
+    view = memoryview(data)
+    position = 0
+    for part in parts:
+        if part is None:
+            return None
+        end = position + len(part)
+        if end > total_size:
+            return None
+        view[position:end] = part
+        position = end
+    if position != total_size:
+        return None
+    return data
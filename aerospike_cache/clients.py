@@ -0,0 +1,78 @@
+"Process wide registry of connected aerospike clients"
+import os
+import threading
+
+import aerospike
+
+_clients = {}
+_clients_pid = os.getpid()
+_clients_lock = threading.Lock()
+#bumped whenever the clients handed out so far must not be used any more
+_epoch = 0
+
+
+def _freeze(value):
+    """
+    Turns a client config made of dicts and lists into a hashable value.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def clients_epoch():
+    """
+    Returns a value that changes whenever the clients returned by get_client
+    so far are stale, after a fork or close_clients(). Callers keeping a
+    client around compare it to decide when to ask for a new one.
+    """
+    return (os.getpid(), _epoch)
+
+
+def get_client(config, username=None, password=None):
+    """
+    Returns the connected client for the given config and credentials,
+    connecting it on first use. All the cache backends of a process with the
+    same hosts and credentials share one client, and therefore one set of
+    cluster connections and one tend thread.
+
+    After a fork the clients inherited from the parent process are dropped
+    and new ones are connected in the child.
+    """
+    global _clients_pid, _epoch
+    registry_key = (_freeze(config), username, password)
+    with _clients_lock:
+        pid = os.getpid()
+        if pid != _clients_pid:
+            #the parent's sockets are not ours to use, nor to close
+            _clients.clear()
+            _clients_pid = pid
+            _epoch += 1
+        client = _clients.get(registry_key)
+        if client is None:
+            client = aerospike.client(config)
+            #community edition does not need username/password
+            if username is None and password is None:
+                client.connect()
+            #check for username/password for enterprise versions
+            else:
+                client.connect(username, password)
+            _clients[registry_key] = client
+        return client
+
+
+def close_clients():
+    """
+    Closes all the clients connected by this process, e.g. on shutdown.
+    Backends connect again lazily if they are used afterwards.
+    """
+    global _clients_pid, _epoch
+    with _clients_lock:
+        if os.getpid() == _clients_pid:
+            for client in _clients.values():
+                client.close()
+        _clients.clear()
+        _clients_pid = os.getpid()
+        _epoch += 1
@@ -0,0 +1,43 @@
+"Process wide worker pools for the bulk operations"
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+_executors = {}
+_executors_lock = threading.Lock()
+#marks the threads of the pools
+_local = threading.local()
+
+
+def _enter_pool():
+    _local.on_pool = True
+
+
+def on_pool_thread():
+    """
+    Returns True on a thread of a pool of get_executor. Work running there
+    must not wait on work it submits to the pool, all the other threads of
+    which may be waiting the same way.
+    """
+    return getattr(_local, 'on_pool', False)
+
+
+def get_executor(max_workers):
+    """
+    Returns the process wide pool of max_workers threads, created on first
+    use, that the bulk operations of all the backends fan their requests out
+    over. It outlives the requests, so no threads are started per request. A
+    new pool is made after a fork, the parent's threads do not exist in the
+    child.
+    """
+    key = (os.getpid(), max_workers)
+    executor = _executors.get(key)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(key)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=max_workers,
+                                              initializer=_enter_pool)
+                _executors[key] = executor
+    return executor
@@ -0,0 +1,35 @@
+"Helpers to build aerospike keys, digest-only keys and their memo"
+
+
+class Digest(bytearray):
+    """
+    The digest of a record, as sent in a digest-only key. The client wants a
+    bytearray, this one can also be used as a dict key, e.g. by the near
+    cache. It must not be modified.
+    """
+    __slots__ = ()
+
+    def __hash__(self):
+        return hash(bytes(self))
+
+
+class KeyMemo(object):
+    """
+    A bounded memo of the aerospike keys built for (key, version, clear
+    generation), so hot keys skip KEY_FUNCTION and the digest computation.
+    When full it is simply emptied, which keeps the lookups free of locking
+    and bookkeeping.
+    """
+    __slots__ = ('max_entries', '_data')
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = {}
+
+    def get(self, memo_key):
+        return self._data.get(memo_key)
+
+    def set(self, memo_key, aero_key):
+        if len(self._data) >= self.max_entries:
+            self._data.clear()
+        self._data[memo_key] = aero_key
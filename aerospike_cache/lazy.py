@@ -0,0 +1,142 @@
+"Deferred gets resolved together with one batch read"
+from django.utils.functional import SimpleLazyObject
+
+from aerospike_cache.nearcache import MISSING
+
+
+class Deferred(object):
+    """
+    The future value of a deferred get. result() resolves, with one batch
+    read, all the gets deferred so far in the thread.
+    """
+    __slots__ = ('_batch', 'aero_key', 'key', 'version', 'default', '_value')
+
+    def __init__(self, batch, aero_key, key, version, default):
+        self._batch = batch
+        self.aero_key = aero_key
+        self.key = key
+        self.version = version
+        self.default = default
+        self._value = MISSING
+
+    def done(self):
+        return self._value is not MISSING
+
+    def result(self):
+        if self._value is MISSING:
+            #pending again if the batch was cleared meanwhile
+            self._batch._add(self)
+            self._batch.resolve()
+        #used, a later get reads the key again
+        self._batch.forget(self.aero_key)
+        return self._value
+
+    def _set(self, value):
+        self._value = self.default if value is MISSING else value
+
+
+def lazy_value(deferred):
+    """
+    A proxy of the value of deferred, resolving it on first use. It can not
+    be told apart from a missing key with "is None", use the deferred then.
+    """
+    return SimpleLazyObject(deferred.result)
+
+
+class LazyBatch(object):
+    """
+    The gets deferred by one thread. They are resolved all at once, with
+    get_many(keys, version) called for each version, when the value of one
+    of them is needed. The outcome of each key is kept until a get of that
+    key or its deferred uses it, so gets of the deferred keys made one after
+    the other afterwards, e.g. by the cache template tag, cost no more
+    requests. The outcomes not used are dropped by the next resolve, they
+    would go stale otherwise.
+    """
+    def __init__(self, get_many):
+        self._get_many = get_many
+        #aero key -> (key, version, [deferred])
+        self._pending = {}
+        #aero key -> value or MISSING, the outcome not yet taken by a get
+        self._resolved = {}
+
+    def __len__(self):
+        return len(self._pending) + len(self._resolved)
+
+    def defer(self, aero_key, key, version, default=None):
+        """
+        Adds a get of key to the batch, returns its Deferred.
+        """
+        deferred = Deferred(self, aero_key, key, version, default)
+        self._resolved.pop(aero_key, None)
+        self._add(deferred)
+        return deferred
+
+    def _add(self, deferred):
+        entry = self._pending.get(deferred.aero_key)
+        if entry is None:
+            self._pending[deferred.aero_key] = (
+                deferred.key, deferred.version, [deferred])
+        elif deferred not in entry[2]:
+            entry[2].append(deferred)
+
+    def include(self, items, version):
+        """
+        Adds the (aero key, key) items not pending, if some gets are, so they
+        are read along with them instead of on their own.
+        """
+        if not self._pending:
+            return
+        for aero_key, key in items:
+            if aero_key not in self._pending:
+                self._pending[aero_key] = (key, version, [])
+
+    def take(self, aero_key):
+        """
+        Returns the outcome of the deferred get of aero_key, resolving the
+        batch if needed, MISSING if not found, None if aero_key is not in the
+        batch.
+        """
+        if aero_key in self._pending:
+            self.resolve()
+        return self._resolved.pop(aero_key, None)
+
+    def forget(self, aero_key):
+        """
+        Drops the outcome of aero_key, as it is used or written.
+        """
+        self._resolved.pop(aero_key, None)
+
+    def clear(self):
+        """
+        Drops the pending gets and the outcomes not taken, e.g. at the end of
+        a request. A deferred dropped is read on its own if used later.
+        """
+        self._pending.clear()
+        self._resolved.clear()
+
+    def resolve(self):
+        """
+        Reads all the pending keys, with one request per version and batch
+        size, and hands their values to their deferreds.
+        """
+        pending, self._pending = self._pending, {}
+        self._resolved.clear()
+        by_version = {}
+        for aero_key, (key, version, deferreds) in pending.items():
+            by_version.setdefault(version, []).append(
+                (aero_key, key, deferreds))
+        for version, entries in by_version.items():
+            try:
+                found = self._get_many([entry[1] for entry in entries],
+                                       version)
+            except Exception:
+                #the deferreds stay pending for a later try
+                for aero_key, key, deferreds in entries:
+                    self._pending[aero_key] = (key, version, deferreds)
+                raise
+            for aero_key, key, deferreds in entries:
+                value = found.get(key, MISSING)
+                self._resolved[aero_key] = value
+                for deferred in deferreds:
+                    deferred._set(value)
@@ -0,0 +1,291 @@
+"Per-operation counters, latency histograms and byte counters"
+import threading
+import time
+
+from aerospike_cache.executors import on_pool_thread
+from aerospike_cache.nearcache import MISSING
+
+#perf_counter is not in python 2
+clock = getattr(time, 'perf_counter', time.time)
+
+#latencies are counted in power of two buckets of microseconds, the last
+#one holds everything from about 17 minutes up
+BUCKETS = 31
+
+#the methods of AerospikeCache timed and counted when metrics are enabled
+OPERATIONS = (
+    'get', 'get_many', 'has_key', 'get_fields', 'get_many_fields', 'set',
+    'add', 'set_many', 'delete', 'delete_many', 'get_or_set', 'incr',
+    'incr_many', 'touch', 'touch_many', 'update_fields', 'list_append',
+    'list_trim', 'list_range', 'map_put', 'map_incr', 'map_remove', 'map_get',
+    'invalidate_tags', 'clear',
+)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_metrics(name, exporter=None, export_interval=60):
+    """
+    Returns the process wide metrics registered under name, creating them on
+    first use, so the backends of all the threads add up in one place.
+    """
+    with _registry_lock:
+        metrics = _registry.get(name)
+        if metrics is None:
+            metrics = Metrics(exporter, export_interval)
+            _registry[name] = metrics
+        return metrics
+
+
+class OperationStats(object):
+    """
+    The counters of one operation.
+    """
+    __slots__ = ('calls', 'errors', 'hits', 'misses', 'total', 'max',
+                 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.hits = 0
+        self.misses = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def snapshot(self):
+        histogram = {}
+        for index, count in enumerate(self.buckets):
+            if count:
+                #upper bound of the bucket in microseconds
+                histogram[1 << index] = count
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'hits': self.hits,
+            'misses': self.misses,
+            'total_ms': self.total * 1000,
+            'max_ms': self.max * 1000,
+            'histogram_us': histogram,
+            'p50_ms': self._percentile(0.5),
+            'p99_ms': self._percentile(0.99),
+        }
+
+    def _percentile(self, fraction):
+        """
+        The upper bound, in ms, of the bucket holding the given percentile.
+        """
+        if not self.calls:
+            return 0.0
+        rank = fraction * self.calls
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return (1 << index) / 1000.0
+        return (1 << (BUCKETS - 1)) / 1000.0
+
+
+class Metrics(object):
+    """
+    Thread safe counters of the cache operations: calls, errors, hits and
+    misses, latencies, and bytes encoded and decoded by the codec. When an
+    exporter is given it is called with the stats() snapshot at most every
+    export_interval seconds, from the thread of the operation that finds it
+    due, so it should be quick, e.g. a statsd push.
+    """
+    def __init__(self, exporter=None, export_interval=60):
+        self.exporter = exporter
+        self.export_interval = export_interval
+        self._next_export = time.time() + export_interval
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._ops = {}
+        self.bytes_encoded = 0
+        self.bytes_decoded = 0
+        self.reported_errors = 0
+
+    def record(self, op, duration, error=False, hits=0, misses=0):
+        """
+        Records a call to op which took duration seconds.
+        """
+        index = min(int(duration * 1000000).bit_length(), BUCKETS - 1)
+        with self._lock:
+            stats = self._ops.get(op)
+            if stats is None:
+                stats = self._ops[op] = OperationStats()
+            stats.calls += 1
+            stats.total += duration
+            if duration > stats.max:
+                stats.max = duration
+            stats.buckets[index] += 1
+            if error:
+                stats.errors += 1
+            stats.hits += hits
+            stats.misses += misses
+        if self.exporter is not None and time.time() >= self._next_export:
+            self.export()
+
+    def encoded(self, size):
+        with self._lock:
+            self.bytes_encoded += size
+
+    def decoded(self, size):
+        with self._lock:
+            self.bytes_decoded += size
+
+    def error(self):
+        """
+        Counts an error reported rather than raised by an operation.
+        """
+        with self._lock:
+            self.reported_errors += 1
+
+    def stats(self):
+        """
+        Returns a snapshot of all the counters.
+        """
+        with self._lock:
+            return {
+                'operations': dict((op, stats.snapshot())
+                                   for op, stats in self._ops.items()),
+                'bytes_encoded': self.bytes_encoded,
+                'bytes_decoded': self.bytes_decoded,
+                'reported_errors': self.reported_errors,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._ops = {}
+            self.bytes_encoded = 0
+            self.bytes_decoded = 0
+            self.reported_errors = 0
+
+    def export(self):
+        """
+        Passes the current stats to the exporter.
+        """
+        self._next_export = time.time() + self.export_interval
+        try:
+            self.exporter(self.stats())
+        except Exception:
+            #an exporter failure must not fail the cache operation
+            self.error()
+
+    def instrument(self, cache):
+        """
+        Replaces the operations of the cache backend instance with timed and
+        counted wrappers, so a backend without metrics pays nothing.
+        """
+        for op in OPERATIONS:
+            func = getattr(cache, op)
+            wrap = getattr(self, '_wrap_' + op, self._wrap)
+            setattr(cache, op, self._outermost(func, wrap(op, func)))
+
+    def _outermost(self, func, metered):
+        """
+        Counts only the calls made by the application, not those made by
+        another counted operation, e.g. the add of get_or_set or the set of
+        each key of set_many, which runs on the worker pool.
+        """
+        local = self._local
+
+        def call(*args, **kwargs):
+            if getattr(local, 'active', False) or on_pool_thread():
+                return func(*args, **kwargs)
+            local.active = True
+            try:
+                return metered(*args, **kwargs)
+            finally:
+                local.active = False
+        return call
+
+    def _wrap(self, op, func):
+        def call(*args, **kwargs):
+            started = clock()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                self.record(op, clock() - started, error=True)
+                raise
+            self.record(op, clock() - started)
+            return result
+        return call
+
+    def _wrap_get(self, op, func):
+        def get(key, default=None, version=None):
+            started = clock()
+            try:
+                value = func(key, MISSING, version)
+            except Exception:
+                self.record(op, clock() - started, error=True)
+                raise
+            if value is MISSING:
+                self.record(op, clock() - started, misses=1)
+                return default
+            self.record(op, clock() - started, hits=1)
+            return value
+        return get
+
+    def _wrap_get_many(self, op, func):
+        def get_many(keys, *args, **kwargs):
+            #counted once read, which would use up an iterator
+            keys = list(keys)
+            started = clock()
+            try:
+                result = func(keys, *args, **kwargs)
+            except Exception:
+                self.record(op, clock() - started, error=True)
+                raise
+            self.record(op, clock() - started, hits=len(result),
+                        misses=max(len(keys) - len(result), 0))
+            return result
+        return get_many
+
+    _wrap_get_many_fields = _wrap_get_many
+
+    def _wrap_has_key(self, op, func):
+        def has_key(*args, **kwargs):
+            started = clock()
+            try:
+                found = func(*args, **kwargs)
+            except Exception:
+                self.record(op, clock() - started, error=True)
+                raise
+            self.record(op, clock() - started, hits=int(bool(found)),
+                        misses=int(not found))
+            return found
+        return has_key
+
+    _wrap_get_fields = _wrap_has_key
+
+
+class MeteredCodec(object):
+    """
+    Wraps the codec of a backend to count the bytes of the blobs and strings
+    it encodes and decodes.
+    """
+    __slots__ = ('codec', 'metrics')
+
+    sized_types = (bytearray, bytes, str)
+
+    def __init__(self, codec, metrics):
+        self.codec = codec
+        self.metrics = metrics
+
+    def encode(self, value):
+        value = self.codec.encode(value)
+        if isinstance(value, self.sized_types):
+            self.metrics.encoded(len(value))
+        return value
+
+    def dumps(self, value):
+        value = self.codec.dumps(value)
+        self.metrics.encoded(len(value))
+        return value
+
+    def decode(self, value):
+        if isinstance(value, self.sized_types):
+            self.metrics.decoded(len(value))
+        return self.codec.decode(value)
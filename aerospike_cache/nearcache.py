@@ -0,0 +1,124 @@
+"In-process near cache kept in front of the aerospike cluster"
+import threading
+import time
+from collections import OrderedDict
+
+#returned by NearCache.get when there is no usable entry
+MISSING = object()
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_near_cache(name, max_entries, ttl):
+    """
+    Returns the process wide near cache registered under name, creating it
+    on first use. Django builds a cache backend instance per thread, sharing
+    the near cache lets all of them benefit from each other's reads.
+    """
+    with _registry_lock:
+        near_cache = _registry.get(name)
+        if near_cache is None:
+            near_cache = NearCache(max_entries, ttl)
+            _registry[name] = near_cache
+        return near_cache
+
+
+class NearCache(object):
+    """
+    A bounded, thread safe LRU map of aerospike key to the raw bin value and
+    the record generation it was read at.
+
+    An entry is served for at most ttl seconds (less if the record itself
+    expires sooner). Past that it is either dropped or, when the caller can
+    confirm the record generation did not change, kept for another ttl.
+    """
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def get(self, key, validate=None):
+        """
+        Returns the value cached for key, or MISSING.
+
+        validate, if given, is called with the generation of an expired entry
+        and should return True if the record is unchanged on the server.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, generation, expires = entry
+            if expires > now:
+                #re-insert to mark it as most recently used
+                self._data[key] = entry
+                self.hits += 1
+                return value
+
+        #validate outside the lock, it is a round trip to the server
+        if validate is not None and generation is not None:
+            try:
+                valid = validate(generation)
+            except Exception:
+                valid = False
+            if valid:
+                self.set(key, value, generation)
+                with self._lock:
+                    self.hits += 1
+                    self.revalidations += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return MISSING
+
+    def set(self, key, value, generation=None, ttl=None):
+        """
+        Caches value for key. ttl is the remaining lifetime of the record on
+        the server, the entry never outlives it.
+        """
+        lifetime = self.ttl
+        if ttl and ttl > 0:
+            lifetime = min(lifetime, ttl)
+        expires = time.time() + lifetime
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, generation, expires)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """
+        Drops the entry for key, if any.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Drops all the entries.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        Returns a snapshot of the near cache counters.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions,
+            }
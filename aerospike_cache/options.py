@@ -0,0 +1,381 @@
+"Settings of an aerospike cache backend, resolved once at construction"
+import aerospike
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from aerospike_cache.chunks import CHUNKS_BIN
+from aerospike_cache.tags import TAGS_BIN
+from aerospike_cache.serializers import Codec, get_serializer, get_compressor
+from aerospike_cache.writebehind import BLOCK, FULL_POLICIES
+
+#bin marking an entry stored one bin per dict field, in STRUCTURED mode
+FIELDS_BIN = "fields"
+
+#used when the cache params have no OPTIONS
+DEFAULT_OPTIONS = {
+    'HOST': "127.0.0.1",
+    'PORT': 3000,
+    'NAMESPACE': "test",
+    'SET': "cache",
+    'BIN': "entry",
+    'TIMEOUT': 10000,
+}
+
+
+class CacheOptions(object):
+    """
+    The settings of a cache backend, read from LOCATION and the cache params
+    or OPTIONS once, so the per-operation code only does attribute lookups
+    and reuses the prebuilt key prefix, meta and policy dicts.
+    """
+    __slots__ = (
+        'params', 'options', 'server', 'hosts', 'username', 'password',
+        'namespace', 'set', 'bin', 'ttl', 'meta', 'key_prefix', 'policy',
+        'policies', 'client_config', 'concurrency', 'batch_size',
+        'near_cache_size', 'near_cache_ttl', 'near_cache_validate', 'codec',
+        'update_policy', 'incr_meta', '_read_op', 'clear_mode',
+        'clear_background', 'clear_rate', 'generation_key', 'generation_meta',
+        'generation_ttl', 'digest_keys', 'key_memo_size', 'async_workers',
+        'create_policy', 'lock_meta', 'stampede_wait', 'stampede_poll',
+        'stampede_beta', 'stale_ttl', 'refresh_workers', 'refresh_max_pending',
+        'sliding_expiration', 'read_ops', 'chunk_size', 'chunk_read_ops',
+        'structured', 'replace_policy', 'gen_replace_policy', 'select_bins', 'tag_ttl', 'breaker',
+        'metrics', 'trace', 'write_behind', 'coalesce_reads', 'coalesce_wait',
+    )
+
+    def __init__(self, server, params):
+        self.params = params or {}
+        self.options = self.params.get('OPTIONS', DEFAULT_OPTIONS)
+        self.server = server or "127.0.0.1:3000"
+        self.hosts = self._parse_hosts(self.server)
+        self.username = self.params.get('username', self.options.get('USERNAME', None))
+        self.password = self.params.get('password', self.options.get('PASSWORD', None))
+
+        self.namespace = self.option('NAMESPACE', "test")
+        self.set = self.option('SET', "cache")
+        self.bin = self.option('BIN', "entry")
+        self.key_prefix = (self.namespace, self.set)
+        #send keys as digests only, and memoize the keys built for hot keys
+        self.digest_keys = bool(self.option('DIGEST_KEYS', False))
+        self.key_memo_size = int(self.option('KEY_MEMO_SIZE', 0))
+
+        #the timeout in django cache is the ttl of the record in aerospike
+        self.ttl = self.params.get('TIMEOUT', 10000)
+        self.meta = {'ttl': self.ttl}
+
+        #store the digest rather than the key along with the record
+        self.policy = {
+            'key': aerospike.POLICY_KEY_DIGEST
+        }
+        #add only creates records
+        self.create_policy = {
+            'key': aerospike.POLICY_KEY_DIGEST,
+            'exists': aerospike.POLICY_EXISTS_CREATE,
+        }
+        #in structured mode a value replaces all the bins of the previous one
+        self.replace_policy = {
+            'key': aerospike.POLICY_KEY_DIGEST,
+            'exists': aerospike.POLICY_EXISTS_CREATE_OR_REPLACE,
+        }
+        #add replaces an entry get does not serve only if it is unchanged
+        self.gen_replace_policy = {
+            'key': aerospike.POLICY_KEY_DIGEST,
+            'exists': aerospike.POLICY_EXISTS_REPLACE,
+            'gen': aerospike.POLICY_GEN_EQ,
+        }
+        #counters are only updated, never created, by incr, nor touched
+        #records by touch
+        self.update_policy = {
+            'key': aerospike.POLICY_KEY_DIGEST,
+            'exists': aerospike.POLICY_EXISTS_UPDATE,
+        }
+        #keep the record ttl on incr, when the client/server support it
+        ttl_dont_update = getattr(aerospike, 'TTL_DONT_UPDATE', None)
+        self.incr_meta = None
+        if ttl_dont_update is not None:
+            self.incr_meta = {'ttl': ttl_dont_update}
+        self._read_op = {'op': aerospike.OPERATOR_READ, 'bin': self.bin}
+        self.policies = self._compile_policies()
+        #any of the seed hosts is enough to discover the whole cluster, the
+        #policies are client wide defaults
+        self.client_config = {
+            "hosts": self.hosts,
+            "policies": self.policies,
+        }
+        max_conns = self.option('MAX_CONNS_PER_NODE')
+        if max_conns is not None:
+            self.client_config["max_conns_per_node"] = int(max_conns)
+
+        self.concurrency = int(self.option('CONCURRENCY', 8))
+        self.async_workers = int(self.option('ASYNC_WORKERS', 32))
+        self.batch_size = int(self.option('BATCH_SIZE', 1000))
+        self.near_cache_size = int(self.option('NEAR_CACHE_SIZE', 0))
+        self.near_cache_ttl = float(self.option('NEAR_CACHE_TTL', 1))
+        self.near_cache_validate = bool(self.option('NEAR_CACHE_VALIDATE', False))
+        self.codec = self._build_codec()
+        #values larger than CHUNK_SIZE bytes are split across records
+        self.chunk_size = int(self.option('CHUNK_SIZE', 0))
+        #the tag versions of an entry are read along with it
+        self.read_ops = [self._read_op,
+                         {'op': aerospike.OPERATOR_READ, 'bin': TAGS_BIN}]
+        self.chunk_read_ops = [self._read_op]
+        if self.chunk_size:
+            self.read_ops.append({'op': aerospike.OPERATOR_READ,
+                                  'bin': CHUNKS_BIN})
+        #dicts are stored one bin per field, which can be read on their own
+        self.structured = bool(self.option('STRUCTURED', False))
+        if self.structured:
+            self.read_ops.append({'op': aerospike.OPERATOR_READ,
+                                  'bin': FIELDS_BIN})
+        #the bins read along with the selected fields of an entry
+        self.select_bins = [FIELDS_BIN, self.bin, TAGS_BIN]
+        if self.chunk_size:
+            self.select_bins.append(CHUNKS_BIN)
+
+        #get_or_set locks and early refreshes
+        self.lock_meta = {'ttl': int(self.option('STAMPEDE_LOCK_TTL', 10))}
+        self.stampede_wait = float(self.option('STAMPEDE_WAIT', 2))
+        self.stampede_poll = float(self.option('STAMPEDE_POLL', 0.05))
+        self.stampede_beta = float(self.option('STAMPEDE_BETA', 1))
+
+        #stale-while-revalidate: records outlive their timeout by STALE_TTL s
+        self.stale_ttl = int(self.option('STALE_TTL', 0))
+        self.refresh_workers = int(self.option('REFRESH_WORKERS', 4))
+        self.refresh_max_pending = int(self.option('REFRESH_MAX_PENDING', 100))
+        #get pushes the expiration back, like a touch
+        self.sliding_expiration = bool(self.option('SLIDING_EXPIRATION', False))
+
+        self.breaker = self._breaker_settings()
+        self.metrics = self._metrics_settings()
+        self.write_behind = self._write_behind_settings()
+        #concurrent gets of a key share one request, waiting for it at most
+        #COALESCE_WAIT seconds
+        self.coalesce_reads = bool(self.option('COALESCE_READS', False))
+        self.coalesce_wait = float(self.option('COALESCE_WAIT', 1))
+        #sampled operations are appended to TRACE_FILE, for replays
+        self.trace = None
+        if self.option('TRACE_FILE'):
+            self.trace = {'path': self.option('TRACE_FILE'),
+                          'sample': float(self.option('TRACE_SAMPLE', 1))}
+
+        self.clear_mode = self.option('CLEAR_MODE', 'scan')
+        if self.clear_mode not in ('scan', 'truncate', 'generation'):
+            raise ImproperlyConfigured(
+                "CLEAR_MODE must be 'scan', 'truncate' or 'generation'")
+        self.clear_background = bool(self.option('CLEAR_BACKGROUND', False))
+        self.clear_rate = int(self.option('CLEAR_RATE', 0))
+        #the record holding the clear generation never expires
+        self.generation_key = self.key_prefix + ("__clear_generation__",)
+        self.generation_meta = {'ttl': -1}
+        self.generation_ttl = float(self.option('CLEAR_GENERATION_TTL', 1))
+        #tag versions are reread at most every TAG_VERSION_TTL seconds
+        self.tag_ttl = float(self.option('TAG_VERSION_TTL', 1))
+
+    def incr_ops(self, delta):
+        """
+        The operate() operations adding delta to the bin and reading it back.
+        """
+        return [{'op': aerospike.OPERATOR_INCR, 'bin': self.bin, 'val': delta},
+                self._read_op]
+
+    def option(self, name, default=None):
+        """
+        The value of a setting given either in the cache params or in OPTIONS.
+        """
+        return self.params.get(name, self.options.get(name, default))
+
+    def _build_codec(self):
+        """
+        Builds the codec for the values from the options:
+        SERIALIZER - 'pickle' (the default), 'json' or 'msgpack'
+        COMPRESSOR - None (the default), 'zlib', 'lz4' or 'zstd'
+        COMPRESS_MIN_SIZE - payloads smaller than this many bytes are not
+        compressed, defaults to 1024
+        """
+        serializer = self.option('SERIALIZER', 'pickle')
+        compressor = self.option('COMPRESSOR')
+        try:
+            serializer = get_serializer(serializer)
+            if compressor is not None:
+                compressor = get_compressor(compressor)
+        except KeyError as e:
+            raise ImproperlyConfigured(
+                "unknown cache serializer or compressor {0}".format(e))
+        except ImportError as e:
+            raise ImproperlyConfigured(
+                "cache serializer or compressor is not available: {0}".format(e))
+        return Codec(serializer, compressor,
+                     int(self.option('COMPRESS_MIN_SIZE', 1024)))
+
+    def _breaker_settings(self):
+        """
+        The circuit breaker settings from the options, None unless
+        CIRCUIT_BREAKER is set:
+        BREAKER_ERROR_RATE - failure rate opening the circuit, 0.5 by default
+        BREAKER_MIN_CALLS - calls needed before it can open, 20 by default
+        BREAKER_WINDOW - how many of the last calls are tracked, 100 by default
+        BREAKER_SLOW_CALL_MS - calls slower than this count as failures, off
+        by default
+        BREAKER_OPEN_SECONDS - how long calls fail fast, 5 by default
+        BREAKER_PROBES - successful probe calls closing it again, 3 by default
+        BREAKER_CALLBACK - callable, or its dotted path, called with the old
+        state, the new state and the breaker on changes. Logs to the
+        'aerospike_cache' logger by default.
+        """
+        if not self.option('CIRCUIT_BREAKER', False):
+            return None
+        settings = {
+            'error_rate': float(self.option('BREAKER_ERROR_RATE', 0.5)),
+            'min_calls': int(self.option('BREAKER_MIN_CALLS', 20)),
+            'window': int(self.option('BREAKER_WINDOW', 100)),
+            'slow_call_ms': float(self.option('BREAKER_SLOW_CALL_MS', 0)),
+            'open_seconds': float(self.option('BREAKER_OPEN_SECONDS', 5)),
+            'probes': int(self.option('BREAKER_PROBES', 3)),
+        }
+        callback = self._callable('BREAKER_CALLBACK')
+        if callback is not None:
+            settings['on_state_change'] = callback
+        return settings
+
+    def _metrics_settings(self):
+        """
+        The metrics settings from the options, None unless METRICS is set:
+        METRICS_EXPORTER - callable, or its dotted path, called with the
+        stats snapshot
+        METRICS_EXPORT_INTERVAL - seconds between exports, 60 by default
+        """
+        if not self.option('METRICS', False):
+            return None
+        return {
+            'exporter': self._callable('METRICS_EXPORTER'),
+            'export_interval': float(self.option('METRICS_EXPORT_INTERVAL', 60)),
+        }
+
+    def _write_behind_settings(self):
+        """
+        The write-behind buffer settings from the options, None unless
+        WRITE_BEHIND is set:
+        WRITE_BEHIND_MAX_SIZE - pending writes at most, 10000 by default
+        WRITE_BEHIND_BATCH_SIZE - writes sent at a time, and pending writes
+        sent at once, 100 by default
+        WRITE_BEHIND_INTERVAL - seconds fewer writes wait, 0.1 by default
+        WRITE_BEHIND_FULL - 'block' (the default), 'sync' or 'drop', what a
+        write does when the buffer is full
+        WRITE_BEHIND_BLOCK_SECONDS - how long 'block' waits for room before
+        writing synchronously, 1 by default
+        WRITE_BEHIND_WORKERS - threads sending a batch, 4 by default
+        """
+        if not self.option('WRITE_BEHIND', False):
+            return None
+        full = self.option('WRITE_BEHIND_FULL', BLOCK)
+        if full not in FULL_POLICIES:
+            raise ImproperlyConfigured(
+                "WRITE_BEHIND_FULL must be 'block', 'sync' or 'drop'")
+        return {
+            'max_size': int(self.option('WRITE_BEHIND_MAX_SIZE', 10000)),
+            'batch_size': int(self.option('WRITE_BEHIND_BATCH_SIZE', 100)),
+            'interval': float(self.option('WRITE_BEHIND_INTERVAL', 0.1)),
+            'full': full,
+            'block_seconds': float(self.option('WRITE_BEHIND_BLOCK_SECONDS', 1)),
+            'workers': int(self.option('WRITE_BEHIND_WORKERS', 4)),
+        }
+
+    def _callable(self, name):
+        """
+        The callable given by the option name, either itself or as a dotted
+        path, None if the option is not set.
+        """
+        value = self.option(name)
+        if value is None or callable(value):
+            return value
+        try:
+            return import_string(value)
+        except ImportError as e:
+            raise ImproperlyConfigured(
+                "cannot import {0}: {1}".format(name, e))
+
+    @staticmethod
+    def _parse_hosts(server):
+        """
+        Returns the list of (host, port) seed nodes. LOCATION is either a list
+        of host:port strings or a single string of them separated by ',' or
+        ';'. The port defaults to 3000.
+        """
+        if isinstance(server, (list, tuple)):
+            servers = server
+        else:
+            servers = server.replace(';', ',').split(',')
+        hosts = []
+        for server in servers:
+            server = server.strip()
+            if not server:
+                continue
+            if ':' in server:
+                host, port = server.rsplit(':', 1)
+                try:
+                    port = int(port)
+                except (ValueError, TypeError):
+                    raise ImproperlyConfigured("port value must be an integer")
+            else:
+                host, port = server, 3000
+            hosts.append((host, port))
+        return hosts
+
+    @staticmethod
+    def _constant(prefix, value):
+        """
+        Resolves a policy value given by name, e.g. 'master' for
+        aerospike.POLICY_REPLICA_MASTER. Integers are used as they are.
+        """
+        if isinstance(value, int):
+            return value
+        try:
+            return getattr(aerospike, prefix + str(value).upper())
+        except AttributeError:
+            raise ImproperlyConfigured(
+                "unknown aerospike policy value {0}{1}".format(
+                    prefix, str(value).upper()))
+
+    def _compile_policies(self):
+        """
+        Builds the client wide policies from the options:
+        SOCKET_TIMEOUT - socket idle timeout in milliseconds
+        TOTAL_TIMEOUT - total transaction timeout in milliseconds
+        MAX_RETRIES - retries before giving up on a transaction
+        REPLICA - which replica to read from, e.g. 'master', 'sequence',
+        'prefer_rack'
+        COMMIT_LEVEL - 'all' or 'master'
+        POLICIES - raw client policies by type ('read', 'write', ...) which
+        are merged over the above
+        """
+        common = {}
+        for option, name in (('SOCKET_TIMEOUT', 'socket_timeout'),
+                             ('TOTAL_TIMEOUT', 'total_timeout'),
+                             ('MAX_RETRIES', 'max_retries')):
+            value = self.option(option)
+            if value is not None:
+                common[name] = int(value)
+
+        read = dict(common)
+        replica = self.option('REPLICA')
+        if replica is not None:
+            read['replica'] = self._constant('POLICY_REPLICA_', replica)
+
+        write = dict(common)
+        commit_level = self.option('COMMIT_LEVEL')
+        if commit_level is not None:
+            write['commit_level'] = self._constant('POLICY_COMMIT_LEVEL_',
+                                                   commit_level)
+
+        policies = {
+            'read': read,
+            'batch': dict(read),
+            'write': write,
+            'remove': dict(write),
+            'operate': dict(write),
+        }
+        for name, policy in self.option('POLICIES', {}).items():
+            policies.setdefault(name, {}).update(policy)
+        return dict((name, policy) for name, policy in policies.items()
+                    if policy)
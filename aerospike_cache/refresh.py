@@ -0,0 +1,111 @@
+"Background refreshes of stale values, for the stale-while-revalidate mode"
+from __future__ import print_function
+import os
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_refresher(name, max_workers, max_pending):
+    """
+    Returns the process wide refresher registered under name, creating it
+    on first use, so refresh callables registered from one thread serve the
+    cache backends of all the threads.
+    """
+    with _registry_lock:
+        refresher = _registry.get(name)
+        if refresher is None:
+            refresher = Refresher(max_workers, max_pending)
+            _registry[name] = refresher
+        return refresher
+
+
+class Refresher(object):
+    """
+    Runs refresh tasks on a bounded pool of worker threads, at most one at a
+    time per aerospike key and at most max_pending in all. Tasks are
+    registered by key ahead of time, or given when asking for the refresh.
+    """
+    def __init__(self, max_workers, max_pending):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._tasks = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self.scheduled = 0
+        self.deduplicated = 0
+        self.dropped = 0
+
+    def register(self, aero_key, task):
+        """
+        Registers the callable refreshing the value of aero_key.
+        """
+        with self._lock:
+            self._tasks[aero_key] = task
+
+    def unregister(self, aero_key):
+        with self._lock:
+            self._tasks.pop(aero_key, None)
+
+    def refresh(self, aero_key, task=None):
+        """
+        Schedules task, or the one registered for aero_key, unless a refresh
+        of aero_key is already pending. Returns False if there is no task, in
+        which case the stale value should not be served.
+        """
+        with self._lock:
+            if task is None:
+                task = self._tasks.get(aero_key)
+                if task is None:
+                    return False
+            executor = self._get_executor()
+            if aero_key in self._pending:
+                self.deduplicated += 1
+                return True
+            if len(self._pending) >= self.max_pending:
+                #too busy, a later read will ask again
+                self.dropped += 1
+                return True
+            self._pending.add(aero_key)
+            self.scheduled += 1
+        executor.submit(self._run, aero_key, task)
+        return True
+
+    def _run(self, aero_key, task):
+        try:
+            task()
+        except Exception as e:
+            print("error: {0}".format(e), file=sys.stderr)
+        finally:
+            with self._lock:
+                self._pending.discard(aero_key)
+
+    def _get_executor(self):
+        """
+        The worker pool, made again after a fork as the parent's threads do
+        not exist in the child. Called with the lock held.
+        """
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            self._executor_pid = pid
+            self._pending.clear()
+        return self._executor
+
+    def stats(self):
+        """
+        Returns a snapshot of the refresher counters.
+        """
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'scheduled': self.scheduled,
+                'deduplicated': self.deduplicated,
+                'dropped': self.dropped,
+            }
@@ -0,0 +1,209 @@
+"Serializers and compressors for the values aerospike can not store natively"
+import json
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+#blobs written with a header start with this byte, which is not a pickle
+#opcode, so blobs pickled by older versions are still told apart
+MAGIC = 0
+HEADER_SIZE = 3
+
+
+class PickleSerializer(object):
+    """
+    Pickles with the highest protocol available.
+    """
+    id = 1
+
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class JSONSerializer(object):
+    """
+    Only for values made of the json types, tuples come back as lists.
+    """
+    id = 2
+
+    def dumps(self, value):
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data.decode('utf-8'))
+
+
+class MsgpackSerializer(object):
+    """
+    Needs the 'msgpack' library, same value types as json but more compact.
+    """
+    id = 3
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def dumps(self, value):
+        return self._msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        return self._msgpack.unpackb(data, raw=False)
+
+
+class ZlibCompressor(object):
+    id = 1
+
+    def compress(self, data):
+        return zlib.compress(data)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class LZ4Compressor(object):
+    """
+    Needs the 'lz4' library.
+    """
+    id = 2
+
+    def __init__(self):
+        import lz4.frame
+        self._lz4 = lz4.frame
+
+    def compress(self, data):
+        return self._lz4.compress(data)
+
+    def decompress(self, data):
+        return self._lz4.decompress(data)
+
+
+class ZstdCompressor(object):
+    """
+    Needs the 'zstandard' library.
+    """
+    id = 3
+
+    def __init__(self):
+        import zstandard
+        self._compressor = zstandard.ZstdCompressor()
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+
+SERIALIZERS = {
+    'pickle': PickleSerializer,
+    'json': JSONSerializer,
+    'msgpack': MsgpackSerializer,
+}
+
+COMPRESSORS = {
+    'zlib': ZlibCompressor,
+    'lz4': LZ4Compressor,
+    'zstd': ZstdCompressor,
+}
+
+#header id -> class, and the instances made when a blob needs them
+_serializers_by_id = dict((cls.id, cls) for cls in SERIALIZERS.values())
+_compressors_by_id = dict((cls.id, cls) for cls in COMPRESSORS.values())
+_serializer_instances = {}
+_compressor_instances = {}
+
+
+def _by_id(classes, instances, id):
+    """
+    Returns the shared instance of the class with the given header id.
+    """
+    instance = instances.get(id)
+    if instance is None:
+        try:
+            instance = instances[id] = classes[id]()
+        except KeyError:
+            raise ValueError("unknown cache value format {0}".format(id))
+    return instance
+
+
+def get_serializer(name):
+    """
+    Returns the serializer registered under name, e.g. 'msgpack'.
+    """
+    return _by_id(_serializers_by_id, _serializer_instances,
+                  SERIALIZERS[name].id)
+
+
+def get_compressor(name):
+    """
+    Returns the compressor registered under name, e.g. 'zlib'.
+    """
+    return _by_id(_compressors_by_id, _compressor_instances,
+                  COMPRESSORS[name].id)
+
+
+class Codec(object):
+    """
+    Turns cache values into bin values and back.
+
+    ints, strings, lists and dicts are stored natively by the client, except
+    strings of at least min_size when compression is enabled. Everything
+    else is serialized into a blob with a 3 byte header: MAGIC, the
+    serializer id and the compressor id (0 for none). The payload is
+    compressed when it is at least min_size bytes long. Blobs are decoded by
+    the ids in their header whatever is configured, and blobs without header
+    are pickles from older versions.
+    """
+    __slots__ = ('serializer', 'compressor', 'min_size', '_header',
+                 '_compressed_header')
+
+    native_types = (int, str, list, dict)
+
+    def __init__(self, serializer, compressor=None, min_size=1024):
+        self.serializer = serializer
+        self.compressor = compressor
+        self.min_size = min_size
+        self._header = bytearray((MAGIC, serializer.id, 0))
+        self._compressed_header = bytearray(
+            (MAGIC, serializer.id, compressor.id if compressor else 0))
+
+    def encode(self, value):
+        """
+        Returns the bin value to store for value.
+        """
+        if isinstance(value, self.native_types):
+            if (self.compressor is None or not isinstance(value, str)
+                    or len(value) < self.min_size):
+                return value
+        return self.dumps(value)
+
+    def dumps(self, value):
+        """
+        Returns the blob for value, whatever its type.
+        """
+        data = self.serializer.dumps(value)
+        if self.compressor is not None and len(data) >= self.min_size:
+            return self._compressed_header + self.compressor.compress(data)
+        return self._header + data
+
+    def decode(self, value):
+        """
+        Returns the cache value for a bin value read back.
+        """
+        if not isinstance(value, bytearray):
+            return value
+        if not value or value[0] != MAGIC:
+            return pickle.loads(bytes(value))
+        data = bytes(value[HEADER_SIZE:])
+        if value[2]:
+            data = _by_id(_compressors_by_id, _compressor_instances,
+                          value[2]).decompress(data)
+        return _by_id(_serializers_by_id, _serializer_instances,
+                      value[1]).loads(data)
@@ -0,0 +1,111 @@
+"Coalescing of the concurrent reads of a key into one request"
+import threading
+
+#returned by FlightGroup.wait when the leader did not answer in time
+TIMED_OUT = object()
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_flight_group(name):
+    """
+    Returns the process wide flight group registered under name, creating it
+    on first use, so the reads of all the threads are coalesced.
+    """
+    with _registry_lock:
+        group = _registry.get(name)
+        if group is None:
+            group = FlightGroup()
+            _registry[name] = group
+        return group
+
+
+class Flight(object):
+    """
+    One read in flight, and the callers waiting for its result.
+    """
+    __slots__ = ('event', 'result', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.waiters = 0
+
+
+class FlightGroup(object):
+    """
+    The reads in flight by key. The first caller to join a key leads: it
+    makes the request and lands the flight with the result. The callers
+    joining the key meanwhile follow: they wait for that result instead of
+    making their own request.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def join(self, key):
+        """
+        Returns the flight of key and whether the caller leads it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Flight()
+                self.leaders += 1
+                return flight, True
+            flight.waiters += 1
+            self.coalesced += 1
+            return flight, False
+
+    def land(self, key, flight, result):
+        """
+        Hands result to the followers of the flight led by the caller.
+        Returns how many there are, no more can join.
+        """
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            waiters = flight.waiters
+        flight.result = result
+        flight.event.set()
+        return waiters
+
+    def detach(self, key=None):
+        """
+        Detaches the flight of key, of all the keys by default, as the value
+        it reads may predate a write: the callers joining the key afterwards
+        make a new request. The callers already following it still get its
+        result.
+        """
+        with self._lock:
+            if key is None:
+                self._flights.clear()
+            else:
+                self._flights.pop(key, None)
+
+    def wait(self, flight, timeout):
+        """
+        Waits up to timeout seconds for the result of a flight the caller
+        follows, returns TIMED_OUT if it does not come.
+        """
+        if flight.event.wait(timeout):
+            return flight.result
+        with self._lock:
+            self.timeouts += 1
+        return TIMED_OUT
+
+    def stats(self):
+        """
+        Returns a snapshot of the coalescing counters.
+        """
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts,
+            }
@@ -0,0 +1,69 @@
+"In-process cache of the tag versions used for group invalidation"
+import threading
+import time
+
+#bin of an entry holding the versions of its tags when it was set
+TAGS_BIN = "tag_versions"
+#the cache is emptied when it holds that many tags
+MAX_ENTRIES = 10000
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_tag_versions(name, ttl):
+    """
+    Returns the process wide tag version cache registered under name,
+    creating it on first use, so the backends of all the threads share the
+    versions they read.
+    """
+    with _registry_lock:
+        tag_versions = _registry.get(name)
+        if tag_versions is None:
+            tag_versions = TagVersions(ttl)
+            _registry[name] = tag_versions
+        return tag_versions
+
+
+class TagVersions(object):
+    """
+    A bounded, thread safe map of tag to its version on the server, each
+    version trusted for ttl seconds after it was read. A tag invalidated by
+    another process is seen within that delay.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, tags):
+        """
+        Returns the dict of the versions known for tags, and the list of the
+        tags to read from the server.
+        """
+        now = time.time()
+        versions = {}
+        missing = []
+        with self._lock:
+            for tag in tags:
+                entry = self._data.get(tag)
+                if entry is None or entry[1] <= now:
+                    missing.append(tag)
+                else:
+                    versions[tag] = entry[0]
+        return versions, missing
+
+    def update(self, versions):
+        """
+        Records the versions just read from, or written to, the server.
+        """
+        expires = time.time() + self.ttl
+        with self._lock:
+            if len(self._data) >= MAX_ENTRIES:
+                self._data.clear()
+            for tag, version in versions.items():
+                self._data[tag] = (version, expires)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
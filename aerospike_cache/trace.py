@@ -0,0 +1,505 @@
+"Recording of cache traffic to a trace file, and its replay"
+from __future__ import division
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from aerospike_cache.metrics import clock
+from aerospike_cache.nearcache import MISSING
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+#the fields of a trace line, separated by tabs
+FIELDS = ('time', 'op', 'keys', 'size', 'ttl', 'hits', 'latency_us')
+
+#the methods of AerospikeCache recorded when tracing is enabled
+#when enabled, set_many and delete_many show as the set and delete of each
+#key they issue
+OPERATIONS = (
+    'get', 'get_many', 'has_key', 'set', 'add', 'delete', 'get_or_set',
+    'incr', 'touch',
+)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_recorder(path, sample=1.0):
+    """
+    Returns the process wide recorder appending to the trace file at path,
+    creating it on first use, so all the backends write through one file.
+    """
+    with _registry_lock:
+        recorder = _registry.get(path)
+        if recorder is None:
+            recorder = Recorder(path, sample)
+            _registry[path] = recorder
+        return recorder
+
+
+def hash_key(key):
+    """
+    The short digest standing for a cache key in traces.
+    """
+    if not isinstance(key, bytes):
+        key = text_type(key).encode('utf-8')
+    return hashlib.sha1(key).hexdigest()[:16]
+
+
+def value_size(value):
+    """
+    The approximate size in bytes of a cached value: the length of blobs and
+    strings, 8 for numbers, the length of its pickle otherwise.
+    """
+    if isinstance(value, (bytes, bytearray, text_type, str)):
+        return len(value)
+    if isinstance(value, (int, float)) or value is None:
+        return 8
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 0
+
+
+class Recorder(object):
+    """
+    Appends one line per recorded operation to a trace file: the time, the
+    operation, the hashed keys, the value size, the ttl, the hits and the
+    latency in microseconds. Keys are sampled by their hash, so all the
+    operations of a sampled key are recorded and hit ratios stay meaningful.
+    Lines are written whole under a lock, a failed write only counts in
+    errors.
+    """
+    def __init__(self, path, sample=1.0):
+        self.path = path
+        self.sample = sample
+        #keys whose hash falls under this bound of 16 bits are recorded
+        self._bound = int(sample * 0x10000)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._file = None
+        self.recorded = 0
+        self.errors = 0
+
+    def sampled(self, hashed):
+        return int(hashed[:4], 16) < self._bound
+
+    def record(self, op, hashed_keys, size, ttl, hits, duration):
+        line = "%.6f\t%s\t%s\t%d\t%s\t%s\t%d\n" % (
+            time.time(), op, ",".join(hashed_keys), size,
+            "" if ttl is None else ttl, "" if hits is None else hits,
+            duration * 1000000)
+        try:
+            with self._lock:
+                if self._file is None:
+                    #line buffered, each line reaches the file whole
+                    self._file = open(self.path, 'a', 1)
+                self._file.write(line)
+                self.recorded += 1
+        except (IOError, OSError, ValueError):
+            self.errors += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        return {'recorded': self.recorded, 'errors': self.errors}
+
+    def instrument(self, cache):
+        """
+        Replaces the operations of the cache backend instance with wrappers
+        recording the sampled calls.
+        """
+        for op in OPERATIONS:
+            func = getattr(cache, op)
+            wrap = getattr(self, '_wrap_' + op)
+            setattr(cache, op,
+                    self._outermost(op, func, wrap(op, func, cache)))
+
+    def _outermost(self, op, func, recorded):
+        """
+        Records only the calls made by the application, not those made by
+        another recorded operation, e.g. the add of get_or_set, which the
+        replay issues again. The operations of those calls are listed in
+        the nested attribute of the thread local.
+        """
+        local = self._local
+
+        def call(*args, **kwargs):
+            if getattr(local, 'active', False):
+                local.nested.append(op)
+                return func(*args, **kwargs)
+            local.active = True
+            local.nested = []
+            try:
+                return recorded(*args, **kwargs)
+            finally:
+                local.active = False
+        return call
+
+    def _sampled_keys(self, keys):
+        """
+        The ordered dict of the sampled keys among keys to their hash.
+        """
+        sampled = OrderedDict()
+        for key in keys:
+            hashed = hash_key(key)
+            if self.sampled(hashed):
+                sampled[key] = hashed
+        return sampled
+
+    def _ttl(self, cache, timeout):
+        if timeout is None:
+            return -1
+        return cache._ttl(timeout)
+
+    def _wrap_get(self, op, func, cache):
+        def get(key, default=None, version=None):
+            hashed = hash_key(key)
+            if not self.sampled(hashed):
+                return func(key, default, version)
+            started = clock()
+            value = func(key, MISSING, version)
+            duration = clock() - started
+            if value is MISSING:
+                self.record(op, [hashed], 0, None, 0, duration)
+                return default
+            self.record(op, [hashed], value_size(value), None, 1, duration)
+            return value
+        return get
+
+    def _wrap_get_many(self, op, func, cache):
+        def get_many(keys, version=None):
+            keys = list(keys)
+            started = clock()
+            result = func(keys, version)
+            duration = clock() - started
+            sampled = self._sampled_keys(keys)
+            if sampled:
+                values = [result[key] for key in sampled if key in result]
+                self.record(op, list(sampled.values()),
+                            sum(value_size(value) for value in values), None,
+                            len(values), duration)
+            return result
+        return get_many
+
+    def _wrap_has_key(self, op, func, cache):
+        def has_key(key, version=None):
+            hashed = hash_key(key)
+            started = clock()
+            found = func(key, version)
+            if self.sampled(hashed):
+                self.record(op, [hashed], 0, None, int(bool(found)),
+                            clock() - started)
+            return found
+        return has_key
+
+    def _wrap_set(self, op, func, cache):
+        def set(key, value, timeout=DEFAULT_TIMEOUT, version=None, *args,
+                **kwargs):
+            hashed = hash_key(key)
+            started = clock()
+            result = func(key, value, timeout, version, *args, **kwargs)
+            if self.sampled(hashed):
+                #add returns False on a hit, when the key exists
+                hits = int(not result) if op == 'add' else None
+                self.record(op, [hashed], value_size(value),
+                            self._ttl(cache, timeout), hits, clock() - started)
+            return result
+        return set
+
+    _wrap_add = _wrap_set
+
+    def _wrap_delete(self, op, func, cache):
+        def delete(key, version=None):
+            hashed = hash_key(key)
+            started = clock()
+            result = func(key, version)
+            if self.sampled(hashed):
+                self.record(op, [hashed], 0, None, None, clock() - started)
+            return result
+        return delete
+
+    def _wrap_get_or_set(self, op, func, cache):
+        def get_or_set(key, default, timeout=DEFAULT_TIMEOUT, version=None):
+            hashed = hash_key(key)
+            if not self.sampled(hashed):
+                return func(key, default, timeout, version)
+            if not callable(default):
+                #a plain default is only added on a miss
+                started = clock()
+                value = func(key, default, timeout, version)
+                self.record(op, [hashed], value_size(value),
+                            self._ttl(cache, timeout),
+                            int('add' not in self._local.nested),
+                            clock() - started)
+                return value
+            #the default is only called on a miss
+            calls = []
+
+            def compute():
+                calls.append(True)
+                return default()
+            started = clock()
+            value = func(key, compute, timeout, version)
+            self.record(op, [hashed], value_size(value),
+                        self._ttl(cache, timeout), int(not calls),
+                        clock() - started)
+            return value
+        return get_or_set
+
+    def _wrap_incr(self, op, func, cache):
+        def incr(key, delta=1, version=None):
+            hashed = hash_key(key)
+            started = clock()
+            try:
+                value = func(key, delta, version)
+            except ValueError:
+                if self.sampled(hashed):
+                    self.record(op, [hashed], 0, None, 0, clock() - started)
+                raise
+            if self.sampled(hashed):
+                self.record(op, [hashed], 8, None, 1, clock() - started)
+            return value
+        return incr
+
+    def _wrap_touch(self, op, func, cache):
+        def touch(key, timeout=DEFAULT_TIMEOUT, version=None):
+            hashed = hash_key(key)
+            started = clock()
+            touched = func(key, timeout, version)
+            if self.sampled(hashed):
+                self.record(op, [hashed], 0, self._ttl(cache, timeout),
+                            int(bool(touched)), clock() - started)
+            return touched
+        return touch
+
+
+class Event(object):
+    """
+    One operation read back from a trace.
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, time, op, keys, size, ttl, hits, latency_us):
+        self.time = time
+        self.op = op
+        self.keys = keys
+        self.size = size
+        self.ttl = ttl
+        self.hits = hits
+        self.latency_us = latency_us
+
+
+def read_trace(path):
+    """
+    Yields the events of the trace file at path, skipping blank, comment
+    and truncated lines.
+    """
+    with open(path) as trace:
+        for line in trace:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != len(FIELDS) or line.startswith('#'):
+                continue
+            try:
+                yield Event(float(fields[0]), fields[1],
+                            fields[2].split(',') if fields[2] else [],
+                            int(fields[3]),
+                            int(fields[4]) if fields[4] else None,
+                            int(fields[5]) if fields[5] else None,
+                            int(fields[6]))
+            except ValueError:
+                continue
+
+
+def percentile(latencies, fraction):
+    """
+    The value at fraction of the sorted list latencies, 0 if empty.
+    """
+    if not latencies:
+        return 0.0
+    index = min(int(fraction * len(latencies)), len(latencies) - 1)
+    return latencies[index]
+
+
+class Replay(object):
+    """
+    Runs the events of a trace against a cache, any django cache backend.
+    The values written are strings of the recorded size, and the keys the
+    recorded hashes.
+
+    With speedup the events are issued at their recorded pace, that many
+    times faster, speedup=0 issues them as fast as the concurrency threads
+    allow. The events of each key are issued in order by the same thread.
+    """
+    def __init__(self, cache, concurrency=1, speedup=0):
+        self.cache = cache
+        self.concurrency = concurrency
+        self.speedup = speedup
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._counts = {}
+
+    def run(self, events):
+        """
+        Replays the events and returns the report().
+        """
+        #the events of a key go to the same worker, in their recorded order
+        queues = [Queue(100) for _ in range(self.concurrency)]
+        workers = [threading.Thread(target=self._work, args=(queue,),
+                                    name="aerospike-cache-replay")
+                   for queue in queues]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        started = time.time()
+        first = None
+        for event in events:
+            if self.speedup:
+                if first is None:
+                    first = event.time
+                delay = (event.time - first) / self.speedup - \
+                    (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            index = int(event.keys[0][:8], 16) if event.keys else 0
+            queues[index % len(queues)].put(event)
+        for queue in queues:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+        return self.report(time.time() - started)
+
+    def _work(self, queue):
+        while True:
+            event = queue.get()
+            if event is None:
+                return
+            started = clock()
+            try:
+                hits, misses = self.apply(event)
+                error = False
+            except Exception:
+                hits, misses, error = 0, 0, True
+            self._count(event, clock() - started, hits, misses, error)
+
+    def _count(self, event, duration, hits, misses, error):
+        with self._lock:
+            self._latencies.setdefault(event.op, []).append(duration)
+            counts = self._counts.get(event.op)
+            if counts is None:
+                counts = self._counts[event.op] = {
+                    'hits': 0, 'misses': 0, 'errors': 0,
+                    'recorded_hits': 0, 'recorded_misses': 0}
+            counts['hits'] += hits
+            counts['misses'] += misses
+            counts['errors'] += int(error)
+            if event.hits is not None:
+                counts['recorded_hits'] += event.hits
+                counts['recorded_misses'] += max(
+                    (len(event.keys) if event.op == 'get_many' else 1) -
+                    event.hits, 0)
+
+    def apply(self, event):
+        """
+        Issues the operation of event, returns its hits and misses.
+        """
+        cache = self.cache
+        keys = event.keys
+        timeout = DEFAULT_TIMEOUT
+        if event.ttl is not None:
+            timeout = None if event.ttl < 0 else event.ttl
+        op = event.op
+        if op == 'get':
+            found = cache.get(keys[0], MISSING) is not MISSING
+            return int(found), int(not found)
+        if op == 'get_many':
+            found = len(cache.get_many(keys))
+            return found, len(keys) - found
+        if op == 'has_key':
+            found = bool(cache.has_key(keys[0]))
+            return int(found), int(not found)
+        if op == 'touch':
+            found = bool(cache.touch(keys[0], timeout))
+            return int(found), int(not found)
+        if op == 'incr':
+            try:
+                cache.incr(keys[0])
+            except ValueError:
+                return 0, 1
+            return 1, 0
+        if op == 'add':
+            found = not cache.add(keys[0], "x" * event.size, timeout)
+            return int(found), int(not found)
+        if op == 'set':
+            cache.set(keys[0], "x" * event.size, timeout)
+        elif op == 'get_or_set':
+            calls = []
+
+            def default():
+                calls.append(True)
+                return "x" * event.size
+            cache.get_or_set(keys[0], default, timeout)
+            return int(not calls), int(bool(calls))
+        elif op == 'delete':
+            cache.delete(keys[0])
+        return 0, 0
+
+    def report(self, duration):
+        """
+        The latency percentiles, in ms, and the hit ratios of each operation,
+        with the hit ratios recorded in the trace for comparison.
+        """
+        with self._lock:
+            operations = {}
+            total = 0
+            for op, latencies in self._latencies.items():
+                latencies = sorted(latencies)
+                counts = self._counts[op]
+                total += len(latencies)
+                reads = counts['hits'] + counts['misses']
+                recorded = counts['recorded_hits'] + counts['recorded_misses']
+                operations[op] = dict(
+                    counts,
+                    calls=len(latencies),
+                    hit_ratio=counts['hits'] / reads if reads else None,
+                    recorded_hit_ratio=(counts['recorded_hits'] / recorded
+                                        if recorded else None),
+                    p50_ms=percentile(latencies, 0.5) * 1000,
+                    p90_ms=percentile(latencies, 0.9) * 1000,
+                    p99_ms=percentile(latencies, 0.99) * 1000,
+                    max_ms=latencies[-1] * 1000,
+                )
+            return {
+                'duration_s': duration,
+                'calls': total,
+                'ops_per_s': total / duration if duration else 0.0,
+                'operations': operations,
+            }
+
+
+def replay(cache, path, concurrency=1, speedup=0):
+    """
+    Replays the trace file at path against cache, see Replay, and returns
+    the report.
+    """
+    return Replay(cache, concurrency, speedup).run(read_trace(path))
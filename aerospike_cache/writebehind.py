@@ -0,0 +1,273 @@
+"Write-behind buffer flushing cache writes in the background"
+from __future__ import print_function
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from concurrent.futures import ThreadPoolExecutor
+
+SET = 'set'
+DELETE = 'delete'
+
+#what a write does when the buffer is full
+BLOCK = 'block'
+DROP = 'drop'
+SYNC = 'sync'
+FULL_POLICIES = (BLOCK, DROP, SYNC)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_write_buffer(name, **settings):
+    """
+    Returns the process wide write buffer registered under name, creating it
+    on first use, so the backends of all the threads share one flusher.
+    """
+    with _registry_lock:
+        buffer = _registry.get(name)
+        if buffer is None:
+            buffer = WriteBuffer(**settings)
+            _registry[name] = buffer
+        return buffer
+
+
+def flush_all():
+    """
+    Flushes all the write buffers of the process, e.g. on shutdown.
+    """
+    with _registry_lock:
+        buffers = list(_registry.values())
+    for buffer in buffers:
+        buffer.flush()
+        buffer.stop()
+
+
+atexit.register(flush_all)
+
+
+class WriteBuffer(object):
+    """
+    A bounded buffer of the pending writes, by aerospike key. A new write to
+    a key replaces the pending one, which is then never sent. A background
+    thread sends the writes, batch_size at a time over workers threads, as
+    soon as batch_size of them are pending or interval seconds after it last
+    woke up.
+
+    When max_size writes are pending, a write to another key waits for room
+    up to block_seconds and then is sent by its caller (full=BLOCK), is sent
+    by its caller at once (full=SYNC) or is dropped (full=DROP). Deletes are
+    never dropped, a stale value could be served for good otherwise.
+    """
+    def __init__(self, max_size=10000, batch_size=100, interval=0.1,
+                 full=BLOCK, block_seconds=1, workers=4):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.full = full
+        self.block_seconds = block_seconds
+        self.workers = workers
+        self._pending = OrderedDict()
+        self._cond = threading.Condition(threading.Lock())
+        #held while sending a batch, so writes to a key go out in order
+        self._send_lock = threading.Lock()
+        self._thread = None
+        self._executor = None
+        self._pid = None
+        self.buffered = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.batches = 0
+        self.dropped = 0
+        self.sync_writes = 0
+        self.errors = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def enqueue(self, aero_key, op, value, send):
+        """
+        Buffers the write op (SET or DELETE) of value to aero_key, sent by
+        calling send(). Returns False if the buffer is full and the caller
+        must write itself.
+        """
+        self._check_pid()
+        with self._cond:
+            self._start()
+            pending = self._pending
+            if aero_key in pending:
+                #only the last write of a key is sent
+                del pending[aero_key]
+                self.coalesced += 1
+            elif len(pending) >= self.max_size:
+                if self.full == DROP and op != DELETE:
+                    self.dropped += 1
+                    return True
+                if self.full == BLOCK:
+                    deadline = time.time() + self.block_seconds
+                    while len(pending) >= self.max_size:
+                        left = deadline - time.time()
+                        if left <= 0:
+                            break
+                        self._cond.wait(left)
+                if len(pending) >= self.max_size:
+                    self.sync_writes += 1
+                    return False
+            pending[aero_key] = (op, value, send)
+            self.buffered += 1
+            if len(pending) == 1 or len(pending) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def lookup(self, aero_key):
+        """
+        Returns the pending (op, value) of aero_key, None if there is none.
+        """
+        self._check_pid()
+        entry = self._pending.get(aero_key)
+        if entry is None:
+            return None
+        return entry[0], entry[1]
+
+    def settle(self, aero_key):
+        """
+        Sends the pending write of aero_key now, if any, before the caller
+        works on the record in another way.
+        """
+        self._check_pid()
+        if aero_key not in self._pending:
+            return
+        with self._send_lock:
+            with self._cond:
+                entry = self._pending.pop(aero_key, None)
+                self._cond.notify_all()
+            if entry is not None:
+                self._send([entry])
+
+    def flush(self):
+        """
+        Sends all the pending writes, waiting for them.
+        """
+        self._check_pid()
+        while self._pending:
+            self._send_batch()
+        #and for the batch the flusher may be sending
+        with self._send_lock:
+            pass
+
+    def discard(self):
+        """
+        Drops the pending writes, e.g. as the cache is cleared.
+        """
+        self._check_pid()
+        with self._cond:
+            self._pending.clear()
+            self._cond.notify_all()
+
+    def _check_pid(self):
+        """
+        Drops, in a forked child, the pending writes copied from the parent,
+        which the parent sends. The child has no flusher thread either, the
+        next write starts one. Called without the lock held.
+        """
+        if self._pid is None or self._pid == os.getpid():
+            return
+        #the locks too, a thread of the parent may have held them
+        self._cond = threading.Condition(threading.Lock())
+        self._send_lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._thread = self._executor = None
+        self._pid = None
+
+    def _start(self):
+        """
+        Starts the flusher thread if it is not running. Called with the lock
+        held.
+        """
+        if self._pid is None:
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            self._thread = threading.Thread(target=self._flusher,
+                                            name="aerospike-cache-write-behind")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the flusher thread, a later write starts it again.
+        """
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._pid = None
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+
+    def _flusher(self):
+        pid = os.getpid()
+        while True:
+            with self._cond:
+                while not self._pending and self._pid == pid:
+                    self._cond.wait()
+                if self._pid != pid:
+                    return
+                if len(self._pending) < self.batch_size:
+                    #let more writes come, or coalesce, for a while
+                    self._cond.wait(self.interval)
+            self._send_batch()
+
+    def _send_batch(self):
+        with self._send_lock:
+            with self._cond:
+                pending = self._pending
+                batch = [pending.popitem(last=False)[1]
+                         for _ in range(min(self.batch_size, len(pending)))]
+                self._cond.notify_all()
+            if batch:
+                self._send(batch)
+
+    def _send(self, batch):
+        """
+        Sends a batch of writes to distinct keys, concurrently.
+        """
+        sends = [entry[2] for entry in batch]
+        if len(sends) == 1:
+            results = [self._call(sends[0])]
+        else:
+            try:
+                results = list(self._executor.map(self._call, sends))
+            except RuntimeError:
+                #the pool takes no more work once the interpreter is exiting
+                results = [self._call(send) for send in sends]
+        with self._cond:
+            self.batches += 1
+            self.flushed += results.count(True)
+            self.errors += results.count(False)
+
+    def _call(self, send):
+        try:
+            send()
+        except Exception as e:
+            print("error: {0}".format(e), file=sys.stderr)
+            return False
+        return True
+
+    def stats(self):
+        """
+        Returns a snapshot of the write buffer counters.
+        """
+        self._check_pid()
+        with self._cond:
+            return {
+                'pending': len(self._pending),
+                'buffered': self.buffered,
+                'coalesced': self.coalesced,
+                'flushed': self.flushed,
+                'batches': self.batches,
+                'dropped': self.dropped,
+                'sync_writes': self.sync_writes,
+                'errors': self.errors,
+            }
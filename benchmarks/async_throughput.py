@@ -0,0 +1,45 @@
+"""
+Measures the throughput of many concurrent async cache requests, each
+waiting a simulated network latency, with the native async methods and with
+the sync_to_async wrapping django falls back to.
+
+Usage::
+
+    python benchmarks/async_throughput.py [requests] [concurrency] [latency ms]
+"""
+from __future__ import print_function
+import asyncio
+import sys
+import time
+
+from asgiref.sync import sync_to_async
+
+import fake_aerospike
+
+fake_aerospike.install(force=True)
+
+from overhead import make_cache
+
+
+async def run(get, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await get("key%d" % (i % 100))
+
+    started = time.time()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    return requests / (time.time() - started)
+
+
+def main(requests=2000, concurrency=200, latency=1):
+    cache = make_cache(latency=latency / 1000.0)
+    for name, get in (("aget", cache.aget),
+                      ("sync_to_async", sync_to_async(cache.get))):
+        throughput = asyncio.run(run(get, requests, concurrency))
+        print("{0:<14} {1:10.0f} req/s".format(name, throughput))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
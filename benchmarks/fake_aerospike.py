@@ -0,0 +1,454 @@
+"""
+In-memory stand-in for the ``aerospike`` client module, so the benchmarks run
+without a cluster. Records live in a dict shared by all the clients of the
+process, and every client call can be made to wait ``latency`` seconds to
+simulate the network round trip.
+
+Only the calls and constants used by aerospike_cache are provided. Call
+install() before aerospike_cache is imported::
+
+    import fake_aerospike
+    fake_aerospike.install(latency=0.0005)
+    from aerospike_cache import AerospikeCache
+"""
+import hashlib
+import sys
+import threading
+import time
+import types
+
+POLICY_KEY_DIGEST = 0
+POLICY_KEY_SEND = 1
+POLICY_EXISTS_IGNORE = 0
+POLICY_EXISTS_UPDATE = 1
+POLICY_EXISTS_REPLACE = 3
+POLICY_EXISTS_CREATE_OR_REPLACE = 4
+POLICY_EXISTS_CREATE = 5
+POLICY_GEN_IGNORE = 0
+POLICY_GEN_EQ = 1
+POLICY_REPLICA_MASTER = 0
+POLICY_REPLICA_ANY = 1
+TTL_NAMESPACE_DEFAULT = 0
+TTL_NEVER_EXPIRE = -1
+TTL_DONT_UPDATE = -2
+
+OPERATOR_WRITE = 0
+OPERATOR_READ = 1
+OPERATOR_INCR = 2
+OPERATOR_TOUCH = 11
+OPERATOR_DELETE = 14
+OP_LIST_APPEND = 1001
+OP_LIST_SIZE = 1002
+OP_LIST_REMOVE_BY_INDEX_RANGE = 1003
+OP_LIST_GET_BY_INDEX_RANGE = 1004
+OP_MAP_PUT = 1101
+OP_MAP_INCREMENT = 1102
+OP_MAP_REMOVE_BY_KEY = 1103
+OP_MAP_GET_BY_KEY = 1104
+LIST_RETURN_NONE = 0
+LIST_RETURN_VALUE = 7
+MAP_RETURN_VALUE = 7
+
+#operations that do not create a missing record
+READ_ONLY_OPS = frozenset([OPERATOR_READ, OP_LIST_SIZE,
+                           OP_LIST_GET_BY_INDEX_RANGE, OP_MAP_GET_BY_KEY])
+
+#seconds each client call waits, see install()
+latency = 0
+
+_store = {}
+_lock = threading.Lock()
+
+
+class AerospikeError(Exception):
+    pass
+
+
+class RecordNotFound(AerospikeError):
+    pass
+
+
+class RecordExistsError(AerospikeError):
+    pass
+
+
+class RecordGenerationError(AerospikeError):
+    pass
+
+
+class RecordTooBig(AerospikeError):
+    pass
+
+
+exception = types.ModuleType('aerospike.exception')
+for _error in (AerospikeError, RecordNotFound, RecordExistsError,
+               RecordGenerationError, RecordTooBig):
+    setattr(exception, _error.__name__, _error)
+
+
+def install(latency=None, force=False):
+    """
+    Registers this module as ``aerospike``, unless the real client can be
+    imported and force is not set. Returns True if the fake is in use.
+    """
+    if latency is not None:
+        set_latency(latency)
+    if not force and 'aerospike' not in sys.modules:
+        try:
+            import aerospike  # noqa
+        except ImportError:
+            pass
+    current = sys.modules.get('aerospike')
+    if current is not None and current is not sys.modules[__name__]:
+        if not force:
+            return False
+    sys.modules['aerospike'] = sys.modules[__name__]
+    sys.modules['aerospike.exception'] = exception
+    return True
+
+
+def set_latency(seconds):
+    global latency
+    latency = seconds
+
+
+def reset():
+    """
+    Drops all the records.
+    """
+    with _lock:
+        _store.clear()
+
+
+def null():
+    return _Null()
+
+
+class _Null(object):
+    pass
+
+
+def calc_digest(namespace, set, key):
+    return bytearray(hashlib.sha1(
+        ("%s:%r" % (set, key)).encode('utf-8')).digest())
+
+
+def client(config):
+    return Client(config)
+
+
+def _wait():
+    if latency:
+        time.sleep(latency)
+
+
+def _expires(ttl, old=None):
+    if ttl == TTL_DONT_UPDATE:
+        return old
+    if not ttl or ttl < 0:
+        return None
+    return time.time() + ttl
+
+
+def _meta(entry):
+    expires = entry[1]
+    ttl = int(expires - time.time()) if expires is not None else -1
+    return {'gen': entry[0], 'ttl': ttl}
+
+
+def _index_range(items, op):
+    start = op['index']
+    if start < 0:
+        start = max(len(items) + start, 0)
+    end = start + op['count'] if 'count' in op else len(items)
+    return start, end
+
+
+class _BatchRecord(object):
+    def __init__(self, key, result, record):
+        self.key = key
+        self.result = result
+        self.record = record
+
+
+class _BatchRecords(object):
+    def __init__(self, batch_records):
+        self.batch_records = batch_records
+
+
+class _Scan(object):
+    def __init__(self, namespace, set):
+        self.namespace = namespace
+        self.set = set
+
+    def foreach(self, callback, policy=None, options=None):
+        _wait()
+        with _lock:
+            keys = [key for key in _store
+                    if key[0] == self.namespace and key[1] == self.set]
+        for key in keys:
+            entry = _store.get(key)
+            if entry is not None:
+                aero_key = (key[0], key[1], None, bytearray(key[2]))
+                if callback((aero_key, _meta(entry), dict(entry[2]))) is False:
+                    break
+
+
+class Client(object):
+    """
+    Each record is kept as [generation, expiry time or None, bins].
+    """
+    def __init__(self, config):
+        self.config = config
+        self.connected = False
+
+    def connect(self, username=None, password=None):
+        self.connected = True
+        return self
+
+    def is_connected(self):
+        return self.connected
+
+    def close(self):
+        self.connected = False
+
+    def _key(self, key):
+        digest = key[3] if len(key) > 3 and key[2] is None else \
+            calc_digest(key[0], key[1], key[2])
+        return (key[0], key[1], bytes(digest))
+
+    def _entry(self, key):
+        """
+        Returns the live entry of key, called with the lock held.
+        """
+        entry = _store.get(key)
+        if entry is not None and entry[1] is not None and \
+                entry[1] <= time.time():
+            del _store[key]
+            return None
+        return entry
+
+    def put(self, key, bins, meta=None, policy=None):
+        _wait()
+        policy = policy or {}
+        exists = policy.get('exists')
+        with _lock:
+            key_ = self._key(key)
+            entry = self._entry(key_)
+            if entry is not None and exists == POLICY_EXISTS_CREATE:
+                raise RecordExistsError("record exists")
+            if entry is None and exists in (POLICY_EXISTS_UPDATE,
+                                            POLICY_EXISTS_REPLACE):
+                raise RecordNotFound("record not found")
+            if (policy.get('gen') == POLICY_GEN_EQ
+                    and entry[0] != (meta or {}).get('gen')):
+                raise RecordGenerationError("generation mismatch")
+            if entry is None or exists in (POLICY_EXISTS_REPLACE,
+                                           POLICY_EXISTS_CREATE_OR_REPLACE):
+                new = {}
+            else:
+                new = dict(entry[2])
+            for name, value in bins.items():
+                if isinstance(value, _Null):
+                    new.pop(name, None)
+                else:
+                    new[name] = value
+            generation = entry[0] + 1 if entry is not None else 1
+            old_expires = entry[1] if entry is not None else None
+            _store[key_] = [generation,
+                            _expires((meta or {}).get('ttl', 0), old_expires),
+                            new]
+        return 0
+
+    def get(self, key, policy=None):
+        _wait()
+        with _lock:
+            entry = self._entry(self._key(key))
+            if entry is None:
+                raise RecordNotFound("record not found")
+            return (key, _meta(entry), dict(entry[2]))
+
+    def select(self, key, bins, policy=None):
+        key, meta, record = self.get(key, policy)
+        return (key, meta, dict((name, record[name])
+                                for name in bins if name in record))
+
+    def exists(self, key, policy=None):
+        _wait()
+        with _lock:
+            entry = self._entry(self._key(key))
+            return (key, _meta(entry) if entry is not None else None)
+
+    def remove(self, key, meta=None, policy=None):
+        _wait()
+        return self._remove(key)
+
+    def _remove(self, key):
+        with _lock:
+            key_ = self._key(key)
+            if self._entry(key_) is None:
+                raise RecordNotFound("record not found")
+            del _store[key_]
+        return 0
+
+    def get_many(self, keys, policy=None):
+        _wait()
+        records = []
+        with _lock:
+            for key in keys:
+                entry = self._entry(self._key(key))
+                if entry is None:
+                    records.append((key, None, None))
+                else:
+                    records.append((key, _meta(entry), dict(entry[2])))
+        return records
+
+    def batch_read(self, keys, bins=None, policy=None):
+        if bins is None:
+            records = self.get_many(keys, policy)
+        else:
+            records = self.select_many(keys, bins, policy)
+        return _BatchRecords([
+            _BatchRecord(key, 2, None) if record is None
+            else _BatchRecord(key, 0, (key, meta, record))
+            for key, meta, record in records])
+
+    def select_many(self, keys, bins, policy=None):
+        records = []
+        for key, meta, record in self.get_many(keys, policy):
+            if record is not None:
+                record = dict((name, record[name])
+                              for name in bins if name in record)
+            records.append((key, meta, record))
+        return records
+
+    def increment(self, key, bin, offset, meta=None, policy=None):
+        self.operate(key, [{'op': OPERATOR_INCR, 'bin': bin, 'val': offset}],
+                     meta, policy)
+        return 0
+
+    def operate(self, key, list, meta=None, policy=None):
+        _wait()
+        return self._operate(key, list, meta, policy)
+
+    def _operate(self, key, ops, meta, policy):
+        policy = policy or {}
+        with _lock:
+            key_ = self._key(key)
+            entry = self._entry(key_)
+            if entry is None:
+                if policy.get('exists') == POLICY_EXISTS_UPDATE or \
+                        all(op['op'] in READ_ONLY_OPS or
+                            op['op'] == OPERATOR_DELETE for op in ops):
+                    raise RecordNotFound("record not found")
+                entry = [0, None, {}]
+            bins = dict(entry[2])
+            expires = entry[1]
+            written = deleted = False
+            result = {}
+            for op in ops:
+                code = op['op']
+                name = op.get('bin')
+                if code not in READ_ONLY_OPS:
+                    written = True
+                if code == OPERATOR_READ:
+                    result[name] = bins.get(name)
+                elif code == OPERATOR_WRITE:
+                    if isinstance(op['val'], _Null):
+                        bins.pop(name, None)
+                    else:
+                        bins[name] = op['val']
+                elif code == OPERATOR_DELETE:
+                    bins = {}
+                    deleted = True
+                elif code == OPERATOR_INCR:
+                    bins[name] = bins.get(name, 0) + op['val']
+                elif code == OPERATOR_TOUCH:
+                    expires = _expires(op.get('val', 0), expires)
+                elif code == OP_LIST_APPEND:
+                    items = bins[name] = list(bins.get(name) or [])
+                    items.append(op['val'])
+                    result[name] = len(items)
+                elif code == OP_LIST_SIZE:
+                    result[name] = len(bins.get(name) or [])
+                elif code == OP_LIST_REMOVE_BY_INDEX_RANGE:
+                    items = bins.get(name) or []
+                    start, end = _index_range(items, op)
+                    if op.get('inverted'):
+                        bins[name] = items[start:end]
+                    else:
+                        bins[name] = items[:start] + items[end:]
+                    result[name] = None
+                elif code == OP_LIST_GET_BY_INDEX_RANGE:
+                    items = bins.get(name) or []
+                    start, end = _index_range(items, op)
+                    result[name] = items[start:end]
+                elif code == OP_MAP_PUT:
+                    items = bins[name] = dict(bins.get(name) or {})
+                    items[op['key']] = op['val']
+                    result[name] = len(items)
+                elif code == OP_MAP_INCREMENT:
+                    items = bins[name] = dict(bins.get(name) or {})
+                    items[op['key']] = items.get(op['key'], 0) + op['val']
+                    result[name] = items[op['key']]
+                elif code == OP_MAP_REMOVE_BY_KEY:
+                    items = bins[name] = dict(bins.get(name) or {})
+                    result[name] = items.pop(op['key'], None)
+                elif code == OP_MAP_GET_BY_KEY:
+                    result[name] = (bins.get(name) or {}).get(op['key'])
+                else:
+                    raise AerospikeError("unsupported operation %r" % code)
+            generation = entry[0]
+            if deleted and not bins:
+                _store.pop(key_, None)
+            elif written:
+                generation += 1
+                if meta and 'ttl' in meta:
+                    expires = _expires(meta['ttl'], expires)
+                _store[key_] = [generation, expires, bins]
+            return (key, _meta([generation, expires, bins]), result)
+
+    def batch_operate(self, keys, ops, policy_batch=None,
+                      policy_batch_write=None, ttl=None):
+        _wait()
+        meta = {'ttl': ttl} if ttl is not None else None
+        records = []
+        for key in keys:
+            try:
+                record = self._operate(key, ops, meta, policy_batch_write)
+            except RecordNotFound:
+                records.append(_BatchRecord(key, 2, None))
+            else:
+                records.append(_BatchRecord(key, 0, record))
+        return _BatchRecords(records)
+
+    def batch_write(self, batch_records, policy=None):
+        _wait()
+        for record in batch_records.batch_records:
+            ops = getattr(record, 'ops', None)
+            try:
+                if ops is None:
+                    #a Remove record
+                    self._remove(record.key)
+                    record.record = None
+                else:
+                    record.record = self._operate(record.key, ops,
+                                                  record.meta, record.policy)
+            except RecordNotFound:
+                record.result = 2
+            except AerospikeError:
+                record.result = 1
+            else:
+                record.result = 0
+        return batch_records
+
+    def truncate(self, namespace, set, nanos, policy=None):
+        _wait()
+        with _lock:
+            for key in [key for key in _store
+                        if key[0] == namespace and key[1] == set]:
+                del _store[key]
+        return 0
+
+    def scan(self, namespace, set):
+        return _Scan(namespace, set)
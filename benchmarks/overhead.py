@@ -0,0 +1,98 @@
+"""
+Measures the Python overhead of each cache operation with the network taken
+out of the picture: the backend talks to a client whose calls return right
+away, so what is left is the time spent in aerospike_cache itself.
+
+Usage::
+
+    python benchmarks/overhead.py [number of calls]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import timeit
+
+#run from a checkout, the package is next to the benchmarks directory
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_aerospike
+
+#the backend needs an aerospike module to import, the calls go to NullClient
+fake_aerospike.install(force=True)
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from aerospike_cache import AerospikeCache
+from aerospike_cache.clients import clients_epoch
+
+
+class NullClient(object):
+    """
+    Stands in for a connected aerospike client, every call succeeds at once
+    or, with latency, after that many seconds spent waiting on the network.
+    """
+    def __init__(self, bin_name, latency=0):
+        self.record = {bin_name: "value"}
+        self.meta = {'gen': 1, 'ttl': 100}
+        self.latency = latency
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put(self, key, record, meta=None, policy=None):
+        self._wait()
+        return 0
+
+    def get(self, key, policy=None):
+        self._wait()
+        return (key, self.meta, self.record)
+
+    def exists(self, key, policy=None):
+        self._wait()
+        return (key, self.meta)
+
+    def select(self, key, bins, policy=None):
+        self._wait()
+        return (key, self.meta, dict((name, self.record[name])
+                                     for name in bins if name in self.record))
+
+    def get_many(self, keys, policy=None):
+        self._wait()
+        return [(key, self.meta, self.record) for key in keys]
+
+
+def make_cache(latency=0, **options):
+    options.update({'NAMESPACE': "test", 'SET': "cache", 'BIN': "entry"})
+    cache = AerospikeCache('127.0.0.1:3000', {'OPTIONS': options})
+    #swap the shared client for the null one
+    cache._client_obj = NullClient("entry", latency)
+    cache._client_epoch = clients_epoch()
+    return cache
+
+
+def main(number=100000):
+    cache = make_cache()
+    memo_cache = make_cache(KEY_MEMO_SIZE=1000)
+    keys = ["key%d" % i for i in range(10)]
+    operations = [
+        ("make_key", lambda: cache.make_key("key")),
+        ("memo key", lambda: memo_cache.make_key("key")),
+        ("memo get", lambda: memo_cache.get("key")),
+        ("set str", lambda: cache.set("key", "value")),
+        ("set tuple", lambda: cache.set("key", (1, 2))),
+        ("get", lambda: cache.get("key")),
+        ("has_key", lambda: cache.has_key("key")),
+        ("get_many 10", lambda: cache.get_many(keys)),
+    ]
+    for name, operation in operations:
+        seconds = min(timeit.repeat(operation, number=number, repeat=3))
+        print("{0:<12} {1:8.3f} us/op".format(name, seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,107 @@
+"""
+Replays a trace recorded with the TRACE_FILE option against a cache backend,
+to compare configurations, e.g. batch sizes, near cache sizes or
+serializers, on a real access pattern. Prints the latency percentiles and
+the hit ratios, replayed and recorded, of each operation.
+
+Usage::
+
+    python benchmarks/replay.py TRACE [--cache ALIAS] [--option NAME=VALUE]
+                                [--concurrency N] [--speedup X]
+                                [--latency MS] [--json FILE]
+
+Without --cache the trace runs against an AerospikeCache on the in-memory
+fake client of fake_aerospike, waiting --latency ms per client call. With
+--cache it runs against that alias of the CACHES of DJANGO_SETTINGS_MODULE,
+any backend. --option overrides an OPTIONS entry of the aerospike backend,
+the value read as JSON when it parses, e.g. --option NEAR_CACHE_SIZE=1000.
+--speedup replays at the recorded pace that many times faster, 0 (the
+default) as fast as the --concurrency threads go.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import sys
+
+#run from a checkout, the package is next to the benchmarks directory
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_aerospike
+
+
+def option(value):
+    name, _, value = value.partition('=')
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return name, value
+
+
+def make_cache(args):
+    if args.cache is None:
+        fake_aerospike.install(args.latency / 1000.0, force=True)
+    from django.conf import settings
+    if not settings.configured and args.cache is None:
+        settings.configure()
+    import django
+    django.setup()
+    from django.core.cache import caches
+    from aerospike_cache import AerospikeCache
+    if args.cache is None:
+        options = {'NAMESPACE': "test", 'SET': "replay", 'BIN': "entry"}
+        options.update(args.option)
+        return AerospikeCache('127.0.0.1:3000', {'OPTIONS': options})
+    if not args.option:
+        return caches[args.cache]
+    params = dict(settings.CACHES[args.cache])
+    params['OPTIONS'] = dict(params.get('OPTIONS', {}), **dict(args.option))
+    return AerospikeCache(params.get('LOCATION'), params)
+
+
+def print_report(report, out=sys.stdout):
+    print("{0:<12} {1:>8} {2:>9} {3:>9} {4:>9} {5:>9} {6:>8} {7:>8}".format(
+        "op", "calls", "p50 ms", "p90 ms", "p99 ms", "max ms", "hits",
+        "recorded"), file=out)
+    for op, stats in sorted(report['operations'].items()):
+        print("{0:<12} {calls:>8} {p50_ms:>9.3f} {p90_ms:>9.3f} {p99_ms:>9.3f} "
+              "{max_ms:>9.3f} {1:>8} {2:>8}".format(
+                  op, ratio(stats['hit_ratio']),
+                  ratio(stats['recorded_hit_ratio']), **stats), file=out)
+    print("{calls} calls in {duration_s:.3f}s, {ops_per_s:.0f} ops/s".format(
+        **report), file=out)
+
+
+def ratio(value):
+    return "-" if value is None else "{0:.1%}".format(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('trace')
+    parser.add_argument('--cache', help="alias of the cache in CACHES")
+    parser.add_argument('--option', type=option, action='append', default=[],
+                        help="NAME=VALUE overriding an OPTIONS entry")
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--speedup', type=float, default=0)
+    parser.add_argument('--latency', type=float, default=0,
+                        help="milliseconds each fake client call waits")
+    parser.add_argument('--json', metavar='FILE',
+                        help="write the report as JSON, - for stdout")
+    args = parser.parse_args(argv)
+    cache = make_cache(args)
+    from aerospike_cache.trace import replay
+    report = replay(cache, args.trace, args.concurrency, args.speedup)
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+        return
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
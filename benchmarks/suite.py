@@ -0,0 +1,238 @@
+"""
+Measures the throughput of the cache operations against the in-memory fake
+client of fake_aerospike, for each payload type and size and each batch
+size. With no latency the figures are the Python overhead of
+aerospike_cache and the codec, with a latency they approach what a single
+thread gets from a cluster that far away.
+
+Native payloads (int, str, list, dict) are stored as aerospike types, the
+others (tuple, object) are pickled, which is what the comparison shows.
+
+Usage::
+
+    python benchmarks/suite.py [--number N] [--latency MS] [--json FILE]
+                               [--ops get,set,...] [--payloads int,str,...]
+
+Results are printed as a table, and written as JSON, the environment and the
+list of results, to FILE when --json is given, "-" meaning stdout.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+#run from a checkout, the package is next to the benchmarks directory
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_aerospike
+
+fake_aerospike.install(force=True)
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from aerospike_cache import AerospikeCache
+from aerospike_cache.metrics import clock
+
+OPERATIONS = ('get', 'set', 'add', 'get_many', 'incr', 'clear')
+PAYLOADS = ('int', 'str', 'list', 'dict', 'tuple', 'object')
+#number of characters or items of the small, medium and large payloads
+SIZES = (10, 1000, 100000)
+BATCH_SIZES = (10, 100, 1000)
+#keys in the set cleared by each clear call
+CLEAR_KEYS = 1000
+
+
+class Payload(object):
+    """
+    A plain object, pickled by the cache.
+    """
+    def __init__(self, size):
+        self.name = "x" * size
+        self.items = list(range(size))
+
+
+def make_payload(kind, size):
+    if kind == 'int':
+        return 10 ** min(size, 18)
+    if kind == 'str':
+        return "x" * size
+    if kind == 'list':
+        return list(range(size))
+    if kind == 'dict':
+        return dict(("k%d" % i, i) for i in range(size))
+    if kind == 'tuple':
+        return tuple(range(size))
+    return Payload(size)
+
+
+def make_cache(**options):
+    options.update({'NAMESPACE': "test", 'SET': "bench", 'BIN': "entry"})
+    return AerospikeCache('127.0.0.1:3000', {'OPTIONS': options})
+
+
+def measure(operation, number, setup=None):
+    """
+    Returns the best time of three runs of number calls to operation, in
+    seconds per call.
+    """
+    best = None
+    for _ in range(3):
+        if setup is not None:
+            setup()
+        seconds = timeit.timeit(operation, number=number)
+        if best is None or seconds < best:
+            best = seconds
+    return best / number
+
+
+def counter():
+    state = [0]
+
+    def next_key():
+        state[0] += 1
+        return "new%d" % state[0]
+    return next_key
+
+
+def bench_payloads(cache, ops, payloads, sizes, number):
+    for kind in payloads:
+        for size in sizes:
+            if kind == 'int' and size != sizes[0]:
+                continue
+            value = make_payload(kind, size)
+            #large payloads are slow to copy, fewer calls are enough
+            calls = max(number * sizes[0] // size, 10)
+            cache.set("key", value)
+            if 'set' in ops:
+                yield ('set', kind, size, 1,
+                       measure(lambda: cache.set("key", value), calls))
+            if 'get' in ops:
+                yield ('get', kind, size, 1,
+                       measure(lambda: cache.get("key"), calls))
+            if 'add' in ops:
+                new_key = counter()
+                yield ('add', kind, size, 1,
+                       measure(lambda: cache.add(new_key(), value), calls,
+                               fake_aerospike.reset))
+
+
+def bench_batches(cache, batch_sizes, number):
+    value = make_payload('str', 10)
+    for batch in batch_sizes:
+        keys = ["key%d" % i for i in range(batch)]
+        cache.set_many(dict((key, value) for key in keys))
+        calls = max(number // batch, 10)
+        yield ('get_many', 'str', 10, batch,
+               measure(lambda: cache.get_many(keys), calls))
+
+
+def bench_incr(cache, number):
+    cache.set("counter", 0)
+    yield ('incr', 'int', 1, 1, measure(lambda: cache.incr("counter"), number))
+
+
+def bench_clear(number):
+    value = make_payload('str', 10)
+    items = dict(("key%d" % i, value) for i in range(CLEAR_KEYS))
+    calls = max(number // CLEAR_KEYS, 3)
+    for mode in ('scan', 'truncate', 'generation'):
+        cache = make_cache(CLEAR_MODE=mode)
+        #the records are put back outside of the timed calls
+        seconds = 0.0
+        for _ in range(calls):
+            cache.set_many(items)
+            started = clock()
+            cache.clear()
+            seconds += clock() - started
+        yield ('clear', mode, CLEAR_KEYS, CLEAR_KEYS, seconds / calls)
+
+
+def run(ops=OPERATIONS, payloads=PAYLOADS, sizes=SIZES,
+        batch_sizes=BATCH_SIZES, number=10000, latency=0):
+    """
+    Runs the benchmarks and returns the list of their results.
+    """
+    fake_aerospike.set_latency(latency / 1000.0)
+    fake_aerospike.reset()
+    cache = make_cache()
+    results = []
+    benches = [bench_payloads(cache, ops, payloads, sizes, number)]
+    if 'get_many' in ops:
+        benches.append(bench_batches(cache, batch_sizes, number))
+    if 'incr' in ops:
+        benches.append(bench_incr(cache, number))
+    if 'clear' in ops:
+        benches.append(bench_clear(number))
+    for bench in benches:
+        for op, payload, size, batch, seconds in bench:
+            results.append({
+                'op': op,
+                'payload': payload,
+                'size': size,
+                'batch': batch,
+                'latency_ms': latency,
+                'us_per_op': seconds * 1e6,
+                'ops_per_s': 1.0 / seconds if seconds else 0.0,
+                'keys_per_s': batch / seconds if seconds else 0.0,
+            })
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'pid': os.getpid(),
+    }
+
+
+def print_table(results, out=sys.stdout):
+    print("{0:<9} {1:<10} {2:>7} {3:>6} {4:>12} {5:>12}".format(
+        "op", "payload", "size", "batch", "us/op", "ops/s"), file=out)
+    for result in results:
+        print("{op:<9} {payload:<10} {size:>7} {batch:>6} "
+              "{us_per_op:>12.3f} {ops_per_s:>12.0f}".format(**result),
+              file=out)
+
+
+def split(value):
+    return [item for item in value.split(',') if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--number', type=int, default=10000,
+                        help="calls per measure of the small payloads")
+    parser.add_argument('--latency', type=float, default=0,
+                        help="milliseconds each client call waits")
+    parser.add_argument('--json', metavar='FILE',
+                        help="write the results as JSON, - for stdout")
+    parser.add_argument('--ops', type=split, default=OPERATIONS)
+    parser.add_argument('--payloads', type=split, default=PAYLOADS)
+    parser.add_argument('--sizes', type=lambda value: [
+        int(size) for size in split(value)], default=SIZES)
+    parser.add_argument('--batch-sizes', type=lambda value: [
+        int(size) for size in split(value)], default=BATCH_SIZES)
+    args = parser.parse_args(argv)
+    results = run(args.ops, args.payloads, args.sizes, args.batch_sizes,
+                  args.number, args.latency)
+    report = {'environment': environment(), 'results': results}
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+        return
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,13 @@ setup(
     version = "0.2.0",
     packages = ["aerospike_cache"],
     description = "Aerospike Cache Backend for Django",
-    install_requires=['aerospike>=1.0.37',],
+    install_requires=['aerospike>=1.0.37',
+                      'futures; python_version < "3"',],
+    extras_require={
+        'msgpack': ['msgpack'],
+        'lz4': ['lz4'],
+        'zstd': ['zstandard'],
+    },
     classifiers = [
         "Programming Language :: Python",
         "Programming Language :: Python :: 2.6",
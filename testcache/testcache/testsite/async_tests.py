@@ -0,0 +1,34 @@
+"Tests of the native async methods, python 3.7+ only, imported by tests.py"
+import asyncio
+
+from django.core.cache import caches
+from django.test import TestCase
+
+
+class AsyncCacheTests(TestCase):
+    def setUp(self):
+        self.cache = caches['default']
+
+    def tearDown(self):
+        #clears data
+        self.cache.clear()
+
+    def test_async_methods(self):
+        async def run():
+            await self.cache.aset('async1', 'spam')
+            await self.cache.aset_many({'async2': 2, 'async3': (3,)})
+            self.assertEqual(await self.cache.aget('async1'), 'spam')
+            self.assertEqual(await self.cache.aincr('async2'), 3)
+            self.assertEqual(await self.cache.aget_many(['async2', 'async3']),
+                             {'async2': 3, 'async3': (3,)})
+            await self.cache.aset('async4', 'tagged', tags=['async'])
+            self.cache.invalidate_tags(['async'])
+            self.assertEqual(await self.cache.aget('async4'), None)
+            await self.cache.adelete('async1')
+            self.assertFalse(await self.cache.ahas_key('async1'))
+            # many requests in flight at once
+            values = await asyncio.gather(
+                *[self.cache.aget('async2') for i in range(50)])
+            self.assertEqual(values, [3] * 50)
+
+        asyncio.run(run())
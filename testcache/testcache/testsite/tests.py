@@ -1,5 +1,10 @@
 
+import os
+import sys
+import tempfile
+import threading
 import time
+import unittest
 import aerospike
 
 try:
@@ -14,8 +19,14 @@ else:
     from django.core.cache import caches
 
 from django.test import TestCase
+from aerospike_cache import AerospikeCache
+from aerospike_cache.nearcache import MISSING
 from ..models import Poll, expensive_calculation
 
+#the async tests are python 3 syntax, only imported where they can run
+if sys.version_info >= (3, 7):
+    from .async_tests import AsyncCacheTests
+
 # functions/classes for complex data type tests
 def f():
     return 42
@@ -59,6 +70,38 @@ class AeroCacheTests(TestCase):
         self.assertEqual(result, True)
         self.assertEqual(self.cache.get("addkey1"), "value")
 
+    def test_add_existing_key(self):
+        # add does not overwrite an existing value
+        self.cache.set("addkey2", "value")
+        self.assertEqual(self.cache.add("addkey2", "newvalue"), False)
+        self.assertEqual(self.cache.get("addkey2"), "value")
+
+    def test_get_or_set(self):
+        self.assertEqual(self.cache.get_or_set('projector', 42), 42)
+        self.assertEqual(self.cache.get_or_set('projector', 43), 42)
+        self.assertEqual(self.cache.get_or_set('callable', lambda: 'spam'), 'spam')
+        self.assertEqual(self.cache.get_or_set('callable', lambda: 'eggs'), 'spam')
+
+    def test_get_or_set_stampede(self):
+        # concurrent misses only compute the value once
+        import threading
+        calls = []
+
+        def expensive():
+            calls.append(1)
+            time.sleep(0.5)
+            return 'computed'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.cache.get_or_set('stampede', expensive, 60))) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['computed'] * 5)
+
     def test_get_many(self):
         # Multiple cache keys can be returned using get_many
         self.cache.set('a', 'a')
@@ -74,6 +117,40 @@ class AeroCacheTests(TestCase):
             self.cache.set(key, i)
         self.assertEqual(self.cache.get_many(keys), {'a': 0, 'b': 1, 'c': 2, 'd': 3})
 
+    def test_get_many_across_batches(self):
+        # get_many splits large lookups into several batch requests
+        data = dict(("batch%d" % i, i) for i in range(2500))
+        self.cache.set_many(data)
+        keys = list(data) + ["does_not_exist"]
+        self.assertEqual(self.cache.get_many(keys), data)
+
+    def test_iter_many(self):
+        # iter_many yields the found (key, value) pairs
+        self.cache.set('a', 'a')
+        self.cache.set('b', (1, 2))
+        self.assertEqual(sorted(self.cache.iter_many(['a', 'b', 'e'])),
+                         [('a', 'a'), ('b', (1, 2))])
+
+    def test_versioning(self):
+        # keys are versioned like with the other django backends
+        self.cache.set('answer', 42, version=1)
+        self.cache.set('answer', 43, version=2)
+        self.assertEqual(self.cache.get('answer', version=1), 42)
+        self.assertEqual(self.cache.get('answer', version=2), 43)
+        self.assertEqual(self.cache.get_many(['answer'], version=2), {'answer': 43})
+        self.cache.delete('answer', version=2)
+        self.assertEqual(self.cache.get('answer', version=1), 42)
+        self.assertEqual(self.cache.get('answer', version=2), None)
+
+    def test_key_prefix_and_digest_keys(self):
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'KEY_PREFIX': 'site', 'OPTIONS': {'DIGEST_KEYS': True,
+                                              'KEY_MEMO_SIZE': 100}})
+        cache.set('answer', 42)
+        self.assertEqual(cache.get('answer'), 42)
+        self.assertEqual(cache.make_key('answer')[2], None)
+        self.assertEqual(self.cache.get('answer'), None)
+
     def test_delete(self):
         # Cache keys can be deleted
         self.cache.set("key1", "spam")
@@ -102,6 +179,21 @@ class AeroCacheTests(TestCase):
         self.assertEqual(next_val, 52)
         self.assertRaises(ValueError, self.cache.incr, 'does_not_exist')
 
+    def test_incr_returns_new_value(self):
+        self.cache.set('answer', 41)
+        self.assertEqual(self.cache.incr('answer'), 42)
+        self.assertEqual(self.cache.decr('answer', 2), 40)
+
+    def test_incr_many(self):
+        # many counters can be incremented at once, missing keys are left out
+        self.cache.set('views1', 1)
+        self.cache.set('views2', 10)
+        self.assertEqual(
+            self.cache.incr_many({'views1': 1, 'views2': 5, 'does_not_exist': 1}),
+            {'views1': 2, 'views2': 15})
+        self.assertEqual(self.cache.get('views2'), 15)
+        self.assertFalse(self.cache.has_key('does_not_exist'))
+
     def test_decr(self):
         # Cache values can be decremented
         self.cache.set('answer', 43)
@@ -145,6 +237,27 @@ class AeroCacheTests(TestCase):
         test_stuff = self.cache.get("stuff")
         self.assertEqual(test_stuff, stuff)        
         
+    def test_compressed_values(self):
+        # large values are compressed, small ones and older pickles still read
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'COMPRESSOR': 'zlib', 'COMPRESS_MIN_SIZE': 100}})
+        fragment = 'fragment ' * 1000
+        cache.set('fragment', fragment)
+        cache.set('tuple', (1, 2))
+        self.assertEqual(cache.get('fragment'), fragment)
+        self.assertEqual(cache.get('tuple'), (1, 2))
+        self.assertEqual(self.cache.get('fragment'), fragment)
+        cache._client.put(cache.make_key('legacy'),
+                          {cache.aero_bin: bytearray(pickle.dumps((3, 4)))})
+        self.assertEqual(cache.get('legacy'), (3, 4))
+
+    def test_json_serializer(self):
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'SERIALIZER': 'json'}})
+        cache.set('json', 1.5)
+        self.assertEqual(cache.get('json'), 1.5)
+        self.assertEqual(self.cache.get('json'), 1.5)
+
     def test_cache_read_for_model_instance(self):
         # Don't want fields with callable as default to be called on cache read
         expensive_calculation.num_runs = 0
@@ -235,6 +348,25 @@ class AeroCacheTests(TestCase):
         self.assertEqual(self.cache.get("key2"), None)
         self.assertEqual(self.cache.get("key3"), "ham")
 
+    def test_set_many_returns_failed_keys(self):
+        # set_many reports the keys it could not write, none here
+        data = dict(("bulk%d" % i, i) for i in range(100))
+        self.assertEqual(self.cache.set_many(data), [])
+        self.assertEqual(self.cache.get_many(list(data)), data)
+
+    def test_bulk_pool_outlives_close(self):
+        # the worker pool is shared and kept across requests
+        executor = self.cache.executor
+        self.cache.close()
+        self.assertTrue(self.cache.executor is executor)
+        self.assertEqual(self.cache.set_many({"key1": "spam"}), [])
+
+    def test_delete_many_missing_keys(self):
+        # missing keys are not reported as failures by delete_many
+        self.cache.set("key1", "spam")
+        self.assertEqual(self.cache.delete_many(["key1", "does_not_exist"]), [])
+        self.assertEqual(self.cache.get("key1"), None)
+
     def test_clear(self):
         # The cache can be emptied using clear
         self.cache.set("key1", "spam")
@@ -243,6 +375,470 @@ class AeroCacheTests(TestCase):
         self.assertEqual(self.cache.get("key1"), None)
         self.assertEqual(self.cache.get("key2"), None)
 
+    def test_clear_modes(self):
+        # all the clear modes make the values disappear
+        for mode in ('truncate', 'generation'):
+            cache = AerospikeCache('127.0.0.1:3000', {
+                'OPTIONS': {'CLEAR_MODE': mode}})
+            cache.set("key1", "spam")
+            cache.set("key2", (1, 2))
+            cache.clear()
+            self.assertEqual(cache.get("key1"), None)
+            self.assertEqual(cache.get("key2"), None)
+            cache.set("key1", "eggs")
+            self.assertEqual(cache.get("key1"), "eggs")
+
+    def test_stale_while_revalidate(self):
+        # a stale value is served while it is refreshed in the background
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'STALE_TTL': 60}})
+        cache.set('fragment', 'old', 1)
+        cache.register_refresh('fragment', lambda: 'new', 60)
+        cache.set('unregistered', 'old', 1)
+        time.sleep(2)
+        self.assertEqual(cache.get('fragment'), 'old')
+        self.assertEqual(cache.get('unregistered'), None)
+        self.assertFalse(cache.has_key('unregistered'))
+        self.assertTrue(cache.has_key('fragment'))
+        self.assertTrue(cache.add('unregistered', 'new', 60))
+        self.assertEqual(cache.get('unregistered'), 'new')
+        time.sleep(1)
+        self.assertEqual(cache.get('fragment'), 'new')
+        self.assertEqual(cache.refresher.stats()['scheduled'], 1)
+
+    def test_touch(self):
+        # touch pushes the expiration back without rewriting the value
+        self.cache.set('touched', 'value', 1)
+        self.cache.set('touched2', 'value', 1)
+        self.assertTrue(self.cache.touch('touched', 60))
+        self.assertFalse(self.cache.touch('nonexistent'))
+        self.assertEqual(
+            self.cache.touch_many(['touched2', 'nonexistent'], 60),
+            ['nonexistent'])
+        time.sleep(2)
+        self.assertEqual(self.cache.get('touched'), 'value')
+        self.assertEqual(self.cache.get('touched2'), 'value')
+
+    def test_sliding_expiration(self):
+        # each get resets the expiration to the default timeout
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'TIMEOUT': 2, 'OPTIONS': {'SLIDING_EXPIRATION': True}})
+        cache.set('sliding', 'value')
+        for i in range(3):
+            time.sleep(1)
+            self.assertEqual(cache.get('sliding'), 'value')
+        self.assertEqual(cache.get_many(['sliding']), {'sliding': 'value'})
+
+    def test_chunked_values(self):
+        # values larger than CHUNK_SIZE are split across records
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'CHUNK_SIZE': 64 * 1024}})
+        big = b'x' * (300 * 1024)
+        report = {'rows': list(range(50000))}
+        cache.set('chunked', big)
+        cache.set('chunked_dict', report)
+        cache.set('not_chunked', 'small')
+        self.assertEqual(cache.get('chunked'), big)
+        self.assertEqual(cache.get('chunked_dict'), report)
+        self.assertEqual(
+            cache.get_many(['chunked', 'chunked_dict', 'not_chunked']),
+            {'chunked': big, 'chunked_dict': report, 'not_chunked': 'small'})
+        # overwriting a chunked value with a small one, and back, removes
+        # the chunks of the value replaced
+        manifest = cache._manifest(cache.make_key('chunked'))
+        cache.set('chunked', 'small now')
+        self.assertEqual(cache.get('chunked'), 'small now')
+        self.assertEqual(cache._read_chunks([manifest]), [None])
+        cache.set('chunked', big)
+        self.assertEqual(cache.get('chunked'), big)
+        manifest = cache._manifest(cache.make_key('chunked'))
+        cache.delete('chunked')
+        self.assertEqual(cache.get('chunked'), None)
+        self.assertEqual(cache._read_chunks([manifest]), [None])
+
+    def test_chunked_values_replaced(self):
+        # the chunks of a value are removed with it, and not left behind by
+        # an add of an existing key
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'SET': 'chunked_replaced', 'CHUNK_SIZE': 1024}})
+
+        def records():
+            found = []
+            cache._client.scan(cache._opts.namespace,
+                               cache._opts.set).foreach(found.append)
+            return len(found)
+        cache.set('big', b'x' * 5000)
+        self.assertEqual(records(), 6)
+        self.assertFalse(cache.add('big', b'y' * 5000))
+        self.assertEqual(records(), 6)
+        cache.set('big', b'z' * 3000)
+        self.assertEqual(records(), 4)
+        self.assertEqual(cache.get('big'), b'z' * 3000)
+        cache.delete('big')
+        self.assertEqual(records(), 0)
+
+    def test_chunked_values_without_batch_writes(self):
+        # without batch writes the chunks are written one by one, also from
+        # the workers of set_many which would otherwise wait on each other
+        import aerospike_cache.cache
+        batch_write = aerospike_cache.cache.BatchWrite
+        aerospike_cache.cache.BatchWrite = None
+        try:
+            cache = AerospikeCache('127.0.0.1:3000', {
+                'OPTIONS': {'CONCURRENCY': 2, 'CHUNK_SIZE': 1024}})
+            data = dict(('big%d' % i, b'x' * 5000) for i in range(4))
+            self.assertEqual(cache.set_many(data), [])
+            self.assertEqual(cache.get_many(list(data)), data)
+            self.assertEqual(cache.touch_many(list(data)), [])
+        finally:
+            aerospike_cache.cache.BatchWrite = batch_write
+
+    def test_structured_fields(self):
+        # dicts are stored one bin per field, which can be read on their own
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'STRUCTURED': True}})
+        profile = {'name': 'ann', 'visits': 3, 'last': (2013, 8, 15)}
+        cache.set('profile', profile)
+        cache.set('profile2', {'name': 'bob'})
+        self.assertEqual(cache.get('profile'), profile)
+        self.assertEqual(cache.get_fields('profile', ['name', 'last']),
+                         {'name': 'ann', 'last': (2013, 8, 15)})
+        self.assertEqual(cache.get_fields('nonexistent', ['name']), {})
+        self.assertEqual(
+            cache.get_many_fields(['profile', 'profile2', 'nonexistent'],
+                                  ['name']),
+            {'profile': {'name': 'ann'}, 'profile2': {'name': 'bob'}})
+        self.assertTrue(cache.update_fields('profile', {'visits': 4}))
+        self.assertFalse(cache.update_fields('nonexistent', {'visits': 1}))
+        self.assertEqual(cache.get('profile'), dict(profile, visits=4))
+        # a non dict value replaces the fields
+        cache.set('profile', 'gone')
+        self.assertEqual(cache.get('profile'), 'gone')
+        self.assertEqual(cache.get_fields('profile', ['name']), {})
+        bins = cache._client.get(cache.make_key('profile'))[2]
+        self.assertFalse('name' in bins or 'visits' in bins)
+
+    def test_list_operations(self):
+        # lists are changed on the server without reading them back
+        self.assertEqual(self.cache.list_append('feed', 1), 1)
+        for item in range(2, 6):
+            self.cache.list_append('feed', item, max_items=3)
+        self.assertEqual(self.cache.get('feed'), [3, 4, 5])
+        self.assertEqual(self.cache.list_range('feed', -2), [4, 5])
+        self.assertEqual(self.cache.list_range('feed', 0, 1), [3])
+        self.assertEqual(self.cache.list_trim('feed', 1), 1)
+        self.assertEqual(self.cache.get('feed'), [5])
+        self.assertEqual(self.cache.list_trim('nonexistent', 1), None)
+        self.assertEqual(self.cache.list_range('nonexistent'), None)
+
+    def test_map_operations(self):
+        # dicts are changed on the server without reading them back
+        self.assertEqual(self.cache.map_put('board', 'ann', 10), 1)
+        self.assertEqual(self.cache.map_incr('board', 'ann', 5), 15)
+        self.assertEqual(self.cache.map_incr('board', 'bob'), 1)
+        self.assertEqual(self.cache.get('board'), {'ann': 15, 'bob': 1})
+        self.assertEqual(self.cache.map_get('board', 'ann'), 15)
+        self.assertEqual(self.cache.map_get('board', 'eve', 0), 0)
+        self.assertEqual(self.cache.map_remove('board', 'bob'), 1)
+        self.assertEqual(self.cache.get('board'), {'ann': 15})
+        self.assertEqual(self.cache.map_get('nonexistent', 'ann'), None)
+
+    def test_tags(self):
+        # invalidating a tag drops all the entries set with it
+        self.cache.set('results', 'r', tags=['poll:1'])
+        self.cache.set('detail', 'd', tags=['poll:1', 'poll:2'])
+        self.cache.set('other', 'o', tags=['poll:2'])
+        self.cache.set('untagged', 'u')
+        self.assertEqual(self.cache.get('results'), 'r')
+        self.cache.invalidate_tags(['poll:1'])
+        self.assertEqual(self.cache.get('results'), None)
+        self.assertEqual(
+            self.cache.get_many(['results', 'detail', 'other', 'untagged']),
+            {'other': 'o', 'untagged': 'u'})
+        # the entries dropped count as missing
+        self.assertFalse(self.cache.has_key('detail'))
+        self.assertTrue(self.cache.has_key('other'))
+        self.assertTrue(self.cache.add('detail', 'd2'))
+        self.assertEqual(self.cache.get('detail'), 'd2')
+        self.assertFalse(self.cache.add('detail', 'd3'))
+        self.cache.set('detail', 'd', tags=['poll:1'])
+        self.cache.invalidate_tags(['poll:1'])
+        self.assertEqual(self.cache.get_or_set('detail', 'd4'), 'd4')
+        self.assertEqual(self.cache.get('detail'), 'd4')
+        # entries set after the invalidation are found
+        self.cache.set('results', 'r2', tags=['poll:1'])
+        self.assertEqual(self.cache.get('results'), 'r2')
+        # and the list and map reads check the tags too
+        self.cache.set('choices', [1, 2], tags=['poll:3'])
+        self.cache.set('votes', {'yes': 1}, tags=['poll:3'])
+        self.assertEqual(self.cache.list_range('choices'), [1, 2])
+        self.assertEqual(self.cache.map_get('votes', 'yes'), 1)
+        self.cache.invalidate_tags(['poll:3'])
+        self.assertEqual(self.cache.list_range('choices'), None)
+        self.assertEqual(self.cache.map_get('votes', 'yes', 0), 0)
+
+    def test_circuit_breaker(self):
+        # the circuit opens on errors, fails fast, then closes on probes
+        from aerospike_cache.breaker import (CircuitBreaker, CLOSED, OPEN,
+                                             HALF_OPEN)
+        changes = []
+        breaker = CircuitBreaker(
+            error_rate=0.5, min_calls=4, open_seconds=1, probes=2,
+            on_state_change=lambda old, new, b: changes.append(new))
+        for success in (True, False, True, False):
+            self.assertTrue(breaker.allow())
+            breaker.record(success, 0.001)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+        time.sleep(1.1)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(True, 0.001)
+        breaker.record(True, 0.001)
+        self.assertEqual(changes, [OPEN, HALF_OPEN, CLOSED])
+        # a live cluster keeps it closed, misses are not failures
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'CIRCUIT_BREAKER': True, 'BREAKER_MIN_CALLS': 2}})
+        for i in range(5):
+            self.assertEqual(cache.get('nonexistent'), None)
+        self.assertEqual(cache.breaker.stats()['state'], CLOSED)
+        # while it is open reads miss and writes fail without raising
+        cache.set('tripped', {'a': 1})
+        with cache.breaker._lock:
+            cache.breaker._open()
+        try:
+            self.assertEqual(cache.get('tripped', 'default'), 'default')
+            self.assertEqual(cache.get_fields('tripped', ['a']), {})
+            self.assertEqual(cache.get_many_fields(['tripped'], ['a']), {})
+            self.assertEqual(cache.map_get('tripped', 'a', 'default'),
+                             'default')
+            self.assertEqual(cache.list_range('tripped'), None)
+            self.assertFalse(cache.touch('tripped'))
+            self.assertFalse(cache.set('tripped', 2))
+            self.assertFalse(cache.add('tripped2', 2))
+            self.assertEqual(cache.set_many({'tripped': 2}), ['tripped'])
+            self.assertEqual(cache.touch_many(['tripped', 'tripped2']),
+                             ['tripped', 'tripped2'])
+            self.assertRaises(ValueError, cache.incr, 'tripped')
+            self.assertEqual(cache.incr_many({'tripped': 1}), {})
+            self.assertEqual(cache.list_append('tripped', 1), None)
+            self.assertEqual(cache.map_put('tripped', 'a', 2), None)
+            self.assertEqual(cache.map_incr('tripped', 'a'), None)
+            self.assertEqual(cache.map_remove('tripped', 'a'), None)
+            self.assertEqual(cache.list_trim('tripped', 1), None)
+            self.assertFalse(cache.invalidate_tags(['tripped']))
+            cache.delete_many(['tripped'])
+            cache.clear()
+        finally:
+            with cache.breaker._lock:
+                cache.breaker._set_state(CLOSED)
+
+    def test_metrics(self):
+        # operations are counted and timed, hits and misses told apart
+        exported = []
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'SET': 'metrics', 'METRICS': True,
+                        'METRICS_EXPORTER': exported.append,
+                        'METRICS_EXPORT_INTERVAL': 0}})
+        cache.metrics.reset()
+        cache.set('metered', (1, 2))
+        self.assertEqual(cache.get('metered'), (1, 2))
+        self.assertEqual(cache.get('nonexistent', 'default'), 'default')
+        self.assertEqual(cache.get_many(['metered', 'nonexistent']),
+                         {'metered': (1, 2)})
+        stats = cache.stats()['metrics']
+        get = stats['operations']['get']
+        self.assertEqual((get['calls'], get['hits'], get['misses']), (2, 1, 1))
+        get_many = stats['operations']['get_many']
+        self.assertEqual((get_many['hits'], get_many['misses']), (1, 1))
+        # a bulk call counts once, its keys may come from a generator
+        cache.set_many({'metered2': 2, 'metered3': 3})
+        cache.delete_many(['metered2', 'metered3'])
+        cache.get_many(key for key in ['metered', 'metered2'])
+        operations = cache.stats()['metrics']['operations']
+        self.assertEqual(operations['set']['calls'], 1)
+        self.assertEqual(operations['set_many']['calls'], 1)
+        self.assertFalse('delete' in operations)
+        self.assertEqual((operations['get_many']['hits'],
+                          operations['get_many']['misses']), (2, 2))
+        self.assertEqual(sum(get['histogram_us'].values()), 2)
+        self.assertTrue(stats['bytes_encoded'] > 0)
+        self.assertTrue(stats['bytes_decoded'] > 0)
+        self.assertTrue(exported)
+        # nothing is wrapped without METRICS
+        self.assertFalse('get' in self.cache.__dict__)
+
+    def test_trace_replay(self):
+        # sampled operations are appended to the trace, and replayed
+        from aerospike_cache.trace import read_trace, replay
+        handle, path = tempfile.mkstemp(suffix='.trace')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'SET': 'traced', 'TRACE_FILE': path}})
+        cache.set('traced', 'value', 30)
+        self.assertEqual(cache.get('traced'), 'value')
+        self.assertEqual(cache.get('nonexistent'), None)
+        self.assertEqual(cache.get_or_set('computed', lambda: 1), 1)
+        self.assertEqual(cache.get_or_set('plain', 2), 2)
+        self.assertEqual(cache.get_or_set('plain', 3), 2)
+        cache._recorder.close()
+        events = list(read_trace(path))
+        self.assertEqual([event.op for event in events],
+                         ['set', 'get', 'get', 'get_or_set', 'get_or_set',
+                          'get_or_set'])
+        self.assertEqual((events[0].size, events[0].ttl), (5, 30))
+        self.assertEqual([event.hits for event in events[1:]],
+                         [1, 0, 0, 0, 1])
+        self.assertFalse('traced' in events[0].keys[0])
+        self.cache.clear()
+        report = replay(self.cache, path, concurrency=2)
+        self.assertEqual(report['calls'], 6)
+        self.assertEqual(report['operations']['get']['hit_ratio'], 0.5)
+        self.assertEqual(report['operations']['get']['recorded_hit_ratio'],
+                         0.5)
+
+    def test_write_behind(self):
+        # writes are buffered, coalesced, read back and flushed on demand
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'SET': 'write_behind', 'WRITE_BEHIND': True,
+                        'WRITE_BEHIND_INTERVAL': 60,
+                        'WRITE_BEHIND_BATCH_SIZE': 1000}})
+        reader = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'SET': 'write_behind'}})
+        cache.set('buffered', 1)
+        cache.set('buffered', 2)
+        cache.set_many({'many1': 'a', 'many2': 'b'})
+        cache.delete('many2')
+        self.assertEqual(cache.get('buffered'), 2)
+        self.assertEqual(cache.get_many(['buffered', 'many1', 'many2']),
+                         {'buffered': 2, 'many1': 'a'})
+        self.assertFalse(cache.has_key('many2'))
+        self.assertEqual(reader.get('buffered'), None)
+        # an increment sends the buffered value first
+        self.assertEqual(cache.incr('buffered'), 3)
+        self.assertEqual(reader.get('buffered'), 3)
+        # the end of a request leaves the buffer to the background thread
+        cache.close()
+        self.assertEqual(reader.get('many1'), None)
+        # a tagged value keeps the tag versions of when it was buffered
+        cache.set('tagged', 't', tags=['wb'])
+        reader.invalidate_tags(['wb'])
+        cache.flush_writes()
+        self.assertEqual(reader.get('tagged'), None)
+        self.assertEqual(reader.get('many1'), 'a')
+        self.assertEqual(reader.get('many2'), None)
+        stats = cache.stats()['write_behind']
+        self.assertEqual(stats['pending'], 0)
+        self.assertTrue(stats['coalesced'] >= 1)
+
+    def test_coalesced_reads(self):
+        # a get or get_many of a key being read waits for that read
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'SET': 'coalesced', 'COALESCE_READS': True,
+                        'COALESCE_WAIT': 5}})
+        cache.set('hot', [1])
+        cache.set('cold', 'c')
+        flights = cache._flights
+        aero_key = cache.make_key('hot')
+        # pretend another thread is reading the key
+        flight, leader = flights.join(aero_key)
+        self.assertTrue(leader)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get('hot'))),
+            threading.Thread(target=lambda: results.append(
+                cache.get_many(['hot', 'cold']))),
+        ]
+        for thread in threads:
+            thread.start()
+        while flight.waiters < 2:
+            time.sleep(0.01)
+        flights.land(aero_key, flight, [2])
+        for thread in threads:
+            thread.join()
+        self.assertTrue([2] in results)
+        self.assertTrue({'hot': [2], 'cold': 'c'} in results)
+        self.assertEqual(cache.stats()['coalescing']['coalesced'], 2)
+        # the wait is bounded, the key is then read directly
+        cache._opts.coalesce_wait = 0.05
+        flight, leader = flights.join(aero_key)
+        self.assertEqual(cache.get('hot'), [1])
+        flights.land(aero_key, flight, MISSING)
+        self.assertEqual(cache.stats()['coalescing']['timeouts'], 1)
+        # a get after a write does not join a read started before it
+        cache._opts.coalesce_wait = 5
+        for write in (lambda: cache.set('hot', [3]),
+                      lambda: cache.delete('hot'),
+                      lambda: cache.list_append('hot', 4)):
+            flight, leader = flights.join(aero_key)
+            write()
+            self.assertNotEqual(cache.get('hot'), 'stale')
+            flights.land(aero_key, flight, 'stale')
+        self.assertEqual(cache.get('hot'), [4])
+        cache.set('count', 1)
+        flight, leader = flights.join(cache.make_key('count'))
+        self.assertEqual(cache.incr('count'), 2)
+        self.assertEqual(cache.get('count'), 2)
+        flights.land(cache.make_key('count'), flight, 'stale')
+
+    def test_deferred_gets(self):
+        # deferred gets are read together, on first use of one of them
+        cache = AerospikeCache('127.0.0.1:3000', {'OPTIONS': {'SET': 'lazy'}})
+        cache.set_many({'a': 1, 'b': [2], 'c': 'three'})
+        da = cache.defer('a')
+        db = cache.defer('b')
+        dx = cache.defer('x', 'missing')
+        cache.defer('c')
+        self.assertFalse(da.done())
+        self.assertEqual(db.result(), [2])
+        self.assertTrue(da.done())
+        self.assertEqual(da.result(), 1)
+        self.assertEqual(dx.result(), 'missing')
+        # a get of a deferred key not used yet is answered from the batch,
+        # the keys used are read again
+        other = AerospikeCache('127.0.0.1:3000', {'OPTIONS': {'SET': 'lazy'}})
+        other.set_many({'b': 'changed', 'c': 'changed'})
+        self.assertEqual(cache.get('c'), 'three')
+        self.assertEqual(cache.get('b'), 'changed')
+        self.assertEqual(cache.get('c'), 'changed')
+        self.assertEqual(cache.get('x', 'default'), 'default')
+        cache.set_many({'b': [2], 'c': 'three'})
+        lazy = cache.get_lazy('c')
+        self.assertEqual(str(lazy), 'three')
+        # plain gets are read along with the pending ones
+        cache.defer('a')
+        self.assertEqual(cache.get_many(['a', 'b', 'y']), {'a': 1, 'b': [2]})
+        # a write drops the outcome read
+        cache.defer('a')
+        cache.flush_deferred()
+        cache.set('a', 5)
+        self.assertEqual(cache.get('a'), 5)
+        # as do the bulk writes, made on other threads
+        cache.defer('a')
+        cache.defer('b')
+        cache.flush_deferred()
+        cache.set_many({'a': 6, 'b': 7})
+        self.assertEqual(cache.get_many(['a', 'b']), {'a': 6, 'b': 7})
+        cache.defer('a')
+        cache.defer('b')
+        cache.flush_deferred()
+        cache.delete_many(['a', 'b'])
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), None)
+        # the template fragments of a page, deferred up front
+        from django.core.cache.utils import make_template_fragment_key
+        cache.set(make_template_fragment_key('frag', [1]), '[1]')
+        deferred = [cache.defer(make_template_fragment_key('frag', [i]))
+                    for i in (1, 2)]
+        self.assertEqual(cache.get(make_template_fragment_key('frag', [1])),
+                         '[1]')
+        self.assertTrue(all(d.done() for d in deferred))
+        self.assertEqual(
+            cache.get(make_template_fragment_key('frag', [2])), None)
+        cache.close()
+
     def test_long_timeout(self):
         '''
         Using a timeout greater than 30 days makes memcached think
@@ -267,6 +863,25 @@ class AeroCacheTests(TestCase):
         self.assertEqual(result, True)
         self.assertEqual(cache.get("addkey1"), "value")
 
+    def test_client_is_shared(self):
+        # backends for the same hosts share one connected client
+        cache = AerospikeCache('127.0.0.1:3000', {})
+        self.assertTrue(cache._client is self.cache._client)
+        cache.close()
+        self.cache.set("shared", "value")
+        self.assertEqual(cache.get("shared"), "value")
+
+    def test_multiple_seed_hosts(self):
+        # LOCATION can list several seed nodes, the port defaults to 3000
+        cache = AerospikeCache('127.0.0.1:3000;localhost', {})
+        self.assertEqual(cache.hosts, [('127.0.0.1', 3000), ('localhost', 3000)])
+        cache = AerospikeCache(['127.0.0.1:3000', 'localhost:3000'], {
+            'OPTIONS': {'TOTAL_TIMEOUT': 500, 'MAX_RETRIES': 2}})
+        self.assertEqual(cache._config['policies']['read'],
+                         {'total_timeout': 500, 'max_retries': 2})
+        cache.set("seeds", "value")
+        self.assertEqual(cache.get("seeds"), "value")
+
     def test_float_caching(self):
         self.cache.set('a', 1.1)
         a = self.cache.get('a')
@@ -294,6 +909,24 @@ class AeroCacheTests(TestCase):
         self.cache.set('a', 'a')
         self.assertTrue(self.cache.has_key('a'))
 
+    def test_near_cache(self):
+        # reads are served from the near cache, local writes invalidate it
+        cache = AerospikeCache('127.0.0.1:3000', {
+            'OPTIONS': {'NEAR_CACHE_SIZE': 10, 'NEAR_CACHE_TTL': 60}})
+        cache.set('near', [1, 2])
+        self.assertEqual(cache.get('near'), [1, 2])
+        self.assertEqual(cache.get('near'), [1, 2])
+        self.assertEqual(cache.get_many(['near']), {'near': [1, 2]})
+        self.assertTrue(cache.has_key('near'))
+        self.assertEqual(cache.near_cache.stats()['hits'], 3)
+        # the cached list is not shared with callers
+        cache.get('near').append(3)
+        self.assertEqual(cache.get('near'), [1, 2])
+        cache.set('near', 'changed')
+        self.assertEqual(cache.get('near'), 'changed')
+        cache.delete('near')
+        self.assertEqual(cache.get('near'), None)
+
     def test_session_store_read_using_cache(self):
         #pre-requisite - set session store to point to store
         from django.contrib.sessions.backends.db import SessionStore